@@ -2,7 +2,10 @@
 
 from __future__ import unicode_literals
 
+from functools import partial
+
 from django.core.exceptions import PermissionDenied
+from django.core.paginator import InvalidPage, Paginator
 from django.core.urlresolvers import reverse, NoReverseMatch
 from django.contrib import messages
 try:
@@ -14,6 +17,7 @@ except ImportError:
         warnings.simplefilter("ignore", DeprecationWarning)
         from django.contrib.admin.util import unquote
 from django.contrib.admin.templatetags.admin_urls import add_preserved_filters
+from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
@@ -26,15 +30,21 @@ from reversion.models import Version
 from reversion.admin import VersionAdmin
 
 from .core import create_revision
+from .delta import get_revision_versions
+from .deferred import defer_revision
 from .forms import RecoverObjectWithTranslationForm
+from .instrumentation import instrument
+from .plan import get_restore_plan
+from .restore import restore_versions
 from .utils import (
-    get_conflict_fks_versions, build_obj_repr,
-    get_deleted_placeholders_for_object, object_is_translation,
-    get_translation_info_message, RecursiveRevisionConflictResolver,
+    build_obj_repr, get_revision_summary,
+    object_is_translation,
+    get_translation_info_message,
     object_is_reversion_ready,
     object_has_placeholders,
     sync_placeholder_version_plugins,
 )
+from .version_cache import get_object_version
 
 REVERSION_1_9_OR_HIGHER = REVERSION_VERSION >= (1, 9)
 
@@ -42,6 +52,15 @@ REVERSION_1_9_OR_HIGHER = REVERSION_VERSION >= (1, 9)
 class VersionedPlaceholderAdminMixin(PlaceholderAdminMixin, VersionAdmin):
     revision_confirmation_template = 'aldryn_reversion/confirm_reversion.html'
     recover_confirmation_template = 'aldryn_reversion/confirm_recover.html'
+    # If True, revisions for plugin changes are created after the request
+    # transaction commits, in a worker pool, instead of during the request.
+    defer_plugin_revisions = False
+    # Time window (seconds or timedelta) in which successive plugin changes
+    # of the same user on the same object are coalesced into one revision.
+    plugin_revisions_coalesce_window = None
+    # Number of versions listed on revision and recover confirmation pages,
+    # larger revisions list versions of one model per page on request.
+    revision_confirmation_page_size = 100
 
     def add_plugin(self, request):
         with transaction.atomic():
@@ -94,12 +113,21 @@ class VersionedPlaceholderAdminMixin(PlaceholderAdminMixin, VersionAdmin):
         if not obj_from_target and not obj_from_source:
             return
 
-        if obj_from_target and object_is_reversion_ready(obj_from_target):
-            create_revision(obj_from_target, user=user, comment=comment)
+        if self.defer_plugin_revisions:
+            revise = defer_revision
+        else:
+            revise = create_revision
+
+        revise = partial(revise, user=user, comment=comment,
+                         coalesce_window=self.plugin_revisions_coalesce_window)
 
-        if (obj_from_source and obj_from_source != obj_from_target and
-                object_is_reversion_ready(obj_from_source)):
-            create_revision(obj_from_source, user=user, comment=comment)
+        with instrument('_create_aldryn_revision', obj_from_target):
+            if obj_from_target and object_is_reversion_ready(obj_from_target):
+                revise(obj_from_target)
+
+            if (obj_from_source and obj_from_source != obj_from_target and
+                    object_is_reversion_ready(obj_from_source)):
+                revise(obj_from_source)
 
     def _get_placeholder_attached_object(self, placeholder):
         objs = placeholder._get_attached_objects()
@@ -246,6 +274,74 @@ class VersionedPlaceholderAdminMixin(PlaceholderAdminMixin, VersionAdmin):
                 'lang_code': obj.language_code.upper()}
         self.log_change(request, obj.master, message, deletion=True)
 
+    def get_version_groups(self, request, revision, notes=None):
+        """
+        Returns a list of dicts describing versions of revision grouped by
+        model (content_type, count, expanded, versions, page and the urls
+        which show the group and its previous and next pages). Versions are
+        listed for all groups of small revisions, otherwise only for the
+        group requested with the content_type GET parameter, paginated.
+        notes maps version pks to a note shown next to the version.
+        """
+        def get_url(content_type, page=None):
+            # keeps _changelist_filters and other parameters
+            query = request.GET.copy()
+            query['content_type'] = content_type.pk
+            if page is None:
+                query.pop('page', None)
+            else:
+                query['page'] = page
+            return '?{0}'.format(query.urlencode())
+
+        groups = [{'content_type': content_type, 'count': count,
+                   'expanded': False, 'versions': [], 'page': None,
+                   'url': get_url(content_type),
+                   'previous_url': None, 'next_url': None}
+                  for content_type, count in get_revision_summary(revision)]
+        total = sum(group['count'] for group in groups)
+        queryset = revision.version_set.order_by('object_id_int', 'pk')
+        notes = notes or {}
+
+        if total <= self.revision_confirmation_page_size:
+            by_content_type = dict(
+                (group['content_type'].pk, group) for group in groups)
+            for group in groups:
+                group['expanded'] = True
+            for version in queryset:
+                group = by_content_type[version.content_type_id]
+                version.content_type = group['content_type']
+                version.note = notes.get(version.pk)
+                group['versions'].append(version)
+            return groups
+
+        try:
+            content_type_id = int(request.GET.get('content_type'))
+        except (TypeError, ValueError):
+            return groups
+        for group in groups:
+            if group['content_type'].pk != content_type_id:
+                continue
+            paginator = Paginator(
+                queryset.filter(content_type_id=content_type_id),
+                self.revision_confirmation_page_size)
+            try:
+                page = paginator.page(request.GET.get('page', 1))
+            except InvalidPage:
+                page = paginator.page(1)
+            group['expanded'] = True
+            group['page'] = page
+            group['versions'] = list(page.object_list)
+            for version in group['versions']:
+                version.content_type = group['content_type']
+                version.note = notes.get(version.pk)
+            if page.has_previous():
+                group['previous_url'] = get_url(
+                    group['content_type'], page.previous_page_number())
+            if page.has_next():
+                group['next_url'] = get_url(
+                    group['content_type'], page.next_page_number())
+        return groups
+
     @transaction.atomic
     def revision_view(self, request, object_id, version_id,
                       extra_context=None):
@@ -258,10 +354,13 @@ class VersionedPlaceholderAdminMixin(PlaceholderAdminMixin, VersionAdmin):
         revision = version.revision
 
         if request.method == "POST":
-            revision.revert()
+            # only write rows which differ from the revision
+            versions = get_revision_versions(revision)
+            restore_versions(versions, skip_unchanged=True)
 
             if object_has_placeholders(obj):
-                sync_placeholder_version_plugins(obj, version)
+                sync_placeholder_version_plugins(
+                    obj, version, versions=versions)
             opts = self.model._meta
             pk_value = obj._get_pk_val()
             preserved_filters = self.get_preserved_filters(request)
@@ -289,8 +388,7 @@ class VersionedPlaceholderAdminMixin(PlaceholderAdminMixin, VersionAdmin):
                 'version': version,
                 'revision': revision,
                 'revision_date': revision.date_created,
-                'versions': revision.version_set.order_by(
-                    'content_type__model', 'object_id_int').all,
+                'version_groups': self.get_version_groups(request, revision),
                 'object_name': force_text(self.model._meta.verbose_name),
                 'app_label': self.model._meta.app_label,
                 'opts': self.model._meta,
@@ -308,51 +406,64 @@ class VersionedPlaceholderAdminMixin(PlaceholderAdminMixin, VersionAdmin):
             }
             return render(request, self.revision_confirmation_template, context)
 
+    def get_conflict_recover_link(self, version):
+        """
+        Returns the url of the recover view of a conflict version, or None if
+        it can not be recovered by the user.
+        """
+        try:
+            return reverse(
+                'admin:{0}_{1}_recover'.format(
+                    self.model._meta.app_label,
+                    ContentType.objects.get_for_id(
+                        version.content_type_id).model),
+                args=[version.pk])
+        except NoReverseMatch:
+            # if there is exception either model is not registered
+            # with VersionedPlaceholderAdminMixin or there is no admin
+            # for that model. In both cases we need to revert this object
+            # to avoid conflicts / integrity errors
+            return None
+
     @transaction.atomic
     def recover_view(self, request, version_id, extra_context=None):
         if not self.has_change_permission(request):
             raise PermissionDenied()
 
-        version = get_object_or_404(Version, pk=unquote(version_id))
-        obj = version.object_version.object
+        version = get_object_or_404(
+            Version.objects.select_related('revision'),
+            pk=unquote(version_id))
+        obj = get_object_version(version).object
         revision = version.revision
 
-        # check for conflicts, it is better that user would solve them
-        conflict_fks_versions = get_conflict_fks_versions(
-            obj, version, revision)
-
-        # build urls to point user onto restore links for conflicts
-        opts = self.model._meta
-        non_reversible_by_user = []
-        conflicts_links_to_restore = []
-        for fk_version in conflict_fks_versions:
-            # try to point user to conflict recover views
-            try:
-                link = reverse(
-                    'admin:{0}_{1}_recover'.format(
-                        opts.app_label,
-                        fk_version.object_version.object._meta.model_name),
-                    args=[fk_version.pk])
-                link_dict = {
-                    'version': fk_version,
-                    'link': link
-                }
-            except NoReverseMatch:
-                # if there is exception either model is not registered
-                # with VersionedPlaceholderAdminMixin or there is no admin
-                # for that model. In both cases we need to revert this object
-                # to avoid conflicts / integrity errors
-                non_reversible_by_user.append(fk_version)
-            else:
-                conflicts_links_to_restore.append(link_dict)
-
-        # check if we need to restore placeholder fields
-        object_placeholders = get_deleted_placeholders_for_object(obj, revision)
-        # if there are conflicts that cannot be resolved manually by the user
-        # rely on resolver.
-        if len(non_reversible_by_user) > 0:
-            non_reversible_by_user = RecursiveRevisionConflictResolver(
-                non_reversible_by_user[0], non_reversible_by_user[1:]).resolve()
+        # conflicts, deleted placeholders and the resolver output are computed
+        # once, and reused by the confirmation POST and the form
+        plan = get_restore_plan(
+            version, self.get_conflict_recover_link,
+            namespace='{0}:{1}.{2}'.format(
+                self.admin_site.name, self.model._meta.app_label,
+                self.model._meta.model_name))
+
+        # it is better that user would solve conflicts, point user onto
+        # restore links for them
+        conflicts_links_to_restore = [
+            {'version': fk_version, 'link': link}
+            for fk_version, (_, link) in zip(
+                plan.get_versions(
+                    [pk for pk, _ in plan.conflict_links]),
+                plan.conflict_links)]
+        # conflicts that cannot be resolved manually by the user are resolved
+        # by the resolver
+        non_reversible_by_user = plan.get_versions(plan.resolved_pks)
+        # placeholder fields which need to be restored
+        object_placeholders = plan.get_versions(plan.placeholder_pks)
+
+        # marked in the listing of the revision's objects
+        notes = dict(
+            [(pk, _('will be recovered automatically'))
+             for pk in plan.resolved_pks] +
+            [(pk, _('deleted, will be restored'))
+             for pk in plan.placeholder_pks])
 
         # prepare form kwargs
         restore_form_kwargs = {
@@ -360,7 +471,8 @@ class VersionedPlaceholderAdminMixin(PlaceholderAdminMixin, VersionAdmin):
             'obj': obj,
             'version': version,
             'resolve_conflicts': non_reversible_by_user,
-            'placeholders': object_placeholders
+            'placeholders': object_placeholders,
+            'plan': plan,
         }
 
         if request.method == "POST":
@@ -407,8 +519,8 @@ class VersionedPlaceholderAdminMixin(PlaceholderAdminMixin, VersionAdmin):
             'conflict_links': conflicts_links_to_restore,
             'non_resolvable_conflicts': non_reversible_by_user,
             'placeholders_to_restore': object_placeholders,
-            'versions': revision.version_set.order_by(
-                'content_type__name', 'object_id_int').all,
+            'version_groups': self.get_version_groups(
+                request, revision, notes),
             'object_name': force_text(self.model._meta.verbose_name),
             'app_label': self.model._meta.app_label,
             'opts': self.model._meta,
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming export and import of revision history as JSON Lines.
+
+Every line holds one revision with all of its versions, so placeholders,
+plugins and translations stay grouped as they were captured. Revisions are
+read in chunks of ids with iterator based querysets, which keeps memory use
+independent of the size of the history.
+
+Content types are written as natural keys and users as usernames. Delta
+manifests (see aldryn_reversion.delta) and references (see
+aldryn_reversion.dedupe) point to earlier revisions of the same object, they
+are written with the creation date of that revision, and mapped to the
+imported revision or version of the same object and date on import. This
+requires that the referenced revisions are imported first (as they are by
+importing a whole export), but no map of all imported ids.
+"""
+from __future__ import unicode_literals
+
+import json
+from collections import defaultdict
+from itertools import groupby, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Q, Value, When
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_text
+
+from reversion.models import Revision, Version
+
+from .formats import DELTA_FORMAT, REFERENCE_FORMAT, SNAPSHOT_FORMAT
+from .formats.delta import loads
+from .utils import chunks
+
+
+def _get_natural_key(content_type_id):
+    return list(ContentType.objects.get_for_id(content_type_id).natural_key())
+
+
+def _get_content_type_id(natural_key):
+    try:
+        return ContentType.objects.get_by_natural_key(*natural_key).pk
+    except ContentType.DoesNotExist:
+        raise ValueError('Unknown content type {0}.'.format(
+            '.'.join(natural_key)))
+
+
+def _convert_serialized_data(format, serialized_data, convert_content_type,
+                             convert_reference=None, convert_manifest=None):
+    """
+    Converts content type ids in payloads of aldryn_reversion formats with
+    convert_content_type. Data of references and manifests of delta encoded
+    versions are passed to convert_reference and convert_manifest, which
+    update them.
+    """
+    if format not in (DELTA_FORMAT, SNAPSHOT_FORMAT, REFERENCE_FORMAT):
+        return serialized_data
+    data = loads(serialized_data)
+    if isinstance(data, list):
+        # regular json
+        return serialized_data
+
+    if format == REFERENCE_FORMAT:
+        if convert_reference is None:
+            return serialized_data
+        convert_reference(data)
+        return json.dumps(data)
+
+    if format == SNAPSHOT_FORMAT:
+        data['plugins'] = [
+            [convert_content_type(plugin[0])] + plugin[1:]
+            for plugin in data['plugins']]
+        return json.dumps(data, separators=(',', ':'))
+
+    manifest = data['manifest']
+    manifest['plugins'] = [
+        [convert_content_type(content_type), object_id]
+        for content_type, object_id in manifest['plugins']]
+    content_type, object_id = manifest['owner']
+    manifest['owner'] = [convert_content_type(content_type), object_id]
+    if manifest['base'] is not None and convert_manifest is not None:
+        convert_manifest(manifest)
+    return json.dumps(data)
+
+
+def get_history_versions(models=(), objects=()):
+    """
+    Returns a queryset of versions of given models and objects.
+    """
+    query = Q(pk__in=[])
+    for model in models:
+        query |= Q(content_type=ContentType.objects.get_for_model(model))
+    object_ids = defaultdict(list)
+    for obj in objects:
+        object_ids[ContentType.objects.get_for_model(obj)].append(
+            force_text(obj.pk))
+    for content_type, ids in object_ids.items():
+        query |= Q(content_type=content_type, object_id__in=ids)
+    return Version.objects.filter(query)
+
+
+def get_revision_id_chunks(versions, chunk_size=500):
+    """
+    Yields lists of at most chunk_size ids of revisions of given versions,
+    in order.
+    """
+    revision_ids = versions.order_by(
+        'revision_id').values_list('revision_id', flat=True).distinct()
+    last_id = None
+    while True:
+        chunk = revision_ids
+        if last_id is not None:
+            chunk = revision_ids.filter(revision_id__gt=last_id)
+        ids = list(chunk[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def _get_usernames(user_ids):
+    user_model = get_user_model()
+    return dict(user_model._default_manager.filter(
+        pk__in=user_ids,
+    ).values_list('pk', user_model.USERNAME_FIELD))
+
+
+def _get_link_dates(revision_ids):
+    """
+    Returns a tuple of dicts ({revision id: date created} of revisions which
+    delta encoded versions of given revisions are based on, {version id:
+    date created of its revision} of versions which their references point
+    to).
+    """
+    base_ids = set()
+    ref_ids = set()
+    versions = Version.objects.filter(
+        revision_id__in=revision_ids,
+        format__in=(DELTA_FORMAT, REFERENCE_FORMAT),
+    ).values_list('format', 'serialized_data')
+    for format, serialized_data in versions.iterator():
+        data = loads(serialized_data)
+        if isinstance(data, list):
+            continue
+        if format == REFERENCE_FORMAT:
+            ref_ids.add(data['ref'])
+        elif data['manifest']['base'] is not None:
+            base_ids.add(data['manifest']['base'])
+
+    base_dates = {}
+    for base_ids_chunk in chunks(base_ids):
+        base_dates.update(Revision.objects.filter(
+            pk__in=base_ids_chunk).values_list('pk', 'date_created'))
+    ref_dates = {}
+    for ref_ids_chunk in chunks(ref_ids):
+        ref_dates.update(Version.objects.filter(
+            pk__in=ref_ids_chunk,
+        ).values_list('pk', 'revision__date_created'))
+    return base_dates, ref_dates
+
+
+def iter_history(revision_ids):
+    """
+    Yields exported revisions (as dicts) with given ids, in order.
+    """
+    revisions = list(Revision.objects.filter(pk__in=revision_ids).order_by(
+        'pk').values_list(
+            'pk', 'date_created', 'user_id', 'comment', 'manager_slug'))
+    usernames = _get_usernames(
+        set(revision[2] for revision in revisions if revision[2]))
+    base_dates, ref_dates = _get_link_dates(revision_ids)
+
+    def get_date(dates, pk):
+        # None if the revision does not exist (anymore)
+        return dates[pk].isoformat() if pk in dates else None
+
+    def add_reference_date(data):
+        data['date'] = get_date(ref_dates, data['ref'])
+
+    def add_base_date(manifest):
+        manifest['base_date'] = get_date(base_dates, manifest['base'])
+
+    versions = Version.objects.filter(revision_id__in=revision_ids).order_by(
+        'revision_id', 'pk').values_list(
+            'revision_id', 'pk', 'content_type_id', 'object_id',
+            'object_id_int', 'format', 'serialized_data', 'object_repr')
+    grouped = groupby(versions.iterator(), key=lambda version: version[0])
+    grouped_revision_id, revision_versions = next(grouped, (None, ()))
+
+    for pk, date_created, user_id, comment, manager_slug in revisions:
+        exported_versions = []
+        if grouped_revision_id == pk:
+            for (_, version_pk, content_type_id, object_id, object_id_int,
+                    format, serialized_data, object_repr) in revision_versions:
+                exported_versions.append({
+                    'id': version_pk,
+                    'content_type': _get_natural_key(content_type_id),
+                    'object_id': object_id,
+                    'object_id_int': object_id_int,
+                    'format': format,
+                    'serialized_data': _convert_serialized_data(
+                        format, serialized_data, _get_natural_key,
+                        add_reference_date, add_base_date),
+                    'object_repr': object_repr,
+                })
+            grouped_revision_id, revision_versions = next(
+                grouped, (None, ()))
+        yield {
+            'id': pk,
+            'date_created': date_created.isoformat(),
+            'user': usernames.get(user_id),
+            'comment': comment,
+            'manager_slug': manager_slug,
+            'versions': exported_versions,
+        }
+
+
+def export_history(stream, models=(), objects=(), chunk_size=500,
+                   progress=None):
+    """
+    Writes the whole history of given models and objects to stream (a text
+    stream) as JSON Lines, one revision per line, reading chunk_size
+    revisions at a time. progress is called with (number of exported
+    revisions, total) after every chunk. Returns the number of exported
+    revisions.
+    """
+    versions = get_history_versions(models, objects)
+    total = versions.values('revision_id').distinct().count()
+    exported = 0
+    for revision_ids in get_revision_id_chunks(versions, chunk_size):
+        for revision in iter_history(revision_ids):
+            stream.write(
+                force_text(json.dumps(revision, sort_keys=True)) + '\n')
+        exported += len(revision_ids)
+        if progress is not None:
+            progress(exported, total)
+    return exported
+
+
+def _get_user_ids(usernames):
+    user_model = get_user_model()
+    return dict(user_model._default_manager.filter(**{
+        '{0}__in'.format(user_model.USERNAME_FIELD): usernames,
+    }).values_list(user_model.USERNAME_FIELD, 'pk'))
+
+
+def _get_link_key(content_type_id, object_id, date):
+    if date is None:
+        return None
+    return (content_type_id, force_text(object_id), parse_datetime(date))
+
+
+def _find_linked_versions(keys):
+    """
+    Returns a dict of {(content type id, object id, date created): (revision
+    id, version id)} of the latest versions which are not references for
+    given keys, in one query per chunk of keys.
+    """
+    found = {}
+    for keys_chunk in chunks(keys):
+        versions = Version.objects.filter(
+            content_type_id__in=set(key[0] for key in keys_chunk),
+            object_id__in=set(key[1] for key in keys_chunk),
+            revision__date_created__in=set(key[2] for key in keys_chunk),
+        ).exclude(
+            format=REFERENCE_FORMAT,
+        ).order_by('revision_id').values_list(
+            'content_type_id', 'object_id', 'revision__date_created',
+            'revision_id', 'pk')
+        for content_type_id, object_id, date, revision_id, pk in versions:
+            found[(content_type_id, object_id, date)] = (revision_id, pk)
+    return found
+
+
+def _import_revisions(revisions):
+    user_ids = _get_user_ids(
+        set(revision['user'] for revision in revisions if revision['user']))
+
+    # maps of exported to imported ids of this chunk, links to earlier
+    # chunks are looked up in the database
+    revision_ids = {}
+    version_ids = {}
+    created = []
+    for revision in revisions:
+        instance = Revision.objects.create(
+            manager_slug=revision['manager_slug'],
+            user_id=user_ids.get(revision['user']),
+            comment=revision['comment'],
+        )
+        revision_ids[revision['id']] = instance.pk
+        created.append((instance.pk, revision))
+
+    # date_created is set on insert, restore the exported dates at once
+    Revision.objects.filter(pk__in=[pk for pk, _ in created]).update(
+        date_created=Case(
+            *[When(pk=pk, then=Value(
+                parse_datetime(revision['date_created'])))
+              for pk, revision in created],
+            output_field=DateTimeField()))
+
+    versions = [
+        (pk, version, _get_content_type_id(version['content_type']))
+        for pk, revision in created for version in revision['versions']]
+
+    def get_links(format):
+        for pk, version, content_type_id in versions:
+            if version['format'] != format:
+                continue
+            data = loads(version['serialized_data'])
+            if isinstance(data, list):
+                continue
+            if format == REFERENCE_FORMAT:
+                if data['ref'] not in version_ids:
+                    yield data['ref'], _get_link_key(
+                        content_type_id, version['object_id'],
+                        data.get('date'))
+            else:
+                manifest = data['manifest']
+                if (manifest['base'] is not None and
+                        manifest['base'] not in revision_ids):
+                    owner_content_type, owner_id = manifest['owner']
+                    yield manifest['base'], _get_link_key(
+                        _get_content_type_id(owner_content_type), owner_id,
+                        manifest.get('base_date'))
+
+    def get_linked(format):
+        links = dict(get_links(format))
+        found = _find_linked_versions(
+            set(key for key in links.values() if key is not None))
+        return dict((exported_id, found[key])
+                    for exported_id, key in links.items() if key in found)
+
+    linked_revisions = get_linked(DELTA_FORMAT)
+
+    def convert_manifest(manifest):
+        if manifest['base'] in revision_ids:
+            manifest['base'] = revision_ids[manifest['base']]
+        elif manifest['base'] in linked_revisions:
+            manifest['base'] = linked_revisions[manifest['base']][0]
+        else:
+            raise ValueError('Base revision {0} was not imported.'.format(
+                manifest['base']))
+        manifest.pop('base_date', None)
+
+    def convert_reference(data):
+        if data['ref'] in version_ids:
+            data['ref'] = version_ids[data['ref']]
+        elif data['ref'] in linked_versions:
+            data['ref'] = linked_versions[data['ref']][1]
+        else:
+            raise ValueError(
+                'Referenced version {0} was not imported.'.format(
+                    data['ref']))
+        data.pop('date', None)
+
+    def get_versions(references):
+        return [
+            Version(
+                revision_id=pk,
+                content_type_id=content_type_id,
+                object_id=version['object_id'],
+                object_id_int=version['object_id_int'],
+                format=version['format'],
+                serialized_data=_convert_serialized_data(
+                    version['format'], version['serialized_data'],
+                    _get_content_type_id, convert_reference,
+                    convert_manifest),
+                object_repr=version['object_repr'],
+            )
+            for pk, version, content_type_id in versions
+            if (version['format'] == REFERENCE_FORMAT) == references]
+
+    # references always point to payloads, which have to be created first
+    Version.objects.bulk_create(get_versions(references=False))
+    keys = dict(
+        ((pk, content_type_id, version['object_id']), version['id'])
+        for pk, version, content_type_id in versions)
+    for key in Version.objects.filter(
+            revision_id__in=[pk for pk, _ in created],
+    ).values_list('revision_id', 'content_type_id', 'object_id', 'pk'):
+        version_ids[keys[key[:3]]] = key[3]
+    linked_versions = get_linked(REFERENCE_FORMAT)
+    Version.objects.bulk_create(get_versions(references=True))
+
+
+def import_history(lines, chunk_size=100, progress=None):
+    """
+    Imports revisions exported by export_history from an iterable of lines,
+    creating chunk_size revisions and their versions at a time, every chunk
+    in its own transaction. progress is called with the number of imported
+    revisions after every chunk. Returns the number of imported revisions.
+    """
+    imported = 0
+    lines = (line for line in lines if line.strip())
+    while True:
+        revisions = [json.loads(line) for line in islice(lines, chunk_size)]
+        if not revisions:
+            return imported
+        with transaction.atomic():
+            _import_revisions(revisions)
+        imported += len(revisions)
+        if progress is not None:
+            progress(imported)
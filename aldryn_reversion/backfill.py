@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Backfill of initial revisions for objects of models which were registered
+with version_controlled_content after they had been created.
+
+Objects are processed in chunks of primary keys, optionally spread across a
+process pool, every worker with its own database connection. Objects which
+already have a revision are skipped, so an interrupted backfill can be
+resumed by running it again.
+"""
+from __future__ import unicode_literals
+
+import multiprocessing
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.utils.encoding import force_text
+
+from reversion.models import Version
+
+from .core import create_revision
+
+BACKFILL_COMMENT = 'Initial version.'
+
+
+def get_pks_without_revisions(model, pks):
+    """
+    Returns those of given primary keys of model, which objects have no
+    versions yet.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    existing = set(Version.objects.filter(
+        content_type=content_type,
+        object_id__in=[force_text(pk) for pk in pks],
+    ).values_list('object_id', flat=True))
+    return [pk for pk in pks if force_text(pk) not in existing]
+
+
+def backfill_objects(model, pks, comment=BACKFILL_COMMENT):
+    """
+    Creates initial revisions, including placeholders, plugins and
+    translations, for objects of model with given primary keys, which have
+    no revisions yet. Returns the number of created revisions.
+    """
+    pks = get_pks_without_revisions(model, pks)
+    count = 0
+    for obj in model._default_manager.filter(pk__in=pks).order_by('pk'):
+        create_revision(obj, comment=comment)
+        count += 1
+    return count
+
+
+def get_pk_chunks(model, chunk_size=500):
+    """
+    Yields lists of at most chunk_size primary keys of model, in order.
+    """
+    queryset = model._default_manager.order_by('pk')
+    last_pk = None
+    while True:
+        chunk_queryset = queryset
+        if last_pk is not None:
+            chunk_queryset = queryset.filter(pk__gt=last_pk)
+        pks = list(chunk_queryset.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+def _init_worker():
+    import django
+    if not apps.ready:
+        django.setup()
+
+
+def _backfill_chunk(args):
+    model_label, pks, comment = args
+    return len(pks), backfill_objects(
+        apps.get_model(model_label), pks, comment)
+
+
+def backfill(model, chunk_size=500, workers=None, comment=BACKFILL_COMMENT,
+             progress=None):
+    """
+    Creates initial revisions for all objects of model which have none, in
+    chunks of chunk_size objects. If workers is given, chunks are processed
+    by a pool of that many processes. progress is called with (number of
+    processed objects, total) after every chunk. Returns the number of
+    created revisions.
+    """
+    total = model._default_manager.count()
+    model_label = '{0}.{1}'.format(
+        model._meta.app_label, model._meta.object_name)
+    tasks = ((model_label, pks, comment)
+             for pks in get_pk_chunks(model, chunk_size))
+
+    if workers:
+        # workers must not share the connections of this process
+        connections.close_all()
+        pool = multiprocessing.Pool(workers, initializer=_init_worker)
+        results = pool.imap_unordered(_backfill_chunk, tasks)
+    else:
+        pool = None
+        results = (_backfill_chunk(task) for task in tasks)
+
+    processed = created = 0
+    try:
+        for chunk_processed, chunk_created in results:
+            processed += chunk_processed
+            created += chunk_created
+            if progress is not None:
+                progress(processed, total)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return created
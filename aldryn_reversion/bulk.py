@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk revision writer. Serializes all objects of one model in a single
+serializer pass and saves the versions of a revision with one bulk insert.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.db import transaction
+from django.utils import six
+from django.utils.encoding import force_text
+
+from reversion.models import Revision, Version, has_int_pk
+from reversion.revisions import default_revision_manager, VersionAdapter
+from reversion.signals import pre_revision_commit, post_revision_commit
+
+
+class BulkSerializerMixin(object):
+    """
+    Serializes a sequence of objects in one pass, but keeps the output of
+    every object separate, exactly as if it was serialized on its own.
+    """
+
+    def serialize_each(self, objects, **options):
+        self.results = []
+        self.serialize(objects, **options)
+        return self.results
+
+    def start_object(self, obj):
+        self.stream = six.StringIO()
+        self.first = True
+        self.start_serialization()
+        super(BulkSerializerMixin, self).start_object(obj)
+
+    def end_object(self, obj):
+        super(BulkSerializerMixin, self).end_object(obj)
+        self.end_serialization()
+        self.results.append(self.getvalue())
+
+
+_bulk_serializers = {}
+
+
+def get_bulk_serializer(format):
+    """
+    Returns a bulk serializer class for the given serialization format.
+    """
+    if format not in _bulk_serializers:
+        serializer_class = serializers.get_serializer(format)
+        _bulk_serializers[format] = type(
+            str('Bulk{0}'.format(serializer_class.__name__)),
+            (BulkSerializerMixin, serializer_class), {})
+    return _bulk_serializers[format]
+
+
+def _supports_bulk_serialization(adapter):
+    """
+    Returns True if adapter uses the default version data, so that it is
+    safe to build the version data in bulk.
+    """
+    adapter_cls = type(adapter)
+    return (
+        adapter_cls.get_version_data == VersionAdapter.get_version_data and
+        adapter_cls.get_serialized_data == VersionAdapter.get_serialized_data)
+
+
+def get_versions_data(objects, manager=None, db=None):
+    """
+    Returns an ordered dict of {obj: version data} for given objects,
+    serializing all objects of the same model in one serializer pass.
+    """
+    if manager is None:
+        manager = default_revision_manager
+
+    objects_by_model = OrderedDict()
+    for obj in objects:
+        objects_by_model.setdefault(obj.__class__, []).append(obj)
+
+    versions_data = OrderedDict()
+    for model, model_objects in objects_by_model.items():
+        adapter = manager.get_adapter(model)
+
+        if not _supports_bulk_serialization(adapter):
+            for obj in model_objects:
+                versions_data[obj] = adapter.get_version_data(obj, db)
+            continue
+
+        serialization_format = adapter.get_serialization_format()
+        serialized_data = get_bulk_serializer(
+            serialization_format)().serialize_each(
+            model_objects, fields=list(adapter.get_fields_to_serialize()))
+        content_type = ContentType.objects.db_manager(db).get_for_model(model)
+        int_pk = has_int_pk(model)
+
+        for obj, data in zip(model_objects, serialized_data):
+            versions_data[obj] = {
+                'object_id': force_text(obj.pk),
+                'object_id_int': int(obj.pk) if int_pk else None,
+                'content_type': content_type,
+                'format': serialization_format,
+                'serialized_data': data,
+                'object_repr': force_text(obj),
+            }
+    return versions_data
+
+
+def get_revision_objects(objects, manager=None):
+    """
+    Returns a list of given objects and all objects they follow, without
+    duplicates and objects that are not saved. Explicitly given objects come
+    first and keep their order.
+    """
+    if manager is None:
+        manager = default_revision_manager
+
+    objects = [obj for obj in objects if obj.pk is not None]
+    ordered_objects = list(OrderedDict.fromkeys(objects))
+    seen = set(ordered_objects)
+    for obj in manager._follow_relationships(ordered_objects):
+        if obj not in seen:
+            seen.add(obj)
+            ordered_objects.append(obj)
+    return ordered_objects
+
+
+def save_revision(objects, manager=None, user=None, comment='', db=None,
+                  follow=True, versions_data=None):
+    """
+    Saves a new revision for the given objects and objects they follow.
+    Works like RevisionManager.save_revision, but serializes objects in bulk
+    and inserts all versions with one query. Pass follow=False if objects
+    were already prepared with get_revision_objects, or versions_data (as
+    returned by get_versions_data) to save prepared versions data instead of
+    objects.
+    """
+    if manager is None:
+        manager = default_revision_manager
+
+    if versions_data is None:
+        if follow:
+            objects = get_revision_objects(objects, manager)
+        versions_data = get_versions_data(objects, manager, db)
+    if not versions_data:
+        return
+
+    ordered_objects = list(versions_data.keys())
+    new_versions = [Version(**data) for data in versions_data.values()]
+
+    revision = Revision(
+        manager_slug=manager._manager_slug,
+        user=user,
+        comment=comment,
+    )
+    pre_revision_commit.send(
+        manager,
+        instances=ordered_objects,
+        revision=revision,
+        versions=new_versions,
+    )
+    with transaction.atomic(using=db):
+        revision.save(using=db)
+        for version in new_versions:
+            version.revision = revision
+        Version.objects.using(db).bulk_create(new_versions)
+
+    if any(version.pk is None for version in new_versions):
+        # Most of the backends do not set primary keys on bulk_create,
+        # receivers expect saved versions though.
+        new_versions = list(revision.version_set.using(db).order_by('pk'))
+
+    post_revision_commit.send(
+        manager,
+        instances=ordered_objects,
+        revision=revision,
+        versions=new_versions,
+    )
+    return revision
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed storage of versions.
+
+For models registered with compress_versions=True, versions of revisions of
+the object (the object, its translations, placeholders and plugins) are
+stored compressed with the preset dictionary of their model, if that makes
+them smaller (see aldryn_reversion.formats.compressed). Versions are
+compressed before they are delta encoded, put into snapshots or
+deduplicated, which compare compressed payloads: compression is
+deterministic. Revisions saved by django-reversion itself (i.e. by the admin
+within a revision context) are compressed when they are committed.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from reversion.revisions import default_revision_manager
+from reversion.signals import pre_revision_commit
+
+from .formats import COMPRESSED_FORMAT, FORMATS
+from .formats.compressed import dumps
+
+
+def uses_compression(model, manager=None):
+    """
+    Returns True if model is registered with compressed versions.
+    """
+    if manager is None:
+        manager = default_revision_manager
+    if not manager.is_registered(model):
+        return False
+    return getattr(manager.get_adapter(model), 'compress_versions', False)
+
+
+def get_compressed_versions_data(obj, versions_data, manager=None):
+    """
+    Returns versions data (as returned by bulk.get_versions_data) for a
+    revision of obj, where payloads are compressed, unless that would not
+    make them smaller.
+    Returns versions_data as is, if obj does not use compression.
+    """
+    if not uses_compression(obj.__class__, manager):
+        return versions_data
+
+    result = OrderedDict()
+    for item, data in versions_data.items():
+        result[item] = data
+        compressed = compress_version_data(
+            data['format'], data['serialized_data'], data['content_type'])
+        if compressed is not None:
+            result[item] = dict(
+                data,
+                format=COMPRESSED_FORMAT,
+                serialized_data=compressed,
+            )
+    return result
+
+
+def compress_version_data(format, serialized_data, content_type):
+    """
+    Returns compressed serialized data of a version of given content type,
+    or None if the version is stored in a format of aldryn-reversion or
+    would not get smaller.
+    """
+    if format in FORMATS:
+        return None
+    compressed = dumps(
+        serialized_data, format,
+        '{0}.{1}'.format(content_type.app_label, content_type.model))
+    if len(compressed) < len(serialized_data):
+        return compressed
+    return None
+
+
+def _compress_revision_versions(sender, instances, revision, versions,
+                                **kwargs):
+    for instance, version in zip(instances, versions):
+        # translations are compressed with their translated model
+        model = getattr(instance, 'shared_model', None) or instance.__class__
+        if not uses_compression(model, sender):
+            continue
+        compressed = compress_version_data(
+            version.format, version.serialized_data, version.content_type)
+        if compressed is not None:
+            version.format = COMPRESSED_FORMAT
+            version.serialized_data = compressed
+
+
+pre_revision_commit.connect(
+    _compress_revision_versions,
+    dispatch_uid='aldryn_reversion.compression.compress_revision_versions')
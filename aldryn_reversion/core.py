@@ -6,20 +6,33 @@ from __future__ import unicode_literals
 Support for django-reversion on models with translatable fields and django-cms
 placeholder fields.
 """
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
 from functools import partial
 
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.db.models.signals import post_save
+from django.utils import timezone
+from django.utils.encoding import force_text
 
 from cms.models.pluginmodel import CMSPlugin
+from cms.plugin_pool import plugin_pool
+from reversion.models import Revision
 from reversion.revisions import (
     default_revision_manager, revision_context_manager, VersionAdapter)
 
-# We would like this to not depend on Parler, but still support if it is
-# available.
-try:
-    from parler import cache
-except:
-    pass
+from .bulk import get_revision_objects, get_versions_data, save_revision
+from .compression import get_compressed_versions_data
+from .dedupe import get_deduplicated_versions_data
+from .delta import get_delta_versions_data
+from .formats import register_formats
+from .instrumentation import instrument
+from .snapshot import get_snapshot_versions_data
+from .metadata import register_model_metadata
+from .translation_cache import cache_translation
+
+register_formats()
 
 
 def _add_to_context(obj, manager=None, context=None):
@@ -32,52 +45,342 @@ def _add_to_context(obj, manager=None, context=None):
     adapter = manager.get_adapter(obj.__class__)
     version_data = adapter.get_version_data(obj)
     context.add_to_context(manager, obj, version_data)
+    return version_data
+
+
+def _get_object_key(obj):
+    return (ContentType.objects.get_for_model(obj).pk, force_text(obj.pk))
+
+
+def merge_comments(*comments):
+    """
+    Returns a comment which consists of all unique lines of given comments.
+    """
+    lines = []
+    for comment in comments:
+        for line in (comment or '').splitlines():
+            if line and line not in lines:
+                lines.append(line)
+    return '\n'.join(lines)
+
+
+def get_coalescible_revision(obj, objects, user=None, window=None):
+    """
+    Returns the latest revision of obj if it can be replaced by a revision
+    of given objects: it was created by the same user not longer than window
+    ago (timedelta or seconds), and it contains only given objects or
+    plugins. Returns None otherwise.
+    """
+    if window is None:
+        return None
+    if not isinstance(window, timedelta):
+        window = timedelta(seconds=window)
+
+    version = (default_revision_manager.get_for_object(obj)
+               .select_related('revision').first())
+    if version is None:
+        return None
+
+    revision = version.revision
+    user_id = user.pk if user is not None else None
+    if revision.user_id != user_id:
+        return None
+    if timezone.now() - revision.date_created > window:
+        return None
+
+    keys = set(_get_object_key(item) for item in objects)
+    previous_keys = revision.version_set.values_list(
+        'content_type_id', 'object_id')
+    for content_type_id, object_id in previous_keys:
+        if (content_type_id, object_id) in keys:
+            continue
+        # plugins which were deleted or moved away since then
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None or not issubclass(model, CMSPlugin):
+            return None
+    return revision
+
+
+class _ReplacedRevisionsManager(object):
+
+    def __init__(self, using=None):
+        self.using = using
+
+    def db_manager(self, using):
+        return _ReplacedRevisionsManager(using)
+
+    def create(self, revision, revision_ids):
+        # the saved revision may have been coalesced more than once
+        (Revision.objects.using(self.using)
+         .filter(pk__in=revision_ids).exclude(pk=revision.pk).delete())
+
+
+class ReplacedRevisions(object):
+    """
+    Revision meta (see revision_context_manager.add_meta) which deletes the
+    revisions with given revision_ids after the revision is saved, in its
+    transaction.
+    """
+    _default_manager = _ReplacedRevisionsManager()
+
 
+def _get_revision_objects(obj):
+    objects = [obj]
+    if hasattr(obj._meta, 'placeholder_field_names'):
+        objects.extend(get_placeholder_objects(obj))
+    return get_revision_objects(objects)
+
+
+def create_revision(obj, user=None, comment=None, coalesce_window=None):
+    """
+    Creates a revision for obj and its placeholders. If coalesce_window is
+    given, the latest revision of obj is replaced instead, if it was created
+    by the same user within that window (see get_coalescible_revision), and
+    the comments of both revisions are merged. Within an active revision
+    context the replaced revision is deleted when the context saves its
+    revision.
+    """
+    with instrument('create_revision', obj) as recorder:
+        return _create_revision(
+            obj, user, comment, coalesce_window, recorder)
+
+
+def _create_revision(obj, user, comment, coalesce_window, recorder):
+    if revision_context_manager.is_active():
+        # an outer revision will save the objects
+        with revision_context_manager.create_revision():
+            if user:
+                revision_context_manager.set_user(user)
+
+            previous_revision = None
+            if coalesce_window is not None:
+                previous_revision = get_coalescible_revision(
+                    obj, _get_revision_objects(obj),
+                    user=revision_context_manager.get_user(),
+                    window=coalesce_window)
+            if previous_revision is not None:
+                comment = merge_comments(previous_revision.comment, comment)
+                revision_context_manager.add_meta(
+                    ReplacedRevisions, revision_ids=[previous_revision.pk])
+            if comment:
+                revision_context_manager.set_comment(comment)
+
+            recorder.add_versions_data({obj: _add_to_context(obj)})
+
+            if hasattr(obj._meta, 'placeholder_field_names'):
+                defer_placeholders_capture(
+                    obj, replaced_revision=previous_revision)
+        return
+
+    objects = _get_revision_objects(obj)
+
+    previous_revision = get_coalescible_revision(
+        obj, objects, user=user, window=coalesce_window)
+    if previous_revision is not None:
+        comment = merge_comments(previous_revision.comment, comment)
+
+    # a delta to or a reference into the revision which is going to be
+    # replaced would be lost
+    versions_data = get_compressed_versions_data(
+        obj, get_versions_data(objects))
+    versions_data = get_delta_versions_data(
+        obj, versions_data, keyframe=previous_revision is not None)
+    versions_data = get_snapshot_versions_data(obj, versions_data)
+    versions_data = get_deduplicated_versions_data(
+        obj, versions_data, exclude_revision=previous_revision)
+
+    recorder.add_versions_data(versions_data)
+    with transaction.atomic():
+        revision = save_revision(
+            objects, user=user, comment=comment or '',
+            versions_data=versions_data)
+        if previous_revision is not None:
+            previous_revision.delete()
+    return revision
+
+
+def get_plugin_instances(plugins):
+    """
+    Returns a list of (plugin, plugin_instance) tuples for the given CMSPlugin
+    objects. Plugins are downcasted with one query per plugin type instead of
+    one query per plugin (as plugin.get_plugin_instance() would do).
+    plugin_instance is None if the plugin type is not available or the
+    concrete plugin row is missing.
+    """
+    plugin_models = []
+    plugin_ids_by_model = defaultdict(list)
+
+    for plugin in plugins:
+        try:
+            plugin_model = plugin_pool.get_plugin(plugin.plugin_type).model
+        except KeyError:
+            # plugin type is not registered (anymore)
+            plugin_model = None
+
+        if plugin_model is not None and plugin_model is not plugin.__class__:
+            plugin_ids_by_model[plugin_model].append(plugin.pk)
+        plugin_models.append((plugin, plugin_model))
+
+    instances = {}
+    for plugin_model, plugin_ids in plugin_ids_by_model.items():
+        for instance in plugin_model.objects.filter(pk__in=plugin_ids):
+            instances[(plugin_model, instance.pk)] = instance
+
+    result = []
+    for plugin, plugin_model in plugin_models:
+        if plugin_model is plugin.__class__:
+            plugin_instance = plugin
+        else:
+            plugin_instance = instances.get((plugin_model, plugin.pk))
+        result.append((plugin, plugin_instance))
+    return result
+
+
+def get_placeholder_objects(instance):
+    """
+    Returns a list of placeholders, plugins and plugin instances for the
+    placeholder fields of the given instance.
+    """
+    objects = [getattr(instance, name)
+               for name in instance._meta.placeholder_field_names]
 
-def create_revision(obj, user=None, comment=None):
-    with revision_context_manager.create_revision():
-        if user:
-            revision_context_manager.set_user(user)
-        if comment:
-            revision_context_manager.set_comment(comment)
+    ph_ids = [getattr(instance, '{0}_id'.format(name))
+              for name in instance._meta.placeholder_field_names]
 
-        _add_to_context(obj)
+    plugins = CMSPlugin.objects.filter(placeholder_id__in=ph_ids)
 
-        if hasattr(obj._meta, 'placeholder_field_names'):
-            add_placeholders_to_revision(instance=obj)
+    for plugin, plugin_instance in get_plugin_instances(plugins):
+        if plugin_instance:
+            objects.append(plugin_instance)
+        objects.append(plugin)
+    return objects
+
+
+def _get_placeholder_versions_data(instance, revision_manager, db,
+                                   replaced_revision=None):
+    # a delta to or a reference into the revision which is going to be
+    # replaced would be lost
+    versions_data = get_versions_data(
+        get_placeholder_objects(instance), revision_manager, db)
+    versions_data = get_compressed_versions_data(
+        instance, versions_data, revision_manager)
+    versions_data = get_delta_versions_data(
+        instance, versions_data, revision_manager,
+        keyframe=replaced_revision is not None)
+    versions_data = get_snapshot_versions_data(
+        instance, versions_data, revision_manager)
+    versions_data = get_deduplicated_versions_data(
+        instance, versions_data, revision_manager,
+        exclude_revision=replaced_revision)
+    return versions_data
 
 
 def add_placeholders_to_revision(
-        instance, revision_manager=None, rev_ctx=None):
+        instance, revision_manager=None, rev_ctx=None,
+        replaced_revision=None):
     """
     Manually add plugins to the revision.
 
     This function is an updated version of
     http://github.com/divio/django-cms/blob/develop/cms/utils/helpers.py#L34
     but instead of working on pages, works on models with placeholder
-    fields.
+    fields. Returns the versions data added to the revision. Pass
+    replaced_revision if the revision is going to replace it.
     """
 
-    add_to_context = partial(
-        _add_to_context,
-        manager=revision_manager,
-        context=rev_ctx,
-    )
+    if revision_manager is None:
+        revision_manager = default_revision_manager
 
-    # Add the placeholder to the revision
-    for name in instance._meta.placeholder_field_names:
-        add_to_context(getattr(instance, name))
+    if rev_ctx is None:
+        rev_ctx = default_revision_manager._revision_context_manager
 
-    # Add all plugins to the revision
-    ph_ids = [getattr(instance, '{0}_id'.format(name))
-              for name in instance._meta.placeholder_field_names]
+    with instrument('add_placeholders_to_revision', instance) as recorder:
+        # Add the placeholders, plugins and plugin instances to the revision
+        versions_data = _get_placeholder_versions_data(
+            instance, revision_manager, rev_ctx.get_db(), replaced_revision)
+        for obj, version_data in versions_data.items():
+            rev_ctx.add_to_context(revision_manager, obj, version_data)
+        recorder.add_versions_data(versions_data)
+    return versions_data
 
-    for plugin in CMSPlugin.objects.filter(placeholder_id__in=ph_ids):
-        plugin_instance, _ = plugin.get_plugin_instance()
 
-        if plugin_instance:
-            add_to_context(plugin_instance)
-        add_to_context(plugin)
+class PlaceholderCaptureContext(dict):
+    """
+    Objects of a revision context frame ({obj: version data}), which adds
+    the placeholders, plugins and plugin instances of owners registered with
+    add_owner when the revision is saved (reversion reads the objects of a
+    revision with items()). Every owner is captured once, however often it
+    was registered. Owners of nested frames are joined by update.
+    """
+
+    def __init__(self, revision_manager, objects=()):
+        super(PlaceholderCaptureContext, self).__init__(objects)
+        self.revision_manager = revision_manager
+        self.owners = OrderedDict()
+        # {owner key: revision the saved revision replaces}
+        self.replaced_revisions = {}
+
+    def add_owner(self, instance, replaced_revision=None):
+        key = (instance.__class__, instance.pk)
+        self.owners[key] = instance
+        if replaced_revision is not None:
+            self.replaced_revisions[key] = replaced_revision
+
+    def update(self, other=(), **kwargs):
+        super(PlaceholderCaptureContext, self).update(other, **kwargs)
+        self.owners.update(getattr(other, 'owners', {}))
+        self.replaced_revisions.update(
+            getattr(other, 'replaced_revisions', {}))
+
+    def capture(self):
+        owners, self.owners = self.owners, OrderedDict()
+        replaced_revisions, self.replaced_revisions = (
+            self.replaced_revisions, {})
+        db = self.revision_manager._revision_context_manager.get_db()
+        for key, instance in owners.items():
+            if instance.pk is None:
+                continue
+            with instrument('add_placeholders_to_revision',
+                            instance) as recorder:
+                versions_data = _get_placeholder_versions_data(
+                    instance, self.revision_manager, db,
+                    replaced_revisions.get(key))
+                self.update(versions_data)
+                recorder.add_versions_data(versions_data)
+
+    def items(self):
+        self.capture()
+        return super(PlaceholderCaptureContext, self).items()
+
+
+def defer_placeholders_capture(instance, revision_manager=None,
+                               rev_ctx=None, replaced_revision=None):
+    """
+    Adds the placeholders, plugins and plugin instances of instance to the
+    active revision when it is saved, once per revision, however often
+    instance is saved within it. Pass replaced_revision if the revision is
+    going to replace it.
+    """
+    if revision_manager is None:
+        revision_manager = default_revision_manager
+
+    if rev_ctx is None:
+        rev_ctx = revision_manager._revision_context_manager
+
+    stack = getattr(rev_ctx, '_stack', None)
+    if not stack:
+        # not a context of django-reversion 1.10, capture right away
+        add_placeholders_to_revision(
+            instance, revision_manager, rev_ctx, replaced_revision)
+        return
+
+    for frame in stack:
+        objects = frame.objects.get(revision_manager)
+        if not isinstance(objects, PlaceholderCaptureContext):
+            frame.objects[revision_manager] = PlaceholderCaptureContext(
+                revision_manager, objects or {})
+    stack[-1].objects[revision_manager].add_owner(
+        instance, replaced_revision)
 
 
 class TranslatableVersionAdapterMixin(object):
@@ -105,15 +408,27 @@ class TranslatableVersionAdapterMixin(object):
         """Update the translations cache when restoring from a revision."""
         if raw:
             # Raw is set to true (only) when restoring from fixtures or,
-            # django-reversion
-            cache._cache_translation(instance)
+            # django-reversion. Translations restored within
+            # batch_translation_cache() are cached at once at its end.
+            cache_translation(instance)
 
 
 class PlaceholderVersionAdapterMixin(object):
     follow_placeholders = True
+    # Store only added or changed plugins in revisions, with a full set of
+    # plugins every placeholder_keyframe_interval revisions.
+    placeholder_deltas = False
+    placeholder_keyframe_interval = 10
+    # Reference the previous payload of unchanged plugins instead of storing
+    # a copy of it.
+    deduplicate_placeholder_plugins = False
+    # Store plugins within the versions of their placeholders, instead of
+    # two versions per plugin.
+    placeholder_snapshots = False
 
     def __init__(self, model):
         super(PlaceholderVersionAdapterMixin, self).__init__(model)
+        register_model_metadata(model)
 
         # Add cms placeholders the to the models to follow.
         placeholders = getattr(model._meta, 'placeholder_field_names', None)
@@ -126,7 +441,8 @@ class PlaceholderVersionAdapterMixin(object):
         rev_ctx = self.revision_manager._revision_context_manager
 
         if rev_ctx.is_active() and not rev_ctx.is_managing_manually():
-            add_placeholders_to_revision(
+            # placeholders are captured once, when the revision is saved
+            defer_placeholders_capture(
                 instance=instance,
                 revision_manager=self.revision_manager,
                 rev_ctx=rev_ctx,
@@ -136,7 +452,14 @@ class PlaceholderVersionAdapterMixin(object):
 class ContentEnabledVersionAdapter(TranslatableVersionAdapterMixin,
                                    PlaceholderVersionAdapterMixin,
                                    VersionAdapter):
-    pass
+    # Retention policy, see aldryn_reversion.retention: number of revisions
+    # to keep, number of days after which only one revision per day is kept
+    # and number of days after which revisions are dropped.
+    retention_keep_last = None
+    retention_keep_daily_after = None
+    retention_drop_older_than = None
+    # Store versions compressed, see aldryn_reversion.compression.
+    compress_versions = False
 
 version_controlled_content = partial(default_revision_manager.register,
     adapter_cls=ContentEnabledVersionAdapter,
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Content hash deduplication of plugin versions.
+
+For models registered with deduplicate_placeholder_plugins=True, a plugin
+version whose content hash matches the hash of the previous version of the
+same plugin references the stored payload instead of storing a copy of it.
+Before a revision is deleted, references from other revisions to payloads
+it stores are replaced by copies of the payloads.
+"""
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+from django.db.models.signals import pre_delete
+
+from cms.models import CMSPlugin
+from reversion.models import Revision, Version
+from reversion.revisions import default_revision_manager
+
+from .delta import uses_placeholder_deltas
+from .formats import REFERENCE_FORMAT
+from .formats.delta import loads
+from .formats.reference import dumps, get_hash
+from .utils import chunks
+
+_local = threading.local()
+
+
+def get_reference(version):
+    """
+    Returns a tuple (pk of the version which holds the payload, content hash)
+    for given version.
+    """
+    if version.format == REFERENCE_FORMAT:
+        data = loads(version.serialized_data)
+        return data['ref'], data['hash']
+    return version.pk, get_hash(version.serialized_data)
+
+
+def get_deduplicated_versions_data(obj, versions_data, manager=None,
+                                   exclude_revision=None):
+    """
+    Returns versions data (as returned by bulk.get_versions_data) for a
+    revision of obj, where plugins which did not change since the previous
+    revision of obj reference the previous payload. Payloads stored in
+    exclude_revision are never referenced.
+    Returns versions_data as is, if obj does not deduplicate plugins or uses
+    placeholder deltas (which do not store unchanged plugins at all).
+    """
+    if manager is None:
+        manager = default_revision_manager
+
+    model = obj.__class__
+    if (not manager.is_registered(model) or
+            not getattr(manager.get_adapter(model),
+                        'deduplicate_placeholder_plugins', False) or
+            uses_placeholder_deltas(model, manager)):
+        return versions_data
+
+    previous_version = manager.get_for_object(obj).first()
+    if previous_version is None:
+        return versions_data
+
+    plugins_content_type_ids = set(
+        data['content_type'].pk for item, data in versions_data.items()
+        if isinstance(item, CMSPlugin))
+    previous_versions = previous_version.revision.version_set.filter(
+        content_type_id__in=plugins_content_type_ids)
+
+    references = {}
+    for version in previous_versions:
+        key = (version.content_type_id, version.object_id)
+        references[key] = get_reference(version)
+
+    excluded_pks = set()
+    if exclude_revision is not None:
+        excluded_pks = set(
+            exclude_revision.version_set.values_list('pk', flat=True))
+
+    result = OrderedDict()
+    for item, data in versions_data.items():
+        key = (data['content_type'].pk, data['object_id'])
+        if isinstance(item, CMSPlugin) and key in references:
+            version_pk, content_hash = references[key]
+            if (version_pk not in excluded_pks and
+                    content_hash == get_hash(data['serialized_data'])):
+                data = dict(
+                    data,
+                    format=REFERENCE_FORMAT,
+                    serialized_data=dumps(version_pk, content_hash),
+                )
+        result[item] = data
+    return result
+
+
+def materialize_references(revision_ids):
+    """
+    Replaces references from versions of other revisions to payloads stored
+    in the revisions with given ids by the payloads they refer to. Expects
+    at most a chunk of revision ids (see utils.chunks).
+    """
+    revision_ids = list(revision_ids)
+    # references point to versions of the same object
+    payload_pks = set()
+    object_ids = set()
+    content_type_ids = set()
+    versions = Version.objects.filter(
+        revision_id__in=revision_ids,
+    ).exclude(
+        format=REFERENCE_FORMAT,
+    ).values_list('pk', 'content_type_id', 'object_id')
+    for pk, content_type_id, object_id in versions:
+        payload_pks.add(pk)
+        content_type_ids.add(content_type_id)
+        object_ids.add(object_id)
+    if not payload_pks:
+        return
+
+    referrers = defaultdict(list)
+    for object_ids_chunk in chunks(object_ids):
+        reference_versions = Version.objects.filter(
+            format=REFERENCE_FORMAT,
+            content_type_id__in=content_type_ids,
+            object_id__in=object_ids_chunk,
+        ).exclude(
+            revision_id__in=revision_ids,
+        ).values_list('pk', 'serialized_data')
+        for pk, serialized_data in reference_versions.iterator():
+            ref = loads(serialized_data)['ref']
+            if ref in payload_pks:
+                referrers[ref].append(pk)
+
+    for payload_pks_chunk in chunks(referrers):
+        payloads = Version.objects.filter(
+            pk__in=payload_pks_chunk,
+        ).values_list('pk', 'format', 'serialized_data')
+        for pk, format, serialized_data in payloads.iterator():
+            Version.objects.filter(pk__in=referrers[pk]).update(
+                format=format, serialized_data=serialized_data)
+
+
+@contextmanager
+def references_materialized():
+    """
+    Revisions deleted within the block do not materialize references, for
+    callers which call materialize_references for them first.
+    """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+
+
+def _materialize_revision_references(sender, instance, **kwargs):
+    if not getattr(_local, 'depth', 0):
+        materialize_references([instance.pk])
+
+
+# revisions are deleted by reversion's deleterevisions command, the admin
+# and retention policies
+pre_delete.connect(
+    _materialize_revision_references, sender=Revision,
+    dispatch_uid='aldryn_reversion.dedupe.materialize_references')
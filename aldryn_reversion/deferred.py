@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Deferred revisions: only the owning object reference and the comment are
+recorded while handling the request, the revision itself is built after
+the transaction commits, in an in-process worker pool.
+
+Every commit which defers a revision of an object gets a sequence number.
+A worker only builds the revision of the latest commit of the object, and
+discards it if the object was committed again while the revision was being
+built, so that revisions never contain changes of later commits. Comments
+of skipped and discarded revisions are merged into the revision of the
+latest commit.
+"""
+from __future__ import unicode_literals
+
+import atexit
+import itertools
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.utils import translation
+from django.utils.encoding import force_text
+
+from .core import create_revision, merge_comments
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ThreadPoolExecutor = None
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_sequence = itertools.count(1)
+# {(content type id, object id): latest sequence number}
+_commits = {}
+# {(content type id, object id): [(sequence number, comment)]}
+_comments = {}
+_commits_lock = threading.Lock()
+
+
+class _Superseded(Exception):
+    pass
+
+
+def get_revision_executor():
+    """
+    Returns the worker pool which builds deferred revisions, or None if
+    deferred revisions are built in the committing thread
+    (ALDRYN_REVERSION_DEFERRED_WORKERS is 0, i.e. for tests and management
+    commands) or there is no worker pool available.
+    """
+    global _executor
+    workers = getattr(settings, 'ALDRYN_REVERSION_DEFERRED_WORKERS', 2)
+    if not workers or ThreadPoolExecutor is None:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=workers)
+    return _executor
+
+
+def shutdown_revision_executor(wait=True):
+    """
+    Shuts the worker pool down, after building queued revisions if wait is
+    True. Called on process exit.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+atexit.register(shutdown_revision_executor)
+
+
+def _register_commit(key, comment):
+    with _commits_lock:
+        sequence = next(_sequence)
+        _commits[key] = sequence
+        _comments.setdefault(key, []).append((sequence, comment))
+    return sequence
+
+
+def _forget_commits(key, sequence):
+    # expects _commits_lock to be held
+    if _commits.get(key) == sequence:
+        del _commits[key]
+        del _comments[key]
+
+
+def create_deferred_revision(content_type_id, object_id, user_id=None,
+                             comment=None, language=None,
+                             coalesce_window=None, sequence=None):
+    """
+    Creates a revision for the object referenced by given content type and
+    object ids. Does nothing if the object does not exist anymore. If
+    sequence is given, the revision is only created if sequence is the
+    latest commit of the object, with the comments of all earlier commits.
+    """
+    key = (content_type_id, force_text(object_id))
+    if sequence is not None:
+        with _commits_lock:
+            if _commits.get(key) != sequence:
+                # the revision of a later commit includes this one
+                return
+            comment = merge_comments(*[
+                item_comment for item_sequence, item_comment
+                in _comments[key] if item_sequence <= sequence])
+
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    try:
+        obj = model._default_manager.get(pk=object_id)
+    except model.DoesNotExist:
+        with _commits_lock:
+            _forget_commits(key, sequence)
+        return
+
+    user = None
+    if user_id is not None:
+        user = get_user_model()._default_manager.filter(pk=user_id).first()
+
+    try:
+        with translation.override(language), transaction.atomic():
+            create_revision(obj, user=user, comment=comment,
+                            coalesce_window=coalesce_window)
+            if sequence is not None:
+                with _commits_lock:
+                    if _commits.get(key) != sequence:
+                        # the revision may contain changes of that commit
+                        raise _Superseded()
+                    _forget_commits(key, sequence)
+    except _Superseded:
+        pass
+
+
+def _run_deferred_revision(*args, **kwargs):
+    try:
+        create_deferred_revision(*args, **kwargs)
+    except Exception:
+        logger.exception('Could not create a deferred revision.')
+
+
+def _run_deferred_revision_in_worker(*args, **kwargs):
+    try:
+        _run_deferred_revision(*args, **kwargs)
+    finally:
+        # worker threads hold their own connections
+        connections.close_all()
+
+
+def defer_revision(obj, user=None, comment=None, coalesce_window=None):
+    """
+    Schedules a revision for obj to be created after the current
+    transaction commits. Falls back to creating the revision right away if
+    transaction.on_commit is not available.
+    """
+    on_commit = getattr(transaction, 'on_commit', None)
+    if on_commit is None:
+        create_revision(obj, user=user, comment=comment,
+                        coalesce_window=coalesce_window)
+        return
+
+    kwargs = {
+        'content_type_id': ContentType.objects.get_for_model(obj).pk,
+        'object_id': obj.pk,
+        'user_id': user.pk if user is not None else None,
+        'comment': comment,
+        'language': translation.get_language(),
+        'coalesce_window': coalesce_window,
+    }
+
+    def committed():
+        kwargs['sequence'] = _register_commit(
+            (kwargs['content_type_id'], force_text(obj.pk)), comment)
+        executor = get_revision_executor()
+        if executor is None:
+            _run_deferred_revision(**kwargs)
+        else:
+            executor.submit(_run_deferred_revision_in_worker, **kwargs)
+
+    on_commit(committed)
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Delta encoded placeholder revisions.
+
+For models registered with placeholder_deltas=True a revision stores only
+plugins which were added or changed since the previous revision of the same
+object. Every placeholder version carries the manifest of plugins which
+belonged to the placeholder, so removed plugins are known as well, and
+unchanged plugins are taken from earlier revisions, up to the last keyframe.
+A keyframe (a revision with all plugins) is stored every
+placeholder_keyframe_interval revisions. Before a revision is deleted,
+placeholder versions of later revisions which take plugins from it are
+turned into keyframes.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict, defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import pre_delete
+from django.utils.encoding import force_text
+
+from cms.models import CMSPlugin, Placeholder
+from reversion.models import Revision, Version
+from reversion.revisions import default_revision_manager
+
+from .formats import DELTA_FORMAT
+from .formats.delta import dumps, loads
+
+
+class IncompleteManifestError(Exception):
+    """
+    Raised if plugins listed in the manifest of a delta encoded placeholder
+    version cannot be found, because revisions it is based on were deleted.
+    """
+
+
+def uses_placeholder_deltas(model, manager=None):
+    """
+    Returns True if model is registered with delta encoded placeholders.
+    """
+    if manager is None:
+        manager = default_revision_manager
+    if not manager.is_registered(model):
+        return False
+    return getattr(manager.get_adapter(model), 'placeholder_deltas', False)
+
+
+def get_manifest(version):
+    """
+    Returns the plugins manifest of a placeholder version, or None if the
+    version is not delta encoded.
+    """
+    if version.format != DELTA_FORMAT:
+        return None
+    return loads(version.serialized_data)['manifest']
+
+
+def get_manifest_versions(version, manifest=None):
+    """
+    Returns versions of all plugins listed in the manifest of given
+    placeholder version: the latest version of every plugin stored in
+    revisions of the same object, from the keyframe up to the version's
+    revision. Raises IncompleteManifestError if any of them is missing.
+    """
+    if manifest is None:
+        manifest = get_manifest(version)
+    keys = set((content_type_id, object_id)
+               for content_type_id, object_id in manifest['plugins'])
+    if not keys:
+        return []
+
+    versions = Version.objects.filter(
+        content_type_id__in=set(key[0] for key in keys))
+    if manifest['base'] is None:
+        # keyframe
+        versions = versions.filter(revision_id=version.revision_id)
+    else:
+        owner_content_type_id, owner_id = manifest['owner']
+        owner_revisions = Version.objects.filter(
+            content_type_id=owner_content_type_id,
+            object_id=owner_id,
+            revision_id__gte=manifest['base'],
+            revision_id__lte=version.revision_id,
+        ).values('revision_id')
+        versions = versions.filter(revision_id__in=owner_revisions)
+
+    found = {}
+    for plugin_version in versions.order_by('-revision_id'):
+        key = (plugin_version.content_type_id, plugin_version.object_id)
+        if key in keys and key not in found:
+            found[key] = plugin_version
+    if len(found) != len(keys):
+        raise IncompleteManifestError(
+            'Version {0} lists {1} plugins which are not stored in revisions '
+            '{2} to {3}.'.format(version.pk, len(keys) - len(found),
+                                 manifest['base'], version.revision_id))
+    return list(found.values())
+
+
+def get_revision_versions(revision):
+    """
+    Returns all versions which are needed to revert given revision: its own
+    versions and versions of unchanged plugins of delta encoded placeholders.
+    """
+    versions = list(revision.version_set.all())
+    known = set(version.pk for version in versions)
+
+    for version in list(versions):
+        manifest = get_manifest(version)
+        if manifest is None:
+            continue
+        for plugin_version in get_manifest_versions(version, manifest):
+            if plugin_version.pk not in known:
+                known.add(plugin_version.pk)
+                versions.append(plugin_version)
+    return versions
+
+
+def _get_previous_state(obj, placeholder_ids, interval, manager):
+    """
+    Returns a tuple (base, depth, plugins data) describing the latest
+    revision of obj, or (None, 0, {}) if the next revision has to be a
+    keyframe.
+    """
+    previous_version = manager.get_for_object(obj).first()
+    if previous_version is None:
+        return None, 0, {}
+
+    placeholder_versions = previous_version.revision.version_set.filter(
+        content_type=ContentType.objects.get_for_model(Placeholder),
+        object_id__in=[force_text(pk) for pk in placeholder_ids],
+    )
+    manifests = [(version, get_manifest(version))
+                 for version in placeholder_versions]
+    if (len(manifests) != len(placeholder_ids) or
+            any(manifest is None for _, manifest in manifests)):
+        return None, 0, {}
+
+    depth = max(manifest['depth'] for _, manifest in manifests) + 1
+    if depth >= interval:
+        return None, 0, {}
+
+    base = manifests[0][1]['base'] or previous_version.revision_id
+    plugins_data = {}
+    for version, manifest in manifests:
+        try:
+            plugin_versions = get_manifest_versions(version, manifest)
+        except IncompleteManifestError:
+            return None, 0, {}
+        for plugin_version in plugin_versions:
+            key = (plugin_version.content_type_id, plugin_version.object_id)
+            plugins_data[key] = plugin_version.serialized_data
+    return base, depth, plugins_data
+
+
+def get_delta_versions_data(obj, versions_data, manager=None, keyframe=False):
+    """
+    Returns versions data (as returned by bulk.get_versions_data) for a
+    revision of obj, leaving out plugins which did not change since the
+    previous revision of obj, and adding the plugins manifest to its
+    placeholders. If keyframe is True all plugins are kept.
+    Returns versions_data as is, if obj does not use placeholder deltas.
+    """
+    if manager is None:
+        manager = default_revision_manager
+    if not uses_placeholder_deltas(obj.__class__, manager):
+        return versions_data
+
+    adapter = manager.get_adapter(obj.__class__)
+    placeholder_ids = [
+        getattr(obj, '{0}_id'.format(name))
+        for name in obj._meta.placeholder_field_names
+        if getattr(obj, '{0}_id'.format(name)) is not None]
+
+    if keyframe:
+        base, depth, previous_data = None, 0, {}
+    else:
+        base, depth, previous_data = _get_previous_state(
+            obj, placeholder_ids, adapter.placeholder_keyframe_interval,
+            manager)
+
+    plugins = dict((pk, []) for pk in placeholder_ids)
+    result = OrderedDict()
+    for item, data in versions_data.items():
+        if isinstance(item, CMSPlugin) and item.placeholder_id in plugins:
+            key = (data['content_type'].pk, data['object_id'])
+            plugins[item.placeholder_id].append(list(key))
+            if previous_data.get(key) == data['serialized_data']:
+                continue
+        result[item] = data
+
+    owner = [ContentType.objects.get_for_model(obj).pk, force_text(obj.pk)]
+    for item, data in result.items():
+        if isinstance(item, Placeholder) and item.pk in plugins:
+            manifest = {
+                'owner': owner,
+                'base': base,
+                'depth': depth,
+                'plugins': plugins[item.pk],
+            }
+            result[item] = dict(
+                data,
+                format=DELTA_FORMAT,
+                serialized_data=dumps(
+                    data['serialized_data'], data['format'], manifest),
+            )
+    return result
+
+
+def _copy_version(version, revision_id):
+    values = dict((field.attname, getattr(version, field.attname))
+                  for field in Version._meta.concrete_fields
+                  if not field.primary_key)
+    values['revision_id'] = revision_id
+    return Version(**values)
+
+
+def promote_dependent_deltas(revision_id):
+    """
+    Turns placeholder versions of later revisions which take plugins from
+    the revision with given id into keyframes: the first version of every
+    delta chain gets copies of the plugin versions it takes from earlier
+    revisions, later versions of the chain are based on it.
+    """
+    placeholder_ct = ContentType.objects.get_for_model(Placeholder)
+    placeholder_ids = Version.objects.filter(
+        revision_id=revision_id, content_type=placeholder_ct,
+        format=DELTA_FORMAT,
+    ).values_list('object_id', flat=True)
+    dependents = Version.objects.filter(
+        content_type=placeholder_ct, format=DELTA_FORMAT,
+        object_id__in=list(placeholder_ids), revision_id__gt=revision_id,
+    ).order_by('revision_id')
+
+    chains = defaultdict(list)
+    for version in dependents:
+        data = loads(version.serialized_data)
+        base = data['manifest']['base']
+        if base is not None and base <= revision_id:
+            chains[(version.object_id, base)].append((version, data))
+
+    for chain in chains.values():
+        keyframe, data = chain[0]
+        manifest = data['manifest']
+        Version.objects.bulk_create([
+            _copy_version(plugin_version, keyframe.revision_id)
+            for plugin_version in get_manifest_versions(keyframe, manifest)
+            if plugin_version.revision_id != keyframe.revision_id])
+        for version, data in chain:
+            data['manifest'] = dict(
+                data['manifest'],
+                base=(None if version is keyframe
+                      else keyframe.revision_id),
+                depth=data['manifest']['depth'] - manifest['depth'])
+            Version.objects.filter(pk=version.pk).update(
+                serialized_data=dumps(
+                    data['data'], data['format'], data['manifest']))
+
+
+def _promote_revision_dependent_deltas(sender, instance, **kwargs):
+    promote_dependent_deltas(instance.pk)
+
+
+# revisions are deleted by reversion's deleterevisions command, the admin
+# and retention policies (which keep revisions deltas depend on)
+pre_delete.connect(
+    _promote_revision_dependent_deltas, sender=Revision,
+    dispatch_uid='aldryn_reversion.delta.promote_dependent_deltas')
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Field level differences between two revisions of an object.
+
+Differences are computed from the deserialized versions of both revisions
+(including versions of unchanged plugins of delta encoded revisions, plugins
+stored in placeholder snapshots, references and compressed versions),
+without touching the objects in the database: changed model fields, changed,
+added and removed translations, and added, removed, moved and edited plugins
+of every placeholder field. Parsed revisions are kept in a bounded cache,
+revisions do not change once they are saved.
+"""
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.utils.encoding import force_text
+
+from cms.models import CMSPlugin
+
+from .delta import get_revision_versions
+from .formats.reference import payloads_preloaded
+from .metadata import get_model_metadata
+from .snapshot import get_deserialized_objects
+
+FieldChange = namedtuple('FieldChange', ['name', 'old', 'new'])
+
+# old and new are the plugin instances (or base plugins, if a plugin has no
+# instance), None for added and removed plugins.
+PluginChange = namedtuple('PluginChange', [
+    'pk', 'plugin_type', 'old', 'new', 'changes',
+])
+
+PlaceholderDiff = namedtuple('PlaceholderDiff', [
+    'added', 'removed', 'moved', 'edited',
+])
+
+# Fields of base plugins which define the position of a plugin. Other tree
+# fields (path, depth, numchild) follow from them.
+PLUGIN_POSITION_FIELDS = ('placeholder', 'parent', 'position')
+
+
+class ObjectDiff(object):
+    """
+    Differences of an object between two revisions: fields is a list of
+    FieldChange, translations an ordered dict of {language code: list of
+    FieldChange} and placeholders an ordered dict of {placeholder field name:
+    PlaceholderDiff}.
+    """
+
+    def __init__(self, fields, translations, placeholders):
+        self.fields = fields
+        self.translations = translations
+        self.placeholders = placeholders
+
+    def __bool__(self):
+        return bool(self.fields or self.translations or any(
+            any(changes) for changes in self.placeholders.values()))
+
+    __nonzero__ = __bool__
+
+
+class RevisionState(object):
+    """
+    All objects stored in a revision, deserialized, keyed by (model, pk).
+    """
+
+    def __init__(self, revision):
+        self.objects = {}
+        versions = get_revision_versions(revision)
+        with payloads_preloaded(versions):
+            for version in versions:
+                for deserialized in get_deserialized_objects(version):
+                    obj = deserialized.object
+                    key = (obj.__class__, force_text(obj.pk))
+                    self.objects[key] = (obj, deserialized.m2m_data)
+
+    def get(self, model, pk):
+        return self.objects.get((model, force_text(pk)), (None, {}))
+
+    def filter(self, model, **values):
+        """
+        Returns objects of model which attributes have given values (compared
+        as text).
+        """
+        values = dict((name, force_text(value))
+                      for name, value in values.items())
+        return [
+            obj for (obj_model, _), (obj, _) in self.objects.items()
+            if obj_model is model and all(
+                force_text(getattr(obj, name)) == value
+                for name, value in values.items())]
+
+
+class _StateCache(object):
+
+    def __init__(self):
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, revision):
+        # ids of deleted revisions may be reused by some databases
+        key = (revision.pk, revision.date_created)
+        with self.lock:
+            if key in self.states:
+                state = self.states.pop(key)
+                self.states[key] = state
+                return state
+
+        state = RevisionState(revision)
+        size = getattr(settings, 'ALDRYN_REVERSION_DIFF_CACHE_SIZE', 32)
+        with self.lock:
+            self.states[key] = state
+            while len(self.states) > size:
+                self.states.popitem(last=False)
+        return state
+
+    def clear(self):
+        with self.lock:
+            self.states.clear()
+
+
+_states = _StateCache()
+
+
+def get_revision_state(revision):
+    """
+    Returns the (cached) RevisionState of given revision.
+    """
+    return _states.get(revision)
+
+
+def clear_cache():
+    _states.clear()
+
+
+def get_field_changes(model, old, new, old_m2m=None, new_m2m=None,
+                      exclude=()):
+    """
+    Returns a list of FieldChange of local fields of model between two
+    deserialized objects, either of which may be None.
+    """
+    changes = []
+    for field in model._meta.local_concrete_fields:
+        if field.primary_key or field.name in exclude:
+            continue
+        old_value = field.value_from_object(old) if old is not None else None
+        new_value = field.value_from_object(new) if new is not None else None
+        if old_value != new_value:
+            changes.append(FieldChange(field.name, old_value, new_value))
+    for field in model._meta.local_many_to_many:
+        if field.name in exclude:
+            continue
+        old_value = sorted((old_m2m or {}).get(field.name, []))
+        new_value = sorted((new_m2m or {}).get(field.name, []))
+        if old_value != new_value:
+            changes.append(FieldChange(field.name, old_value, new_value))
+    return changes
+
+
+def _get_translation_changes(model, object_id, old_state, new_state):
+    translation_model = get_model_metadata(model).translation_model
+    if translation_model is None:
+        return OrderedDict()
+
+    def get_translations(state):
+        return dict(
+            (translation.language_code, translation) for translation in
+            state.filter(translation_model, master_id=object_id))
+
+    old_translations = get_translations(old_state)
+    new_translations = get_translations(new_state)
+    translations = OrderedDict()
+    for language in sorted(set(old_translations) | set(new_translations)):
+        changes = get_field_changes(
+            translation_model, old_translations.get(language),
+            new_translations.get(language),
+            exclude=('master', 'language_code'))
+        if changes:
+            translations[language] = changes
+    return translations
+
+
+def _get_plugins(state, placeholder_ids):
+    """
+    Returns a dict of {plugin pk: (placeholder field name, base plugin,
+    plugin instance)} for plugins of given placeholders.
+    """
+    plugins = {}
+    for name, placeholder_id in placeholder_ids.items():
+        for plugin in state.filter(CMSPlugin, placeholder_id=placeholder_id):
+            instance = None
+            try:
+                plugin_model = plugin.get_plugin_class().model
+            except KeyError:
+                # plugin type is not registered (anymore), fall back to the
+                # fields of the plugin model stored in the revision
+                instance = _get_stored_instance(state, plugin)
+            else:
+                if plugin_model is not CMSPlugin:
+                    instance, _ = state.get(plugin_model, plugin.pk)
+            plugins[plugin.pk] = (name, plugin, instance)
+    return plugins
+
+
+def _get_stored_instance(state, plugin):
+    """
+    Returns the plugin instance of given base plugin stored in state, or None.
+    """
+    pk = force_text(plugin.pk)
+    for (model, obj_pk), (obj, _) in state.objects.items():
+        if (obj_pk == pk and model is not CMSPlugin and
+                issubclass(model, CMSPlugin)):
+            return obj
+    return None
+
+
+def _get_plugin_changes(plugin, instance, other_plugin, other_instance):
+    changes = get_field_changes(
+        CMSPlugin, other_plugin, plugin,
+        exclude=PLUGIN_POSITION_FIELDS + (
+            'path', 'depth', 'numchild', 'changed_date', 'creation_date',
+            'plugin_type'))
+    if instance is not None or other_instance is not None:
+        model = (instance or other_instance).__class__
+        changes += get_field_changes(
+            model, other_instance, instance,
+            exclude=(model._meta.pk.name,))
+    return changes
+
+
+def _get_placeholder_changes(model, old_obj, new_obj, old_state, new_state):
+    names = get_model_metadata(model).placeholder_field_names
+
+    def get_placeholder_ids(obj):
+        return dict(
+            (name, getattr(obj, '{0}_id'.format(name))) for name in names
+            if getattr(obj, '{0}_id'.format(name)) is not None)
+
+    old_plugins = _get_plugins(old_state, get_placeholder_ids(old_obj))
+    new_plugins = _get_plugins(new_state, get_placeholder_ids(new_obj))
+    placeholders = OrderedDict(
+        (name, PlaceholderDiff([], [], [], [])) for name in names)
+
+    for pk in sorted(new_plugins):
+        name, plugin, instance = new_plugins[pk]
+        old = old_plugins.get(pk)
+        if old is None:
+            placeholders[name].added.append(PluginChange(
+                pk, plugin.plugin_type, None, instance or plugin, []))
+            continue
+        old_name, old_plugin, old_instance = old
+        if (old_name != name or
+                old_plugin.parent_id != plugin.parent_id or
+                old_plugin.position != plugin.position):
+            placeholders[name].moved.append(PluginChange(
+                pk, plugin.plugin_type, old_instance or old_plugin,
+                instance or plugin, [
+                    FieldChange('placeholder', old_name, name),
+                    FieldChange('parent', old_plugin.parent_id,
+                                plugin.parent_id),
+                    FieldChange('position', old_plugin.position,
+                                plugin.position)]))
+        changes = _get_plugin_changes(
+            plugin, instance, old_plugin, old_instance)
+        if changes:
+            placeholders[name].edited.append(PluginChange(
+                pk, plugin.plugin_type, old_instance or old_plugin,
+                instance or plugin, changes))
+
+    for pk in sorted(set(old_plugins) - set(new_plugins)):
+        name, plugin, instance = old_plugins[pk]
+        placeholders[name].removed.append(PluginChange(
+            pk, plugin.plugin_type, instance or plugin, None, []))
+    return placeholders
+
+
+def diff_revisions(model, object_id, old_revision, new_revision):
+    """
+    Returns an ObjectDiff of the object of model with given primary key
+    between two revisions which contain it.
+    """
+    old_state = get_revision_state(old_revision)
+    new_state = get_revision_state(new_revision)
+    old_obj, old_m2m = old_state.get(model, object_id)
+    new_obj, new_m2m = new_state.get(model, object_id)
+    if old_obj is None or new_obj is None:
+        raise ValueError('Both revisions have to contain the object.')
+
+    placeholder_field_names = get_model_metadata(
+        model).placeholder_field_names
+    return ObjectDiff(
+        fields=get_field_changes(
+            model, old_obj, new_obj, old_m2m, new_m2m,
+            exclude=placeholder_field_names),
+        translations=_get_translation_changes(
+            model, object_id, old_state, new_state),
+        placeholders=_get_placeholder_changes(
+            model, old_obj, new_obj, old_state, new_state),
+    )
+
+
+def diff_versions(old_version, new_version):
+    """
+    Returns an ObjectDiff of an object between the revisions of two of its
+    versions.
+    """
+    return diff_revisions(
+        old_version.content_type.model_class(), old_version.object_id,
+        old_version.revision, new_version.revision)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Serialization formats used by aldryn-reversion for versions it creates.
+Every format is registered as a django serializer, so that
+Version.object_version deserializes them. Snapshot versions hold more than
+one object and delta encoded revisions do not contain unchanged plugins, so
+Version.revert and Revision.revert do not restore them completely; they are
+restored with aldryn_reversion.restore (see revert_revision).
+"""
+from __future__ import unicode_literals
+
+from django.core import serializers
+
+COMPRESSED_FORMAT = 'aldryn_zlib'
+DELTA_FORMAT = 'aldryn_delta'
+REFERENCE_FORMAT = 'aldryn_ref'
+SNAPSHOT_FORMAT = 'aldryn_snapshot'
+
+FORMATS = {
+    COMPRESSED_FORMAT: 'aldryn_reversion.formats.compressed',
+    DELTA_FORMAT: 'aldryn_reversion.formats.delta',
+    REFERENCE_FORMAT: 'aldryn_reversion.formats.reference',
+    SNAPSHOT_FORMAT: 'aldryn_reversion.formats.snapshot',
+}
+
+
+def register_formats():
+    for format, serializer_module in FORMATS.items():
+        serializers.register_serializer(format, serializer_module)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Versions which hold their data in its original format, compressed with zlib
+and base64 encoded. The serialized data holds the original format, the label
+of the model and the version of the model's preset dictionary, which primes
+the compressor with the strings all payloads of the model share.
+
+zlib of Python 2 does not support preset dictionaries (zdict), so streams
+start with the compressed dictionary instead, flushed to a byte boundary,
+and only the rest of the stream is stored. A compressor and a decompressor
+which processed the dictionary are kept per model and copied for every
+payload, so payloads are compressed and read the same way on Python 2 and 3.
+"""
+from __future__ import unicode_literals
+
+import base64
+import json
+import threading
+import zlib
+
+from django.core import serializers
+from django.core.serializers.json import Serializer as JSONSerializer
+
+from .delta import loads
+
+# Version of the preset dictionaries, stored with every payload. Dictionaries
+# of a version must never change, payloads compressed with them could not be
+# decompressed anymore.
+DICTIONARY_VERSION = 1
+
+# {(model label, dictionary version): (compressor, decompressor)}
+_primed = {}
+_primed_lock = threading.Lock()
+
+# Strings shared by serialized models, placeholders, plugins and
+# translations, least frequent first (zlib prefers matches at the end).
+_DICTIONARY_STRINGS = (
+    '<h1>', '</h1>', '<h2>', '</h2>', '<h3>', '</h3>', '<li>', '</li>',
+    '<ul>', '</ul>', '<strong>', '</strong>', '<em>', '</em>', '<br>',
+    '<img src="', '" alt="', '<a href="', '" target="_blank">', '</a>',
+    '<span class="', '</span>', '<div class="', '</div>', '<p>', '</p>',
+    '&nbsp;', '"slot": ', '"default_width": ', '"master": ',
+    '"language_code": ', '"numchild": ', '"depth": ', '"path": ',
+    '"changed_date": ', '"creation_date": ', '"plugin_type": ',
+    '"language": "', '"position": ', '"parent": ', '"placeholder": ',
+    '"cmsplugin_ptr": ', '"body": "', '"fields": {', ', "pk": ',
+)
+
+
+def get_dictionary(model_label, version=DICTIONARY_VERSION):
+    """
+    Returns the preset dictionary of given version for the model with given
+    label (app_label.model_name).
+    """
+    if version != 1:
+        raise ValueError(
+            'Unknown compression dictionary version {0}.'.format(version))
+    return (''.join(_DICTIONARY_STRINGS) +
+            '[{{"model": "{0}", "pk": '.format(model_label)).encode('utf-8')
+
+
+def _get_primed(model_label, version):
+    """
+    Returns a tuple (compressor, decompressor) which processed the preset
+    dictionary of given version for the model. Callers use copies of them.
+    """
+    key = (model_label, version)
+    primed = _primed.get(key)
+    if primed is None:
+        dictionary = get_dictionary(model_label, version)
+        compressor = zlib.compressobj(9)
+        start = (compressor.compress(dictionary) +
+                 compressor.flush(zlib.Z_SYNC_FLUSH))
+        decompressor = zlib.decompressobj()
+        decompressor.decompress(start)
+        with _primed_lock:
+            primed = _primed.setdefault(key, (compressor, decompressor))
+    return primed
+
+
+def compress(serialized_data, model_label, dictionary_version=None):
+    if dictionary_version is None:
+        compressor = zlib.compressobj(9)
+    else:
+        compressor = _get_primed(model_label, dictionary_version)[0].copy()
+    data = compressor.compress(serialized_data.encode('utf-8'))
+    return base64.b64encode(data + compressor.flush()).decode('ascii')
+
+
+def decompress(data):
+    """
+    Returns the original serialized data of a loaded payload.
+    """
+    compressed = base64.b64decode(data['data'])
+    if data['dictionary'] is None:
+        decompressor = zlib.decompressobj()
+    else:
+        decompressor = _get_primed(
+            data['model'], data['dictionary'])[1].copy()
+    serialized_data = (
+        decompressor.decompress(compressed) + decompressor.flush())
+    return serialized_data.decode('utf-8')
+
+
+def dumps(serialized_data, format, model_label,
+          dictionary_version=DICTIONARY_VERSION):
+    return json.dumps({
+        'format': format,
+        'model': model_label,
+        'dictionary': dictionary_version,
+        'data': compress(serialized_data, model_label, dictionary_version),
+    }, separators=(',', ':'))
+
+
+class Serializer(JSONSerializer):
+    """
+    Compressed versions are written by aldryn_reversion.compression,
+    serializing with this format produces regular json.
+    """
+
+
+def Deserializer(stream_or_string, **options):
+    data = loads(stream_or_string)
+    if isinstance(data, list):
+        # regular json
+        return serializers.deserialize('json', json.dumps(data), **options)
+    return serializers.deserialize(
+        data['format'], decompress(data), **options)
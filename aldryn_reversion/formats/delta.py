@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Placeholder versions of delta encoded revisions. The serialized data holds
+the placeholder data in its original format together with the manifest of
+plugins which belonged to the placeholder at that point.
+"""
+from __future__ import unicode_literals
+
+import json
+
+from django.core import serializers
+from django.core.serializers.json import Serializer as JSONSerializer
+from django.utils import six
+
+
+def dumps(serialized_data, format, manifest):
+    return json.dumps({
+        'format': format,
+        'data': serialized_data,
+        'manifest': manifest,
+    })
+
+
+def loads(stream_or_string):
+    if not isinstance(stream_or_string, (bytes, six.string_types)):
+        stream_or_string = stream_or_string.read()
+    if isinstance(stream_or_string, bytes):
+        stream_or_string = stream_or_string.decode('utf-8')
+    return json.loads(stream_or_string)
+
+
+class Serializer(JSONSerializer):
+    """
+    Delta versions are written by aldryn_reversion.delta, serializing with
+    this format produces regular json.
+    """
+
+
+def Deserializer(stream_or_string, **options):
+    data = loads(stream_or_string)
+    if isinstance(data, list):
+        # regular json
+        return serializers.deserialize('json', json.dumps(data), **options)
+    return serializers.deserialize(data['format'], data['data'], **options)
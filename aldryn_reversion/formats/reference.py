@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Versions which reference the payload of another version with the same
+content, instead of storing a copy of it. The serialized data holds the
+primary key of the referenced version and the content hash. References of a
+revision are resolved with one query when deserialized within a
+payloads_preloaded block.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+
+from django.core import serializers
+from django.core.serializers.json import Serializer as JSONSerializer
+
+from .delta import loads
+
+_local = threading.local()
+
+
+def get_hash(serialized_data):
+    return hashlib.sha1(serialized_data.encode('utf-8')).hexdigest()
+
+
+def dumps(version_pk, content_hash):
+    return json.dumps({'ref': version_pk, 'hash': content_hash})
+
+
+class Serializer(JSONSerializer):
+    """
+    References are written by aldryn_reversion.dedupe, serializing with this
+    format produces regular json.
+    """
+
+
+@contextmanager
+def payloads_preloaded(versions):
+    """
+    Fetches the payloads referenced by given versions (which are not
+    deserialized already, see aldryn_reversion.version_cache) with one query
+    per chunk of references, and deserializes references within the block
+    without querying their payloads again. Blocks can be nested.
+    """
+    from reversion.models import Version
+
+    from .. import version_cache
+    from . import REFERENCE_FORMAT
+    from ..utils import chunks
+
+    refs = set(
+        loads(version.serialized_data)['ref'] for version in versions
+        if version.format == REFERENCE_FORMAT and
+        not version_cache.is_cached(version))
+    previous = getattr(_local, 'payloads', None)
+    payloads = dict(previous or {})
+    for refs_chunk in chunks(refs.difference(payloads)):
+        payloads.update(
+            (pk, (format, serialized_data))
+            for pk, format, serialized_data in Version.objects.filter(
+                pk__in=refs_chunk,
+            ).values_list('pk', 'format', 'serialized_data'))
+    _local.payloads = payloads
+    try:
+        yield
+    finally:
+        _local.payloads = previous
+
+
+def Deserializer(stream_or_string, **options):
+    from reversion.models import Version
+
+    data = loads(stream_or_string)
+    if isinstance(data, list):
+        # regular json
+        return serializers.deserialize('json', json.dumps(data), **options)
+    payloads = getattr(_local, 'payloads', None) or {}
+    if data['ref'] in payloads:
+        format, serialized_data = payloads[data['ref']]
+    else:
+        format, serialized_data = Version.objects.filter(
+            pk=data['ref']).values_list('format', 'serialized_data').get()
+    return serializers.deserialize(format, serialized_data, **options)
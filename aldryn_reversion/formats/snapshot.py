@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Placeholder versions which hold the whole plugin tree of the placeholder in
+one document: the placeholder data in its original format, followed by the
+data of every base plugin and plugin instance (which carries its position in
+the tree). Deserializes to the placeholder, followed by the plugin objects.
+"""
+from __future__ import unicode_literals
+
+import itertools
+import json
+
+from django.core import serializers
+from django.core.serializers.json import Serializer as JSONSerializer
+
+from .delta import loads
+
+
+def dumps(serialized_data, format, plugins):
+    """
+    Expects plugins to be a list of (content type id, object id, format,
+    serialized data) tuples.
+    """
+    return json.dumps({
+        'format': format,
+        'data': serialized_data,
+        'plugins': [list(plugin) for plugin in plugins],
+    }, separators=(',', ':'))
+
+
+class Serializer(JSONSerializer):
+    """
+    Snapshots are written by aldryn_reversion.snapshot, serializing with this
+    format produces regular json.
+    """
+
+
+def Deserializer(stream_or_string, **options):
+    data = loads(stream_or_string)
+    if isinstance(data, list):
+        # regular json
+        return serializers.deserialize('json', json.dumps(data), **options)
+    return itertools.chain(
+        serializers.deserialize(data['format'], data['data'], **options),
+        *[serializers.deserialize(plugin_format, plugin_data, **options)
+          for _, _, plugin_format, plugin_data in data['plugins']])
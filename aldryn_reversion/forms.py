@@ -5,8 +5,11 @@ from django.forms.widgets import CheckboxSelectMultiple
 from django.utils.encoding import force_text
 from django.utils.translation import ugettext as _
 
+from .instrumentation import instrument
+from .restore import restore_versions
 from .utils import (
-    get_translations_versions_for_object, get_conflict_fks_versions,
+    get_indexed_translations_versions_for_object, get_conflict_fks_versions,
+    get_placeholders_plugins_versions, RevisionIndex,
 )
 
 
@@ -24,15 +27,24 @@ class RecoverObjectWithTranslationForm(forms.Form):
         self.version = kwargs.pop('version')
         self.resolve_conflicts = kwargs.pop('resolve_conflicts')
         self.placeholders = kwargs.pop('placeholders')
-        # do not check object which needs to be recovered
-        versions = self.revision.version_set.exclude(pk=self.version.pk)
+        # a RestorePlan (see aldryn_reversion.plan) of the version answers
+        # all lookups below, if provided
+        self.plan = kwargs.pop('plan', None)
+        self.index = kwargs.pop('index', None)
+        if self.index is None and self.plan is None:
+            self.index = RevisionIndex(self.revision)
 
         super(RecoverObjectWithTranslationForm, self).__init__(*args, **kwargs)
 
         translatable = hasattr(self.obj, 'translations')
         if translatable:
-            translation_versions = get_translations_versions_for_object(
-                self.obj, self.revision, versions)
+            if self.plan is not None:
+                translation_versions = self.plan.get_versions(
+                    self.plan.translation_pks)
+            else:
+                translation_versions = (
+                    get_indexed_translations_versions_for_object(
+                        self.obj, self.index))
             # update form
             choices = [(translation_version.pk, force_text(translation_version))
                        for translation_version in translation_versions]
@@ -43,13 +55,20 @@ class RecoverObjectWithTranslationForm(forms.Form):
 
     def clean(self):
         data = super(RecoverObjectWithTranslationForm, self).clean()
+        if self.plan is not None:
+            if self.plan.get_unresolved_conflict_pks():
+                raise ValidationError(
+                    _('Cannot restore object, there are conflicts!'),
+                    code='invalid')
+            return data
+
         # if there is self.resolve_conflicts do not count them as conflicts
         exclude = {
             'pk__in': [version.pk for version in
                        self.resolve_conflicts + self.placeholders]}
         conflict_fks_versions = get_conflict_fks_versions(
             self.obj, self.version, self.revision,
-            exclude=exclude)
+            exclude=exclude, index=self.index)
         if bool(conflict_fks_versions):
             raise ValidationError(
                 _('Cannot restore object, there are conflicts!'),
@@ -57,25 +76,31 @@ class RecoverObjectWithTranslationForm(forms.Form):
         return data
 
     def save(self):
-        # restore placeholders
-        for placeholder_version in self.placeholders:
-            # note that only placeholders are being reverted, assuming that
-            # cms plugins that are related to this placeholder were not deleted
-            placeholder_version.revert()
+        with instrument('RecoverObjectWithTranslationForm.save',
+                        self.obj) as recorder:
+            # if there is self.resolve_conflicts restore those objects to
+            # avoid integrity errors, because user cannot do that form admin
+            # assume that that was prepared for us in admin view
+            versions = (list(self.placeholders) +
+                        list(self.resolve_conflicts) + [self.version])
+
+            translations_pks = [int(pk) for pk in self.cleaned_data.get(
+                'translations', [])] if hasattr(self, 'cleaned_data') else []
 
-        # if there is self.resolve_conflicts revert those objects to avoid
-        # integrity errors, because user cannot do that form admin
-        # assume that that was prepared for us in admin view
-        for conflict in self.resolve_conflicts:
-            conflict.revert()
+            if self.plan is not None:
+                versions += self.plan.get_versions(self.plan.plugin_pks)
+                versions += self.plan.get_versions(
+                    [pk for pk in translations_pks
+                     if pk in self.plan.translation_pks])
+            else:
+                # restore plugins of restored placeholders
+                versions += get_placeholders_plugins_versions(
+                    versions, self.revision, self.index)
 
-        # revert main object
-        self.version.revert()
+                # restore translations, if there is translations
+                versions += self.index.get_versions(
+                    [pk for pk in translations_pks if pk in self.index.rows])
 
-        # revert translations, if there is translations
-        translations_pks = self.cleaned_data.get(
-            'translations', []) if hasattr(self, 'cleaned_data') else []
-        translation_versions = self.revision.version_set.filter(
-            pk__in=translations_pks) if translations_pks else []
-        for translation_version in translation_versions:
-            translation_version.revert()
+            # objects are restored in FK dependency order, in bulk
+            restore_versions(versions)
+            recorder.add_versions(versions)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of revision operations.
+
+Instrumented operations (create_revision, add_placeholders_to_revision,
+the admin's _create_aldryn_revision, the conflict resolver, the recover
+form's save and sync_placeholder_version_plugins) report an Event with their
+duration, SQL query count, number of versions touched and size of their
+serialized data to the revision_operation signal and to the collectors
+listed in the ALDRYN_REVERSION_INSTRUMENTATION_COLLECTORS setting (dotted
+paths of Collector classes). Operations are measured only if there is a
+receiver or a collector.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from .signals import revision_operation
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', [
+    'operation', 'instance', 'duration', 'queries', 'versions',
+    'serialized_bytes',
+])
+
+
+class Collector(object):
+    """
+    Base class of instrumentation collectors.
+    """
+
+    def collect(self, event):
+        raise NotImplementedError
+
+
+class LoggingCollector(Collector):
+    """
+    Logs events to the aldryn_reversion.instrumentation logger, with the
+    event as extra 'event' attribute of the log record.
+    """
+
+    def collect(self, event):
+        logger.info(
+            '%s took %.1f ms, %d queries, %d versions, %d bytes',
+            event.operation, event.duration * 1000, event.queries,
+            event.versions, event.serialized_bytes, extra={'event': event})
+
+
+class MemoryCollector(Collector):
+    """
+    Keeps all events in memory, i.e. for tests.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def collect(self, event):
+        self.events.append(event)
+
+
+_collectors = []
+_settings_collectors = ((), [])
+_collectors_lock = threading.Lock()
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def unregister_collector(collector):
+    _collectors.remove(collector)
+
+
+def get_collectors():
+    """
+    Returns registered collectors and collectors configured by the
+    ALDRYN_REVERSION_INSTRUMENTATION_COLLECTORS setting.
+    """
+    global _settings_collectors
+    paths = tuple(getattr(
+        settings, 'ALDRYN_REVERSION_INSTRUMENTATION_COLLECTORS', ()))
+    if paths != _settings_collectors[0]:
+        with _collectors_lock:
+            _settings_collectors = (
+                paths, [import_string(path)() for path in paths])
+    return _settings_collectors[1] + _collectors
+
+
+class Recorder(object):
+    """
+    Records versions touched by an instrumented operation.
+    """
+
+    def __init__(self):
+        self.versions = 0
+        self.serialized_bytes = 0
+
+    def add_versions_data(self, versions_data):
+        """
+        Expects a dict of {obj: version data} (see bulk.get_versions_data).
+        """
+        for data in versions_data.values():
+            self.versions += 1
+            self.serialized_bytes += len(data['serialized_data'])
+
+    def add_versions(self, versions):
+        for version in versions:
+            self.versions += 1
+            self.serialized_bytes += len(version.serialized_data)
+
+
+class _CountingCursor(object):
+    """
+    Cursor wrapper which counts executed statements on its connection.
+    """
+
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def execute(self, sql, params=None):
+        self.connection._aldryn_reversion_queries += 1
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.connection._aldryn_reversion_queries += 1
+        return self.cursor.executemany(sql, param_list)
+
+
+def _wrap_cursors(connection):
+    """
+    Makes cursors created by connection count statements, until the same
+    number of _unwrap_cursors calls. Connections are per thread.
+    """
+    depth = getattr(connection, '_aldryn_reversion_depth', 0)
+    if not depth:
+        make_cursor = connection.make_cursor
+        make_debug_cursor = connection.make_debug_cursor
+        connection._aldryn_reversion_queries = 0
+        connection.make_cursor = lambda cursor: _CountingCursor(
+            make_cursor(cursor), connection)
+        connection.make_debug_cursor = lambda cursor: _CountingCursor(
+            make_debug_cursor(cursor), connection)
+    connection._aldryn_reversion_depth = depth + 1
+
+
+def _unwrap_cursors(connection):
+    connection._aldryn_reversion_depth -= 1
+    if not connection._aldryn_reversion_depth:
+        # restores the methods of the connection class
+        del connection.make_cursor
+        del connection.make_debug_cursor
+
+
+class QueryCounter(object):
+    """
+    Counts statements executed on all connections of the current thread,
+    without enabling query logging. The count is available as count after
+    the block.
+    """
+
+    def __enter__(self):
+        self.connections = []
+        for connection in connections.all():
+            _wrap_cursors(connection)
+            self.connections.append(
+                (connection, connection._aldryn_reversion_queries))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.count = 0
+        for connection, start in self.connections:
+            self.count += connection._aldryn_reversion_queries - start
+            _unwrap_cursors(connection)
+
+
+def is_enabled():
+    return bool(revision_operation.has_listeners() or get_collectors())
+
+
+def send_event(event):
+    # senders are matched by identity, the operation name is event.operation
+    for receiver, response in revision_operation.send_robust(
+            sender=Event, event=event):
+        if isinstance(response, Exception):
+            logger.error('Instrumentation receiver %r failed: %r',
+                         receiver, response)
+    for collector in get_collectors():
+        try:
+            collector.collect(event)
+        except Exception:
+            logger.exception('Instrumentation collector %r failed.',
+                             collector)
+
+
+@contextmanager
+def instrument(operation, instance=None):
+    """
+    Measures the wrapped block and reports it as operation. Yields a
+    Recorder, which the block reports versions it touched to.
+    """
+    recorder = Recorder()
+    if not is_enabled():
+        yield recorder
+        return
+
+    with QueryCounter() as queries:
+        start = default_timer()
+        yield recorder
+        duration = default_timer() - start
+    send_event(Event(
+        operation=operation,
+        instance=instance,
+        duration=duration,
+        queries=queries.count,
+        versions=recorder.versions,
+        serialized_bytes=recorder.serialized_bytes,
+    ))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from reversion.revisions import default_revision_manager
+
+from ...backfill import BACKFILL_COMMENT, backfill
+from ...core import ContentEnabledVersionAdapter
+
+
+class Command(BaseCommand):
+    help = ('Creates initial revisions for objects of models registered with '
+            'version_controlled_content, which have no revisions yet.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Limit the backfill to given models.')
+        parser.add_argument(
+            '--chunk-size', type=int, dest='chunk_size', default=500,
+            help='Number of objects to process per chunk.')
+        parser.add_argument(
+            '--workers', type=int, dest='workers', default=0,
+            help='Number of worker processes, chunks are processed in this '
+                 'process by default.')
+        parser.add_argument(
+            '--comment', dest='comment', default=BACKFILL_COMMENT,
+            help='Comment of created revisions.')
+
+    def get_models(self, options):
+        if options['models']:
+            try:
+                return [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+        return [
+            model for model in default_revision_manager.get_registered_models()
+            if isinstance(default_revision_manager.get_adapter(model),
+                          ContentEnabledVersionAdapter)]
+
+    def handle(self, *args, **options):
+        for model in self.get_models(options):
+            if not default_revision_manager.is_registered(model):
+                raise CommandError('{0} is not registered.'.format(
+                    model._meta.object_name))
+            name = model._meta.verbose_name_plural
+
+            def progress(processed, total):
+                self.stdout.write('Processed {0} of {1} {2}.'.format(
+                    processed, total, name))
+
+            created = backfill(
+                model, chunk_size=options['chunk_size'],
+                workers=options['workers'], comment=options['comment'],
+                progress=progress)
+            self.stdout.write('{0} revisions of {1} created.'.format(
+                created, name))
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from reversion.revisions import default_revision_manager
+
+from ...archive import export_history
+from ...core import ContentEnabledVersionAdapter
+
+
+class Command(BaseCommand):
+    help = ('Exports the revision history of models registered with '
+            'version_controlled_content as JSON Lines.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Limit the export to given models.')
+        parser.add_argument(
+            '--pk', action='append', dest='pks', default=[],
+            help='Limit the export to objects with given primary key, '
+                 'requires exactly one model.')
+        parser.add_argument(
+            '--output', '-o', dest='output',
+            help='File to write to, defaults to standard output.')
+        parser.add_argument(
+            '--chunk-size', type=int, dest='chunk_size', default=500,
+            help='Number of revisions to read per chunk.')
+
+    def get_models(self, options):
+        if options['models']:
+            try:
+                return [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+        return [
+            model for model in default_revision_manager.get_registered_models()
+            if isinstance(default_revision_manager.get_adapter(model),
+                          ContentEnabledVersionAdapter)]
+
+    def handle(self, *args, **options):
+        models = self.get_models(options)
+        objects = ()
+        if options['pks']:
+            if len(models) != 1:
+                raise CommandError('--pk requires exactly one model.')
+            objects = models[0]._default_manager.filter(pk__in=options['pks'])
+            models = ()
+
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8') as stream:
+                exported = export_history(
+                    stream, models, objects, options['chunk_size'])
+            self.stderr.write('{0} revisions exported.'.format(exported))
+        else:
+            export_history(
+                self.stdout, models, objects, options['chunk_size'])
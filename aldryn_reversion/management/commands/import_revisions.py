@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...archive import import_history
+
+
+class Command(BaseCommand):
+    help = 'Imports revision history exported by export_revisions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input', metavar='file',
+            help='JSON Lines file written by export_revisions.')
+        parser.add_argument(
+            '--chunk-size', type=int, dest='chunk_size', default=100,
+            help='Number of revisions to create per transaction.')
+
+    def handle(self, *args, **options):
+        def progress(imported):
+            self.stdout.write('Imported {0} revisions.'.format(imported))
+
+        with io.open(options['input'], encoding='utf-8') as stream:
+            try:
+                imported = import_history(
+                    stream, options['chunk_size'], progress)
+            except ValueError as e:
+                raise CommandError(e)
+        self.stdout.write('{0} revisions imported.'.format(imported))
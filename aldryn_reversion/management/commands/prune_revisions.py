@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from ...retention import (
+    RetentionPolicy, get_prunable_revision_ids, get_retention_policies,
+    prune_revisions,
+)
+
+
+class Command(BaseCommand):
+    help = ('Deletes revisions according to retention policies of models '
+            'registered with version_controlled_content.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Limit pruning to given models.')
+        parser.add_argument(
+            '--keep-last', type=int, dest='keep_last',
+            help='Override the number of revisions to keep per object.')
+        parser.add_argument(
+            '--keep-daily-after', type=int, dest='keep_daily_after',
+            help='Override the number of days after which only one '
+                 'revision per day is kept.')
+        parser.add_argument(
+            '--drop-older-than', type=int, dest='drop_older_than',
+            help='Override the number of days after which revisions are '
+                 'dropped.')
+        parser.add_argument(
+            '--chunk-size', type=int, dest='chunk_size', default=5000,
+            help='Maximum number of versions to delete per transaction.')
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only report the number of revisions to delete.')
+
+    def get_models(self, options):
+        if not options['models']:
+            return None
+        try:
+            return [apps.get_model(label) for label in options['models']]
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+    def get_policies(self, options, models=None):
+        """
+        Returns policies of all registered models, with overrides applied to
+        given models (all models by default), so that revisions kept by any
+        policy are kept.
+        """
+        overrides = dict(
+            (name, options[name])
+            for name in ('keep_last', 'keep_daily_after', 'drop_older_than')
+            if options.get(name) is not None)
+
+        policies = get_retention_policies()
+        if models is None:
+            models = list(policies)
+        for model in models:
+            policy = policies.get(model)
+            if overrides:
+                values = vars(policy).copy() if policy else {}
+                values.update(overrides)
+                policy = RetentionPolicy(**values)
+            if policy:
+                policies[model] = policy
+            else:
+                policies.pop(model, None)
+        return policies
+
+    def handle(self, *args, **options):
+        models = self.get_models(options)
+        policies = self.get_policies(options, models)
+        if not any(models is None or model in models for model in policies):
+            self.stdout.write('There are no retention policies.')
+            return
+
+        if options['dry_run']:
+            total = len(get_prunable_revision_ids(policies, models=models))
+            self.stdout.write('{0} revisions would be deleted.'.format(total))
+            return
+
+        def progress(deleted, total):
+            self.stdout.write(
+                'Deleted {0} of {1} revisions.'.format(deleted, total))
+
+        deleted = prune_revisions(
+            policies, chunk_size=options['chunk_size'], progress=progress,
+            models=models)
+        self.stdout.write('{0} revisions deleted.'.format(deleted))
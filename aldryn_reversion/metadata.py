@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of model metadata used when reverting and recovering objects.
+
+Metadata of a model is registered when the model is registered with
+version_controlled_content, and is introspected once, on first use (related
+models might not be loaded yet at registration time). Metadata of other
+models (placeholders, plugins, translations) is added on demand.
+"""
+from __future__ import unicode_literals
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.fields.related import ForeignKey
+from django.utils.functional import cached_property
+
+from cms.models.fields import PlaceholderField
+
+_registry = {}
+
+
+class ModelMetadata(object):
+
+    def __init__(self, model):
+        self.model = model
+
+    @cached_property
+    def fk_fields(self):
+        # process only FK and subclasses
+        return [field for field in self.model._meta.fields
+                if isinstance(field, ForeignKey)]
+
+    @cached_property
+    def fk_relations(self):
+        """
+        A list of dicts with FK field, target model and its blank and null
+        flags, for every FK relation of the model.
+        """
+        return [{
+            'fk_field': field,
+            'model': field.rel.to,
+            'blank': field.blank,
+            'null': field.null,
+        } for field in self.fk_fields]
+
+    @cached_property
+    def placeholder_field_names(self):
+        return [field.name for field in self.model._meta.fields
+                if type(field) == PlaceholderField]
+
+    @cached_property
+    def translation_model(self):
+        parler_meta = getattr(self.model, '_parler_meta', None)
+        if parler_meta is None:
+            return None
+        return parler_meta.root_model
+
+    @property
+    def content_type_id(self):
+        # content types are not available at registration time, and their ids
+        # may change when the table is flushed, rely on the content types
+        # cache instead of storing ids.
+        return ContentType.objects.get_for_model(self.model).pk
+
+    def get_fk_relations(self, blank=None):
+        """
+        Returns FK relations (see fk_relations) with content types of target
+        models. If blank is provided - filters by `blank` attribute value.
+        """
+        get_for_model = ContentType.objects.get_for_model
+        return [dict(relation, content_type=get_for_model(relation['model']))
+                for relation in self.fk_relations
+                if blank is None or relation['blank'] == blank]
+
+
+def register_model_metadata(model):
+    """
+    Registers metadata of given model, returns it.
+    """
+    if model not in _registry:
+        _registry[model] = ModelMetadata(model)
+    return _registry[model]
+
+
+def get_model_metadata(model):
+    """
+    Returns metadata of given model, registers it if needed.
+    """
+    try:
+        return _registry[model]
+    except KeyError:
+        return register_model_metadata(model)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Restore plans of the recover view.
+
+A restore plan holds everything recovering a version depends on: conflicts
+the user has to resolve first, conflicts which are resolved automatically,
+deleted placeholders of the object with their plugins, and translations.
+It is computed once, on the confirmation page, and stored in the cache
+(as version pks), so that the confirmation POST and the recover form reuse
+it. Plans are cached for ALDRYN_REVERSION_RESTORE_PLAN_TIMEOUT seconds,
+under the version, its revision and the namespace of the caller (conflict
+links depend on the admin), which takes no query of its own. Revisions do
+not change once they are saved, but objects can be deleted or restored
+since, so a cached plan is only used while the objects it checked still
+exist (or are still deleted), which takes one query per model instead of
+indexing and resolving the revision again.
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from reversion.models import Version
+
+from .utils import (
+    RevisionConflictResolver, RevisionIndex, VersionRow,
+    get_conflict_fks_versions, get_deleted_objects_versions,
+    get_deleted_placeholders_for_object,
+    get_indexed_translations_versions_for_object,
+    get_placeholders_plugins_versions,
+)
+from .version_cache import get_object_version
+
+# An object whose existence the plan depends on.
+CheckedObject = namedtuple(
+    'CheckedObject', ['content_type_id', 'object_id', 'deleted'])
+
+
+class RestorePlan(object):
+    """
+    Versions to restore together with a version, as lists of version pks:
+    conflict_links is a list of (version pk, recover view url) of conflicts
+    the user has to recover first, resolved_pks the automatically resolved
+    conflicts in restore order, placeholder_pks deleted placeholders of the
+    object, plugin_pks their plugins, and translation_pks the translations
+    the user can choose from. checked is a list of CheckedObject the plan
+    was computed from.
+    """
+
+    def __init__(self, version_pk, revision_id, conflict_links, resolved_pks,
+                 placeholder_pks, plugin_pks, translation_pks, checked=()):
+        self.version_pk = version_pk
+        self.revision_id = revision_id
+        self.conflict_links = conflict_links
+        self.resolved_pks = resolved_pks
+        self.placeholder_pks = placeholder_pks
+        self.plugin_pks = plugin_pks
+        self.translation_pks = translation_pks
+        self.checked = list(checked)
+        self._versions = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_versions'] = {}
+        return state
+
+    @classmethod
+    def compute(cls, version, get_conflict_link):
+        """
+        Computes the plan of given version. get_conflict_link is called
+        with every conflict version and returns the url of its recover view,
+        or None if the conflict can not be recovered by the user.
+        """
+        obj = get_object_version(version).object
+        revision = version.revision
+        # all lookups below are answered from one index of the revision
+        index = RevisionIndex(revision)
+
+        conflicts = get_conflict_fks_versions(
+            obj, version, revision, index=index)
+        conflict_links = []
+        non_reversible_by_user = []
+        for fk_version in conflicts:
+            link = get_conflict_link(fk_version)
+            if link is None:
+                non_reversible_by_user.append(fk_version)
+            else:
+                conflict_links.append((fk_version.pk, link))
+
+        placeholders = get_deleted_placeholders_for_object(
+            obj, revision, index)
+        resolved = []
+        indexes = [index]
+        if non_reversible_by_user:
+            resolver = RevisionConflictResolver(
+                non_reversible_by_user[0], non_reversible_by_user[1:],
+                index=index)
+            resolved = resolver.resolve()
+            indexes += [item for item in resolver.get_indexes()
+                        if item is not index]
+        plugins = get_placeholders_plugins_versions(
+            placeholders + resolved + [version], revision, index)
+        translations = get_indexed_translations_versions_for_object(
+            obj, index)
+
+        plan = cls(
+            version_pk=version.pk,
+            revision_id=version.revision_id,
+            conflict_links=conflict_links,
+            resolved_pks=[item.pk for item in resolved],
+            placeholder_pks=[item.pk for item in placeholders],
+            plugin_pks=[item.pk for item in plugins],
+            translation_pks=[item.pk for item in translations],
+            checked=[
+                CheckedObject(row.content_type_id, row.object_id, deleted)
+                for item in indexes
+                for row, deleted in item.get_checked()],
+        )
+        plan._versions.update((item.pk, item) for item in (
+            [version] + conflicts + resolved + placeholders + plugins +
+            translations))
+        return plan
+
+    def get_versions(self, pks):
+        """
+        Returns versions with given pks, fetching all versions of the plan
+        which were not fetched yet with one query.
+        """
+        missing = set(pks) - set(self._versions)
+        if missing:
+            missing.update(
+                pk for pk in self.get_all_pks() if pk not in self._versions)
+            self._versions.update(
+                (version.pk, version)
+                for version in Version.objects.filter(pk__in=missing))
+        return [self._versions[pk] for pk in pks if pk in self._versions]
+
+    def get_all_pks(self):
+        return ([self.version_pk] + [pk for pk, _ in self.conflict_links] +
+                self.resolved_pks + self.placeholder_pks + self.plugin_pks +
+                self.translation_pks)
+
+    def is_valid(self):
+        """
+        Returns True if the objects the plan was computed from still exist,
+        or are still deleted.
+        """
+        rows = [VersionRow(position, item.content_type_id, item.object_id,
+                           None)
+                for position, item in enumerate(self.checked)]
+        deleted = set(row.pk for row in get_deleted_objects_versions(rows))
+        return all(item.deleted == (position in deleted)
+                   for position, item in enumerate(self.checked))
+
+    def get_unresolved_conflict_pks(self):
+        """
+        Returns pks of conflicts which are neither resolved automatically
+        nor restored placeholders.
+        """
+        resolved = set(self.resolved_pks + self.placeholder_pks)
+        return [pk for pk, _ in self.conflict_links if pk not in resolved]
+
+
+def _get_cache_key(version, namespace):
+    # ids of deleted versions and revisions may be reused by some databases
+    revision = version.revision
+    return 'aldryn_reversion:restore_plan:{0}:{1}:{2}:{3}'.format(
+        namespace, version.pk, revision.pk,
+        revision.date_created.strftime('%Y%m%d%H%M%S%f'))
+
+
+def get_restore_plan(version, get_conflict_link, namespace=''):
+    """
+    Returns the cached RestorePlan of given version, computes and caches it
+    if needed (see RestorePlan.compute for get_conflict_link). Plans are
+    cached per namespace, which has to identify the links get_conflict_link
+    returns (i.e. the admin site and model).
+    """
+    key = _get_cache_key(version, namespace)
+    plan = cache.get(key)
+    if plan is None or not plan.is_valid():
+        plan = RestorePlan.compute(version, get_conflict_link)
+        cache.set(key, plan, getattr(
+            settings, 'ALDRYN_REVERSION_RESTORE_PLAN_TIMEOUT', 300))
+    else:
+        plan._versions[version.pk] = version
+    return plan
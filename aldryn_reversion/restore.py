@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk restore of deleted objects.
+
+Restores the objects of a set of versions ordered by FK dependency, inserting
+missing rows with one insert per model (and chunk), instead of reverting
+versions one by one. Models with save signal receivers still get their
+pre_save and post_save signals (raw=True, as for reverted versions), the
+receiver of the cms marks the placeholder of inserted plugins as dirty once
+per placeholder and language. Rows which still exist are updated with a raw
+save.
+"""
+from __future__ import unicode_literals
+
+import datetime
+from collections import OrderedDict
+
+from django.db import connections, router, transaction
+from django.db.models import signals
+
+from cms.models import CMSPlugin
+
+from .delta import get_revision_versions
+from .formats.reference import payloads_preloaded
+from .metadata import get_model_metadata
+from .snapshot import get_deserialized_objects
+from .translation_cache import batch_translation_cache
+from .utils import chunks
+
+
+def _get_dependency_order(items, get_dependencies):
+    """
+    Returns items ordered so that every item comes after items it depends
+    on. Dependency cycles are broken arbitrarily.
+    """
+    ordered = []
+    visited = set()
+    for root in items:
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, iter(get_dependencies(root)))]
+        while stack:
+            item, pending = stack[-1]
+            for dependency in pending:
+                if dependency not in visited:
+                    visited.add(dependency)
+                    stack.append(
+                        (dependency, iter(get_dependencies(dependency))))
+                    break
+            else:
+                stack.pop()
+                ordered.append(item)
+    return ordered
+
+
+def get_restore_order(models):
+    """
+    Returns given models ordered by FK dependency, related models first.
+    """
+    models = list(models)
+    known = set(models)
+
+    def get_dependencies(model):
+        return [relation['model']
+                for relation in get_model_metadata(model).fk_relations
+                if relation['model'] in known and relation['model'] != model]
+
+    return _get_dependency_order(models, get_dependencies)
+
+
+def _order_by_self_relations(model, deserialized_objects):
+    """
+    Orders objects of a model with relations to itself (i.e. plugin trees),
+    so that related objects are inserted first.
+    """
+    fields = [relation['fk_field']
+              for relation in get_model_metadata(model).fk_relations
+              if relation['model'] == model]
+    if not fields:
+        return deserialized_objects
+
+    by_pk = dict((item.object.pk, item) for item in deserialized_objects)
+
+    def get_dependencies(item):
+        related = (by_pk.get(getattr(item.object, field.attname))
+                   for field in fields)
+        return [other for other in related
+                if other is not None and other is not item]
+
+    return _get_dependency_order(deserialized_objects, get_dependencies)
+
+
+def _has_save_receivers(model):
+    return (signals.pre_save.has_listeners(model) or
+            signals.post_save.has_listeners(model))
+
+
+def _save_m2m(deserialized):
+    for accessor_name, object_list in (deserialized.m2m_data or {}).items():
+        manager = getattr(deserialized.object, accessor_name)
+        if hasattr(manager, 'set'):
+            manager.set(object_list)
+        else:
+            setattr(deserialized.object, accessor_name, object_list)
+    deserialized.m2m_data = None
+
+
+def _skip_plugin_bookkeeping(plugins):
+    """
+    Flags all but the first of given plugins per placeholder and language
+    with _no_reorder, which the pre_save receiver of the cms skips, so that
+    it marks every placeholder as dirty once instead of querying the
+    placeholder and its page for every plugin. Returns the flagged plugins.
+    """
+    seen = set()
+    flagged = []
+    for plugin in plugins:
+        key = (plugin.placeholder_id, plugin.language)
+        if key not in seen:
+            seen.add(key)
+        elif not hasattr(plugin, '_no_reorder'):
+            plugin._no_reorder = True
+            flagged.append(plugin)
+    return flagged
+
+
+def _bulk_insert(model, deserialized_objects, db):
+    """
+    Inserts given objects with one insert per chunk, as raw saves would do:
+    only the local fields, so objects of inherited models need the objects
+    of their parent models inserted separately.
+    """
+    objs = [item.object for item in deserialized_objects]
+    send_signals = _has_save_receivers(model)
+    flagged = []
+    if send_signals:
+        if issubclass(model, CMSPlugin):
+            flagged = _skip_plugin_bookkeeping(objs)
+        for obj in objs:
+            signals.pre_save.send(
+                sender=model, instance=obj, raw=True, using=db,
+                update_fields=None)
+
+    concrete_model = model._meta.concrete_model
+    fields = concrete_model._meta.local_concrete_fields
+    batch_size = max(
+        connections[db].ops.bulk_batch_size(fields, objs) or 1, 1)
+    for objs_chunk in chunks(objs, batch_size):
+        concrete_model._base_manager._insert(
+            objs_chunk, fields=fields, using=db, raw=True)
+
+    for item in deserialized_objects:
+        item.object._state.adding = False
+        item.object._state.db = db
+        if send_signals:
+            signals.post_save.send(
+                sender=model, instance=item.object, created=True,
+                update_fields=None, raw=True, using=db)
+        _save_m2m(item)
+    for obj in flagged:
+        del obj._no_reorder
+
+
+def _get_comparable_value(field, obj):
+    value = field.value_from_object(obj)
+    if isinstance(value, (datetime.datetime, datetime.time)):
+        # the json serializer keeps milliseconds only
+        value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+def _is_unchanged(deserialized, live_obj):
+    """
+    Returns True if a raw save of deserialized would not change live_obj.
+    """
+    if deserialized.m2m_data:
+        return False
+    opts = deserialized.object._meta.concrete_model._meta
+    return all(_get_comparable_value(field, deserialized.object) ==
+               _get_comparable_value(field, live_obj)
+               for field in opts.local_concrete_fields)
+
+
+def restore_versions(versions, db=None, skip_unchanged=False):
+    """
+    Restores objects of given versions. Objects of models which others
+    relate to are restored first, missing rows are inserted in bulk, rows
+    which still exist are updated with a raw save (like Version.revert).
+    If skip_unchanged is True, rows which equal their versions are not
+    saved at all. Restored translations are cached with one cache write.
+    Returns the list of restored (inserted or updated) objects.
+    """
+    versions = list(versions)
+    deserialized_by_model = OrderedDict()
+    seen = set()
+    with payloads_preloaded(versions):
+        for version in versions:
+            for deserialized in get_deserialized_objects(version):
+                model = deserialized.object.__class__
+                if (model, deserialized.object.pk) in seen:
+                    continue
+                seen.add((model, deserialized.object.pk))
+                deserialized_by_model.setdefault(model, []).append(
+                    deserialized)
+
+    restored = []
+    with batch_translation_cache(), transaction.atomic(using=db):
+        for model in get_restore_order(deserialized_by_model):
+            model_db = db or router.db_for_write(model)
+            deserialized_objects = _order_by_self_relations(
+                model, deserialized_by_model[model])
+
+            existing = {}
+            queryset = model._base_manager.using(model_db)
+            for objs_chunk in chunks(deserialized_objects):
+                pks = [item.object.pk for item in objs_chunk]
+                if skip_unchanged:
+                    existing.update(queryset.in_bulk(pks))
+                else:
+                    existing.update((pk, None) for pk in queryset.filter(
+                        pk__in=pks).values_list('pk', flat=True))
+
+            missing = []
+            for item in deserialized_objects:
+                if item.object.pk not in existing:
+                    missing.append(item)
+                    continue
+                live_obj = existing[item.object.pk]
+                if live_obj is not None and _is_unchanged(item, live_obj):
+                    continue
+                item.save(using=model_db)
+                restored.append(item.object)
+            if missing:
+                _bulk_insert(model, missing, model_db)
+                restored += [item.object for item in missing]
+    return restored
+
+
+def revert_revision(revision, db=None):
+    """
+    Restores all objects of given revision, like Revision.revert, including
+    plugins stored in placeholder snapshots and unchanged plugins of delta
+    encoded revisions. Only rows which differ from the revision are written.
+    Returns the list of restored objects.
+    """
+    return restore_versions(
+        get_revision_versions(revision), db=db, skip_unchanged=True)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Retention policies for revisions of models registered with
+version_controlled_content.
+
+A policy keeps the last keep_last revisions of every object, keeps only the
+latest revision per day of revisions older than keep_daily_after days and
+drops revisions older than drop_older_than days. A revision is pruned only
+if no policy of any object in it keeps it. Revisions which later delta
+encoded revisions are based on are kept, and references into pruned
+revisions are replaced by the payload they refer to. Revisions are deleted
+in transactions of a bounded number of versions.
+"""
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from cms.models import Placeholder
+from reversion.models import Revision, Version
+from reversion.revisions import default_revision_manager
+
+from .dedupe import materialize_references, references_materialized
+from .formats import DELTA_FORMAT
+from .formats.delta import loads
+from .metadata import get_model_metadata
+from .utils import chunks
+
+# keeps the number of query parameters of a batch within database limits
+MAX_BATCH_REVISIONS = 500
+
+
+def _get_day(date_created):
+    if timezone.is_aware(date_created):
+        date_created = timezone.localtime(date_created)
+    return date_created.date()
+
+
+class RetentionPolicy(object):
+
+    def __init__(self, keep_last=None, keep_daily_after=None,
+                 drop_older_than=None):
+        self.keep_last = keep_last
+        self.keep_daily_after = keep_daily_after
+        self.drop_older_than = drop_older_than
+
+    def __bool__(self):
+        return any(value is not None for value in (
+            self.keep_last, self.keep_daily_after, self.drop_older_than))
+    __nonzero__ = __bool__
+
+    def get_pruned(self, revisions, now=None):
+        """
+        Expects revisions of one object as a list of (revision id, date
+        created) tuples, latest first. Returns a tuple (ids of revisions to
+        keep, ids of revisions to prune).
+        """
+        if now is None:
+            now = timezone.now()
+        keep, prune = [], []
+        days = set()
+        for position, (revision_id, date_created) in enumerate(revisions):
+            age = now - date_created
+            if self.keep_last is not None and position < self.keep_last:
+                keep.append(revision_id)
+            elif (self.drop_older_than is not None and
+                    age > timedelta(days=self.drop_older_than)):
+                prune.append(revision_id)
+            elif (self.keep_daily_after is not None and
+                    age > timedelta(days=self.keep_daily_after)):
+                if _get_day(date_created) in days:
+                    prune.append(revision_id)
+                else:
+                    keep.append(revision_id)
+            elif (self.keep_last is not None and
+                    self.keep_daily_after is None and
+                    self.drop_older_than is None):
+                # only the last revisions are kept
+                prune.append(revision_id)
+            else:
+                keep.append(revision_id)
+            if self.keep_daily_after is not None:
+                days.add(_get_day(date_created))
+        return keep, prune
+
+
+def get_retention_policy(model, manager=None):
+    """
+    Returns the retention policy model was registered with, or None.
+    """
+    if manager is None:
+        manager = default_revision_manager
+    if not manager.is_registered(model):
+        return None
+    adapter = manager.get_adapter(model)
+    policy = RetentionPolicy(
+        keep_last=getattr(adapter, 'retention_keep_last', None),
+        keep_daily_after=getattr(adapter, 'retention_keep_daily_after', None),
+        drop_older_than=getattr(adapter, 'retention_drop_older_than', None),
+    )
+    return policy or None
+
+
+def get_retention_policies(manager=None):
+    """
+    Returns a dict of {model: retention policy} for all registered models
+    with a retention policy.
+    """
+    if manager is None:
+        manager = default_revision_manager
+    policies = {}
+    for model in manager.get_registered_models():
+        policy = get_retention_policy(model, manager)
+        if policy:
+            policies[model] = policy
+    return policies
+
+
+def _protect_delta_chains(prunable, owner_revisions):
+    """
+    Removes revisions from prunable which kept delta encoded revisions are
+    based on. Expects owner_revisions to be a dict of {(content type id,
+    object id): all revision ids of the object} for delta encoded objects.
+    """
+    if not owner_revisions:
+        return
+    # only kept revisions of objects with pruned revisions can depend on them
+    kept_revision_ids = set()
+    for revision_ids in owner_revisions.values():
+        kept_revision_ids.update(
+            revision_id for revision_id in revision_ids
+            if revision_id not in prunable)
+
+    placeholder_ct = ContentType.objects.get_for_model(Placeholder)
+    for revision_ids in chunks(sorted(kept_revision_ids)):
+        delta_versions = Version.objects.filter(
+            content_type=placeholder_ct, format=DELTA_FORMAT,
+            revision_id__in=revision_ids,
+        ).values_list('revision_id', 'serialized_data')
+        for revision_id, serialized_data in delta_versions.iterator():
+            manifest = loads(serialized_data)['manifest']
+            if manifest['base'] is None:
+                continue
+            owner = (manifest['owner'][0], manifest['owner'][1])
+            for owner_revision_id in owner_revisions.get(owner, []):
+                if manifest['base'] <= owner_revision_id < revision_id:
+                    prunable.discard(owner_revision_id)
+
+
+def get_prunable_revision_ids(policies=None, now=None, manager=None,
+                              models=None):
+    """
+    Returns a set of ids of revisions to prune according to policies (a dict
+    of {model: RetentionPolicy}, by default policies of registered models).
+    If models are given, only revisions pruned by their policies are
+    returned, but revisions kept by the policy of any other model are still
+    kept.
+    """
+    if policies is None:
+        policies = get_retention_policies(manager)
+
+    prunable = set()
+    kept = set()
+    owner_revisions = {}
+    for model, policy in policies.items():
+        content_type = ContentType.objects.get_for_model(model)
+        # revisions might have been delta encoded before, even if the model
+        # does not use placeholder deltas now.
+        deltas = bool(get_model_metadata(model).placeholder_field_names)
+        versions = Version.objects.filter(
+            content_type=content_type,
+        ).order_by('object_id', '-revision_id').values_list(
+            'object_id', 'revision_id', 'revision__date_created')
+
+        selected = models is None or model in models
+
+        def process(object_id, revisions):
+            keep, prune = policy.get_pruned(revisions, now)
+            kept.update(keep)
+            if selected:
+                prunable.update(prune)
+            # revisions pruned by the policy of another model in them might
+            # be the base of kept deltas of this object
+            if deltas and prune:
+                owner_revisions[(content_type.pk, object_id)] = [
+                    revision_id for revision_id, _ in revisions]
+
+        current, revisions = None, []
+        for object_id, revision_id, date_created in versions.iterator():
+            if object_id != current and revisions:
+                process(current, revisions)
+                revisions = []
+            current = object_id
+            revisions.append((revision_id, date_created))
+        if revisions:
+            process(current, revisions)
+
+    prunable -= kept
+    _protect_delta_chains(prunable, owner_revisions)
+    return prunable
+
+
+def get_revision_batches(revision_ids, chunk_size):
+    """
+    Yields lists of given revision ids with at most chunk_size versions
+    together (and at most MAX_BATCH_REVISIONS ids). Revisions with
+    more versions are yielded alone, they were saved in one transaction too.
+    """
+    batch, size = [], 0
+    for ids in chunks(sorted(revision_ids)):
+        counts = dict(Version.objects.filter(
+            revision_id__in=ids,
+        ).order_by().values_list('revision_id').annotate(Count('pk')))
+        for revision_id in ids:
+            count = counts.get(revision_id, 0)
+            if batch and (size + count > chunk_size or
+                          len(batch) == MAX_BATCH_REVISIONS):
+                yield batch
+                batch, size = [], 0
+            batch.append(revision_id)
+            size += count
+    if batch:
+        yield batch
+
+
+def prune_revisions(policies=None, now=None, chunk_size=5000, progress=None,
+                    manager=None, models=None):
+    """
+    Deletes revisions according to policies and models (see
+    get_prunable_revision_ids), every batch of revisions with at most
+    chunk_size versions in its own transaction (see get_revision_batches).
+    progress is called with (number of deleted revisions, total) after every
+    batch. Returns the number of deleted revisions.
+    """
+    prunable = get_prunable_revision_ids(policies, now, manager, models)
+
+    total = len(prunable)
+    deleted = 0
+    for revision_ids in get_revision_batches(prunable, chunk_size):
+        with transaction.atomic(), references_materialized():
+            materialize_references(revision_ids)
+            Version.objects.filter(revision_id__in=revision_ids).delete()
+            Revision.objects.filter(pk__in=revision_ids).delete()
+        deleted += len(revision_ids)
+        if progress is not None:
+            progress(deleted, total)
+    return deleted
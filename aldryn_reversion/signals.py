@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.dispatch import Signal
+
+# Sent after an instrumented revision operation finished, with
+# aldryn_reversion.instrumentation.Event as sender and an Event (holding the
+# operation name) as event.
+revision_operation = Signal(providing_args=['event'])
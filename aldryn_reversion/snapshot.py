@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Single document placeholder snapshots.
+
+For models registered with placeholder_snapshots=True the plugins of a
+placeholder are not stored as versions of their own (two per plugin: the
+base plugin and the plugin instance), but within the version of their
+placeholder, see aldryn_reversion.formats.snapshot.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from cms.models import CMSPlugin, Placeholder
+from reversion.revisions import default_revision_manager
+
+from .delta import uses_placeholder_deltas
+from .formats import SNAPSHOT_FORMAT
+from .formats.delta import loads
+from .formats.snapshot import dumps
+from . import version_cache
+
+
+def uses_placeholder_snapshots(model, manager=None):
+    """
+    Returns True if model is registered with placeholder snapshots. Delta
+    encoded placeholders take precedence over snapshots.
+    """
+    if manager is None:
+        manager = default_revision_manager
+    if not manager.is_registered(model):
+        return False
+    adapter = manager.get_adapter(model)
+    return (getattr(adapter, 'placeholder_snapshots', False) and
+            not uses_placeholder_deltas(model, manager))
+
+
+def get_snapshot_plugin_keys(version):
+    """
+    Returns a list of (content type id, object id) of plugins stored in a
+    placeholder snapshot version, or None if the version is not a snapshot.
+    """
+    if version.format != SNAPSHOT_FORMAT:
+        return None
+    return [(content_type_id, object_id) for content_type_id, object_id, _, _
+            in loads(version.serialized_data)['plugins']]
+
+
+def get_deserialized_objects(version):
+    """
+    Returns a list of all deserialized objects stored in given version: the
+    placeholder and its plugins for snapshots, the object otherwise.
+    Objects are deserialized once, see aldryn_reversion.version_cache.
+    """
+    return version_cache.get_deserialized_objects(version)
+
+
+def get_snapshot_versions_data(obj, versions_data, manager=None):
+    """
+    Returns versions data (as returned by bulk.get_versions_data) for a
+    revision of obj, where plugins of obj's placeholders are stored within
+    the versions of their placeholders.
+    Returns versions_data as is, if obj does not use placeholder snapshots.
+    """
+    if manager is None:
+        manager = default_revision_manager
+    if not uses_placeholder_snapshots(obj.__class__, manager):
+        return versions_data
+
+    placeholder_ids = set(
+        getattr(obj, '{0}_id'.format(name))
+        for name in obj._meta.placeholder_field_names)
+
+    plugins = dict((pk, []) for pk in placeholder_ids if pk is not None)
+    result = OrderedDict()
+    for item, data in versions_data.items():
+        if isinstance(item, CMSPlugin) and item.placeholder_id in plugins:
+            plugins[item.placeholder_id].append((
+                data['content_type'].pk, data['object_id'],
+                data['format'], data['serialized_data']))
+        else:
+            result[item] = data
+
+    for item, data in result.items():
+        if isinstance(item, Placeholder) and item.pk in plugins:
+            result[item] = dict(
+                data,
+                format=SNAPSHOT_FORMAT,
+                serialized_data=dumps(
+                    data['serialized_data'], data['format'],
+                    plugins[item.pk]),
+            )
+    return result
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of revision capture, revert and recover on the test_app models.
+
+Every benchmark is run for every combination of the data sizes it depends on
+(plugins per placeholder, translations, FK chain depth) and reports wall
+time, query count and peak memory (Python 3 only) of the operation. Data is
+created within a transaction which is rolled back after every run.
+
+Run the suite with ``python benchmark.py`` from the repository root.
+"""
+from __future__ import unicode_literals
+
+import argparse
+import itertools
+import sys
+from collections import namedtuple
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from django.conf import global_settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment,
+)
+
+from cms.api import add_plugin
+from reversion.revisions import default_revision_manager
+
+from aldryn_reversion.bulk import save_revision
+from aldryn_reversion.core import create_revision
+from aldryn_reversion.instrumentation import QueryCounter
+from aldryn_reversion.utils import RecursiveRevisionConflictResolver
+
+from .project.test_app.models import FKtoSelf, WithPlaceholder, WithTranslations
+
+Measurement = namedtuple(
+    'Measurement', ['name', 'sizes', 'time', 'queries', 'peak_memory'])
+
+DEFAULT_SIZES = {
+    'plugins': [10, 100],
+    'translations': [2, 20],
+    'depth': [10, 100],
+}
+
+
+def _get_admin_request(user, post_data=None):
+    request = RequestFactory().post('/', post_data or {})
+    request.LANGUAGE_CODE = 'en'
+    request.current_page = None
+    request.session = 'session'
+    request._messages = FallbackStorage(request)
+    request.user = user
+    return request
+
+
+def _get_model_admin(model):
+    admin.autodiscover()
+    return admin.site._registry[model]
+
+
+def _get_user():
+    return User.objects.create(
+        username='benchmark', is_staff=True, is_superuser=True)
+
+
+def _create_with_plugins(plugins):
+    obj = WithPlaceholder.objects.create()
+    for position in range(plugins):
+        add_plugin(obj.content, 'TextPlugin', 'en',
+                   body='text {0}'.format(position))
+    return obj
+
+
+def _create_with_translations(translations):
+    obj = WithTranslations()
+    languages = [code for code, _ in global_settings.LANGUAGES]
+    for language in languages[:translations]:
+        obj.set_current_language(language)
+        obj.description = 'description {0}'.format(language)
+    obj.save()
+    return obj
+
+
+class Benchmark(object):
+    """
+    A benchmark prepares data in setup() and runs the measured operation in
+    run(). sizes lists the names of the data sizes it depends on.
+    """
+    name = None
+    sizes = ()
+
+    def setup(self, **sizes):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+
+class CreateRevision(Benchmark):
+    name = 'create_revision'
+    sizes = ('plugins',)
+
+    def setup(self, plugins):
+        self.obj = _create_with_plugins(plugins)
+
+    def run(self):
+        create_revision(self.obj)
+
+
+class CreateRevisionWithTranslations(Benchmark):
+    name = 'create_revision (translations)'
+    sizes = ('translations',)
+
+    def setup(self, translations):
+        self.obj = _create_with_translations(translations)
+
+    def run(self):
+        create_revision(self.obj)
+
+
+class RevisionView(Benchmark):
+    name = 'revision_view'
+    sizes = ('plugins',)
+
+    def setup(self, plugins):
+        self.obj = _create_with_plugins(plugins)
+        self.version = create_revision(self.obj).version_set.get(
+            object_id=str(self.obj.pk),
+            content_type__model=WithPlaceholder._meta.model_name)
+        for plugin in self.obj.content.get_plugins():
+            instance = plugin.get_plugin_instance()[0]
+            instance.body = 'changed'
+            instance.save()
+        self.request = _get_admin_request(_get_user())
+        self.model_admin = _get_model_admin(WithPlaceholder)
+
+    def run(self):
+        response = self.model_admin.revision_view(
+            self.request, str(self.obj.pk), str(self.version.pk))
+        assert response.status_code == 302, response.status_code
+
+
+class RecoverView(Benchmark):
+    name = 'recover_view'
+    sizes = ('plugins',)
+
+    def get_object(self, **sizes):
+        return _create_with_plugins(**sizes)
+
+    def get_post_data(self):
+        return {}
+
+    def setup(self, **sizes):
+        obj = self.get_object(**sizes)
+        model = obj.__class__
+        self.revision = create_revision(obj)
+        self.version = self.revision.version_set.get(
+            object_id=str(obj.pk), content_type__model=model._meta.model_name)
+        for name in getattr(model._meta, 'placeholder_field_names', []):
+            getattr(obj, name).delete()
+        obj.delete()
+        self.request = _get_admin_request(_get_user(), self.get_post_data())
+        self.model_admin = _get_model_admin(model)
+
+    def run(self):
+        response = self.model_admin.recover_view(
+            self.request, str(self.version.pk))
+        assert response.status_code == 302, response.status_code
+
+
+class RecoverViewWithTranslations(RecoverView):
+    name = 'recover_view (translations)'
+    sizes = ('translations',)
+
+    def get_object(self, **sizes):
+        return _create_with_translations(**sizes)
+
+    def get_post_data(self):
+        translation_model = WithTranslations._parler_meta.root_model
+        return {'translations': [
+            version.pk for version in self.revision.version_set.filter(
+                content_type__model=translation_model._meta.model_name)]}
+
+
+class ConflictResolver(Benchmark):
+    name = 'RecursiveRevisionConflictResolver'
+    sizes = ('depth',)
+
+    def setup(self, depth):
+        chain = [FKtoSelf.objects.create(pk=1, self_relation_id=1)]
+        for position in range(depth - 1):
+            chain.append(FKtoSelf.objects.create(self_relation=chain[-1]))
+        save_revision(chain, follow=False)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {0}'.format(FKtoSelf._meta.db_table))
+        self.version = default_revision_manager.get_for_object(chain[-1])[0]
+
+    def run(self):
+        RecursiveRevisionConflictResolver(self.version).resolve()
+
+
+BENCHMARKS = [
+    CreateRevision, CreateRevisionWithTranslations, RevisionView,
+    RecoverView, RecoverViewWithTranslations, ConflictResolver,
+]
+
+
+def _run_once(benchmark, sizes, trace_memory=False):
+    """
+    Runs benchmark once in a transaction which is rolled back, returns a
+    tuple (wall time, query count, peak memory).
+    """
+    peak_memory = None
+    with transaction.atomic():
+        benchmark.setup(**sizes)
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            # counts all queries, unlike the bounded queries log
+            with QueryCounter() as queries:
+                start = default_timer()
+                benchmark.run()
+                elapsed = default_timer() - start
+            if trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        transaction.set_rollback(True)
+    return elapsed, queries.count, peak_memory
+
+
+def measure(benchmark, sizes, repeat=3):
+    """
+    Returns a Measurement of benchmark for given sizes: the best wall time
+    and the query count of repeat runs and the peak memory of a separate
+    run with memory tracing.
+    """
+    times = []
+    for _ in range(repeat):
+        elapsed, queries, _ = _run_once(benchmark, sizes)
+        times.append(elapsed)
+    peak_memory = None
+    if tracemalloc is not None:
+        peak_memory = _run_once(benchmark, sizes, trace_memory=True)[2]
+    return Measurement(benchmark.name, sizes, min(times), queries, peak_memory)
+
+
+def run_benchmarks(sizes=None, repeat=3, benchmarks=None):
+    """
+    Yields Measurements of benchmarks (all by default) for every combination
+    of sizes (a dict of {size name: list of values}, see DEFAULT_SIZES).
+    """
+    sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+    for benchmark_cls in benchmarks or BENCHMARKS:
+        benchmark = benchmark_cls()
+        names = benchmark.sizes
+        for values in itertools.product(*(sizes[name] for name in names)):
+            yield measure(benchmark, dict(zip(names, values)), repeat)
+
+
+def format_measurement(measurement):
+    sizes = ', '.join('{0}={1}'.format(name, value)
+                      for name, value in sorted(measurement.sizes.items()))
+    peak_memory = ('{0:.1f} KiB'.format(measurement.peak_memory / 1024.0)
+                   if measurement.peak_memory is not None else '-')
+    return '{0:<36} {1:<18} {2:>10.1f} ms {3:>6} queries {4:>14}'.format(
+        measurement.name, sizes, measurement.time * 1000,
+        measurement.queries, peak_memory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks revision capture, revert and recover.')
+    for name, default in sorted(DEFAULT_SIZES.items()):
+        parser.add_argument(
+            '--{0}'.format(name), type=int, nargs='+', default=default,
+            help='Values of the {0} data size (default: {1}).'.format(
+                name, ' '.join(str(value) for value in default)))
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Number of timed runs per measurement (default: 3).')
+    parser.add_argument(
+        '--only', nargs='+', metavar='NAME',
+        help='Run only benchmarks whose name contains one of given names.')
+    args = parser.parse_args(argv)
+
+    benchmarks = BENCHMARKS
+    if args.only:
+        benchmarks = [benchmark for benchmark in BENCHMARKS
+                      if any(name in benchmark.name for name in args.only)]
+    sizes = dict((name, getattr(args, name)) for name in DEFAULT_SIZES)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        for measurement in run_benchmarks(sizes, args.repeat, benchmarks):
+            sys.stdout.write(format_measurement(measurement) + '\n')
+            sys.stdout.flush()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
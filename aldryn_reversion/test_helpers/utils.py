@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for tests of registration options and of placeholder contents.
+"""
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+
+from reversion.revisions import default_revision_manager
+
+_missing = object()
+
+
+@contextmanager
+def adapter_options(model, manager=None, **options):
+    """
+    Sets given registration options (i.e. placeholder_deltas=True) on the
+    version adapter of model within the block, and restores the previous
+    ones afterwards. Yields the adapter.
+    """
+    if manager is None:
+        manager = default_revision_manager
+
+    adapter = manager.get_adapter(model)
+    previous = dict((name, adapter.__dict__.get(name, _missing))
+                    for name in options)
+    for name, value in options.items():
+        setattr(adapter, name, value)
+    try:
+        yield adapter
+    finally:
+        for name, value in previous.items():
+            if value is _missing:
+                delattr(adapter, name)
+            else:
+                setattr(adapter, name, value)
+
+
+class AdapterOptionsMixin(object):
+    """
+    Test case mixin which sets adapter_options on the version adapter of
+    adapter_model (see adapter_options) for every test, available as
+    self.adapter.
+    """
+    adapter_model = None
+    adapter_options = {}
+
+    def setUp(self):
+        super(AdapterOptionsMixin, self).setUp()
+        self._adapter_options = adapter_options(
+            self.adapter_model, **self.adapter_options)
+        self.adapter = self._adapter_options.__enter__()
+
+    def tearDown(self):
+        self._adapter_options.__exit__(None, None, None)
+        super(AdapterOptionsMixin, self).tearDown()
+
+
+def get_bodies(placeholder):
+    """
+    Returns the sorted bodies of the text plugins of placeholder.
+    """
+    return sorted(plugin.get_plugin_instance()[0].body
+                  for plugin in placeholder.cmsplugin_set.all())
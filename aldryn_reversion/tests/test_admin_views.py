@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
-from django.db import transaction
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 
 from reversion.models import Version
 from reversion.revisions import (
@@ -12,11 +13,16 @@ from django.core.urlresolvers import reverse, NoReverseMatch
 from django.test import Client
 
 from cms import api
+from cms.models import CMSPlugin
 
 from aldryn_reversion.test_helpers.project.test_app.models import (
     SimpleRegistered, SimpleNoAdmin, SimpleFK, SimpleRequiredFK, BlankFK,
+    WithPlaceholder,
 )
 
+from ..core import create_revision
+from ..plan import get_restore_plan
+
 from .base import (
     HelperModelsObjectsSetupMixin, CMSRequestBasedMixin, ReversionBaseTestCase,
     get_version_for_object,
@@ -30,12 +36,10 @@ VERSIONS_INFO = {
     'conflict': RESOLVABLE_CONFLICT_STR,
     'non_resolavable': NON_RESOLVABLE_CONFLICT_STR
 }
-PLACEHOLDER_INFO = (
-    'The following placeholders were deleted and will be restored')
+PLACEHOLDER_INFO = 'deleted and will be restored'
+RESTORED_INFO = '(deleted, will be restored)'
 CONFLICT_INFO = 'Please restore required related objects first'
-NON_RESOLVABLE_CONFLICT_INFO = (
-    'The following conflicts would be recovered automatically'
-)
+NON_RESOLVABLE_CONFLICT_INFO = 'would be recovered automatically'
 ALL_INFO_MESSAGES = [PLACEHOLDER_INFO, CONFLICT_INFO,
                      NON_RESOLVABLE_CONFLICT_INFO]
 REVERT_BUTTON = RECOVER_BUTTON = (
@@ -300,6 +304,86 @@ class ReversionRecoverAdminTestCase(AdminUtilsMixin,
         self.assertEqual(SimpleFK.objects.count(), 1)
         self.assertEqual(SimpleNoAdmin.objects.count(), 1)
 
+    def test_recover_restores_placeholder_plugins_in_bulk(self):
+        obj = WithPlaceholder.objects.create()
+        for position in range(20):
+            api.add_plugin(obj.content, 'TextPlugin', 'en',
+                           body='text {0}'.format(position))
+        create_revision(obj)
+        version = get_version_for_object(obj)
+        obj_pk, placeholder_pk = obj.pk, obj.content.pk
+        obj.content.delete()
+        obj.delete()
+        self.assertEqual(
+            CMSPlugin.objects.filter(placeholder_id=placeholder_pk).count(), 0)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.post_recover_view_response(version)
+        self.assertEqual(response.status_code, 302)
+        obj = WithPlaceholder.objects.get(pk=obj_pk)
+        self.assertEqual(obj.content.pk, placeholder_pk)
+        plugins = obj.content.get_plugins()
+        self.assertEqual(
+            sorted(plugin.get_plugin_instance()[0].body for plugin in plugins),
+            sorted('text {0}'.format(position) for position in range(20)))
+        # one insert per model: object, placeholder, plugin and text plugin
+        inserts = [query for query in context.captured_queries
+                   if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 4)
+
+    def test_recover_reuses_restore_plan(self):
+        obj = WithPlaceholder.objects.create()
+        for position in range(5):
+            api.add_plugin(obj.content, 'TextPlugin', 'en',
+                           body='text {0}'.format(position))
+        create_revision(obj)
+        version = get_version_for_object(obj)
+        placeholder_pk = obj.content.pk
+        obj.content.delete()
+        obj.delete()
+
+        with CaptureQueriesContext(connection) as computed:
+            response = self.get_recover_view_response(version)
+        self.assertContains(response, PLACEHOLDER_INFO)
+        # the placeholder is marked in the listing of the revision only
+        self.assertContains(response, RESTORED_INFO, count=1)
+        self.assertContains(response, VERSION_INFO.format(
+            **self.build_string_args(Version.objects.get(
+                revision_id=version.revision_id,
+                content_type__model='placeholder'))), count=1)
+        with CaptureQueriesContext(connection) as cached:
+            response = self.get_recover_view_response(version)
+        self.assertContains(response, PLACEHOLDER_INFO)
+        self.assertLess(len(cached), len(computed))
+
+        response = self.post_recover_view_response(version)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            CMSPlugin.objects.filter(placeholder_id=placeholder_pk).count(), 5)
+        # the plan of the recovered object is not used anymore
+        response = self.get_recover_view_response(version)
+        self.assertNotContains(response, PLACEHOLDER_INFO)
+
+    def test_restore_plans_per_namespace(self):
+        conflict_version = get_version_for_object(self.simple_registered)
+        version = Version.objects.select_related('revision').get(
+            pk=get_version_for_object(self.simple_required_fk).pk)
+        self.simple_registered.delete()
+        self.simple_required_fk.delete()
+
+        # conflict links of one admin are not used by another one
+        for namespace in ('first', 'second', 'first'):
+            plan = get_restore_plan(
+                version, lambda conflict: namespace, namespace=namespace)
+            self.assertEqual(plan.conflict_links,
+                             [(conflict_version.pk, namespace)])
+
+        # cached plans are looked up without querying revisions
+        with CaptureQueriesContext(connection) as context:
+            get_restore_plan(version, None, namespace='first')
+        self.assertFalse([query for query in context.captured_queries
+                          if 'reversion_revision' in query['sql']])
+
 
 class ReversionRevisionAdminTestCase(AdminUtilsMixin,
                                      CMSRequestBasedMixin,
@@ -360,6 +444,87 @@ class ReversionRevisionAdminTestCase(AdminUtilsMixin,
             pk=self.simple_registered.pk)
         self.assertEquals(self.simple_registered.position, initial_position)
 
+    def test_revision_view_writes_only_changed_rows(self):
+        obj = self.with_placeholder
+        plugins = [api.add_plugin(obj.content, 'TextPlugin', 'en',
+                                  body='text {0}'.format(position))
+                   for position in range(20)]
+        create_revision(obj)
+        version = get_version_for_object(obj)
+        plugins[0].body = 'changed'
+        plugins[0].save()
+        stale = api.add_plugin(obj.content, 'TextPlugin', 'en', body='stale')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.post_revision_veiw_response(obj, version)
+        self.assertEqual(response.status_code, 302)
+        bodies = sorted(plugin.get_plugin_instance()[0].body
+                        for plugin in obj.content.get_plugins())
+        self.assertEqual(
+            bodies, sorted('text {0}'.format(position)
+                           for position in range(20)))
+        self.assertFalse(CMSPlugin.objects.filter(pk=stale.pk).exists())
+        # only the changed text plugin (and its base plugin, which changed
+        # date was updated) is saved again
+        writes = [query for query in context.captured_queries
+                  if query['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(len(writes), 2)
+
+    def test_revision_view_groups_large_revisions(self):
+        obj = self.with_placeholder
+        for position in range(6):
+            api.add_plugin(obj.content, 'TextPlugin', 'en',
+                           body='text {0}'.format(position))
+        revision = create_revision(obj)
+        version = get_version_for_object(obj)
+        plugin_versions = revision.version_set.filter(
+            content_type__model='cmsplugin').order_by('object_id_int')
+        admin_instance = self.get_admin_instance_for_object(obj)
+        url = self.get_admin_url_for_obj(obj, 'revision', version)
+
+        def get_response(query=''):
+            request = self.get_su_request('en', url + query)
+            return admin_instance.revision_view(
+                request, str(obj.pk), str(version.pk))
+
+        admin_instance.revision_confirmation_page_size = 4
+        try:
+            # only the number of versions per model is listed
+            with CaptureQueriesContext(connection) as context:
+                response = get_response()
+            summary_queries = len(context.captured_queries)
+            self.assertContains(response, 'Cms plugin (6)')
+            self.assertNotContains(response, VERSION_INFO.format(
+                **self.build_string_args(plugin_versions[0])))
+
+            # versions of a model are listed on request, paginated
+            content_type_id = plugin_versions[0].content_type_id
+            with CaptureQueriesContext(connection) as context:
+                response = get_response(
+                    '?content_type={0}&page=2'.format(content_type_id))
+            # at most a count and a page of versions more
+            self.assertLessEqual(
+                len(context.captured_queries), summary_queries + 2)
+            for plugin_version in plugin_versions[:4]:
+                self.assertNotContains(response, VERSION_INFO.format(
+                    **self.build_string_args(plugin_version)))
+            for plugin_version in plugin_versions[4:]:
+                self.assertContains(response, VERSION_INFO.format(
+                    **self.build_string_args(plugin_version)))
+            self.assertContains(response, 'Page 2 of 2')
+
+            # links keep the filters of the changelist
+            response = get_response(
+                '?_changelist_filters=q%3Dtext&content_type={0}'.format(
+                    content_type_id))
+            self.assertContains(response, 'Page 1 of 2')
+            self.assertContains(
+                response,
+                '_changelist_filters=q%3Dtext&amp;content_type={0}'
+                '&amp;page=2'.format(content_type_id))
+        finally:
+            del admin_instance.revision_confirmation_page_size
+
     def test_admin_create_obj_view(self):
         """Test that admin create view works and actually creates an object"""
         obj_count = SimpleRegistered.objects.count()
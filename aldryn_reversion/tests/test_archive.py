@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.utils import six
+
+from reversion.models import Revision, Version
+from reversion.revisions import default_revision_manager
+
+from cms.api import add_plugin
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    WithPlaceholder, WithTranslations,
+)
+from aldryn_reversion.test_helpers.utils import adapter_options
+
+from ..archive import export_history, import_history
+from ..core import create_revision
+from ..dedupe import get_reference
+from ..delta import get_manifest, get_revision_versions
+from ..formats import DELTA_FORMAT, REFERENCE_FORMAT
+
+from .base import ReversionBaseTestCase
+
+
+class ArchiveTestCase(ReversionBaseTestCase):
+
+    def export(self, **kwargs):
+        stream = six.StringIO()
+        export_history(stream, **kwargs)
+        return stream.getvalue()
+
+    def reimport(self, exported, **kwargs):
+        Revision.objects.all().delete()
+        return import_history(exported.splitlines(True), **kwargs)
+
+    def test_round_trip_with_deltas(self):
+        with adapter_options(WithPlaceholder, placeholder_deltas=True,
+                             placeholder_keyframe_interval=3):
+            obj = WithPlaceholder.objects.create()
+            plugin = add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+            add_plugin(obj.content, 'TextPlugin', 'en', body='unchanged')
+            create_revision(obj, comment='keyframe')
+            plugin.body = 'changed'
+            plugin.save()
+            create_revision(obj, comment='delta')
+            expected = [
+                (revision.date_created, revision.comment,
+                 len(get_revision_versions(revision)))
+                for revision in Revision.objects.order_by('pk')]
+
+            exported = self.export(models=[WithPlaceholder])
+            self.assertEqual(len(exported.splitlines()), 2)
+            self.assertEqual(self.reimport(exported, chunk_size=1), 2)
+
+        revisions = list(Revision.objects.order_by('pk'))
+        self.assertEqual([
+            (revision.date_created, revision.comment,
+             len(get_revision_versions(revision)))
+            for revision in revisions], expected)
+        delta = revisions[1].version_set.get(format=DELTA_FORMAT)
+        self.assertEqual(get_manifest(delta)['base'], revisions[0].pk)
+
+    def test_round_trip_with_references(self):
+        with adapter_options(WithPlaceholder,
+                             deduplicate_placeholder_plugins=True):
+            obj = WithPlaceholder.objects.create()
+            add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+            create_revision(obj)
+            create_revision(obj)
+
+        # payloads of earlier chunks are looked up in the database
+        self.assertEqual(
+            self.reimport(self.export(objects=[obj]), chunk_size=1), 2)
+        references = Version.objects.filter(format=REFERENCE_FORMAT)
+        # the text plugin and its base plugin
+        self.assertEqual(len(references), 2)
+        for reference in references:
+            payload = Version.objects.get(pk=get_reference(reference)[0])
+            self.assertNotEqual(payload.revision_id, reference.revision_id)
+            self.assertEqual(payload.object_id, reference.object_id)
+
+    def test_export_selected_objects(self):
+        obj = WithTranslations.objects.create(description='text')
+        obj.set_current_language('de')
+        obj.description = 'Text'
+        obj.save()
+        create_revision(obj)
+        create_revision(WithTranslations.objects.create(description='other'))
+
+        lines = self.export(objects=[obj]).splitlines()
+        self.assertEqual(len(lines), 1)
+        # the object and both of its translations
+        self.assertEqual(
+            sorted(version['content_type'][1]
+                   for version in json.loads(lines[0])['versions']),
+            ['withtranslations', 'withtranslationstranslation',
+             'withtranslationstranslation'])
+
+    def test_import_missing_base_revision(self):
+        with adapter_options(WithPlaceholder, placeholder_deltas=True):
+            obj = WithPlaceholder.objects.create()
+            create_revision(obj)
+            create_revision(obj)
+
+        lines = self.export(models=[WithPlaceholder]).splitlines()
+        with self.assertRaises(ValueError):
+            self.reimport(lines[1])
+
+    def test_commands(self):
+        obj = WithPlaceholder.objects.create()
+        add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        create_revision(obj)
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'history.jsonl')
+        try:
+            call_command('export_revisions', 'test_app.WithPlaceholder',
+                         output=path, stderr=six.StringIO())
+            Revision.objects.all().delete()
+            out = six.StringIO()
+            call_command('import_revisions', path, stdout=out)
+        finally:
+            shutil.rmtree(directory)
+        self.assertIn('1 revisions imported.', out.getvalue())
+        self.assertEqual(
+            len(default_revision_manager.get_for_object(obj)), 1)
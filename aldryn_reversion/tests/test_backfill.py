@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.utils import six
+
+from reversion.models import Revision, Version
+from reversion.revisions import default_revision_manager
+
+from cms.api import add_plugin
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    SimpleRegistered, WithPlaceholder, WithTranslations,
+)
+
+from ..backfill import backfill, get_pk_chunks
+
+from .base import ReversionBaseTestCase
+
+
+class BackfillTestCase(ReversionBaseTestCase):
+
+    def test_backfill(self):
+        objs = [WithPlaceholder.objects.create() for _ in range(3)]
+        for obj in objs:
+            add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        processed = []
+
+        def progress(count, total):
+            processed.append((count, total))
+
+        self.assertEqual(
+            backfill(WithPlaceholder, chunk_size=2, progress=progress), 3)
+        self.assertEqual(processed, [(2, 3), (3, 3)])
+        self.assertEqual(Revision.objects.count(), 3)
+        for obj in objs:
+            versions = default_revision_manager.get_for_object(obj)
+            self.assertEqual(len(versions), 1)
+            # the placeholder, the base plugin and the plugin instance
+            self.assertEqual(versions[0].revision.version_set.count(), 4)
+
+        # objects with revisions are skipped
+        obj = WithPlaceholder.objects.create()
+        self.assertEqual(backfill(WithPlaceholder, chunk_size=2), 1)
+        self.assertEqual(Revision.objects.count(), 4)
+        self.assertEqual(backfill(WithPlaceholder), 0)
+        self.assertEqual(Revision.objects.count(), 4)
+
+    def test_backfill_translations(self):
+        obj = WithTranslations.objects.create(description='english')
+        obj.set_current_language('de')
+        obj.description = 'german'
+        obj.save()
+
+        self.assertEqual(backfill(WithTranslations), 1)
+        revision = default_revision_manager.get_for_object(obj)[0].revision
+        translation_model = WithTranslations._parler_meta.root_model
+        self.assertEqual(revision.version_set.filter(
+            content_type__model=translation_model._meta.model_name,
+        ).count(), 2)
+
+    def test_pk_chunks(self):
+        pks = [SimpleRegistered.objects.create(position=i).pk
+               for i in range(5)]
+        self.assertEqual(list(get_pk_chunks(SimpleRegistered, 2)),
+                         [pks[:2], pks[2:4], pks[4:]])
+
+    def test_command(self):
+        SimpleRegistered.objects.create(position=1)
+        WithPlaceholder.objects.create()
+        out = six.StringIO()
+        call_command('backfill_revisions', 'test_app.SimpleRegistered',
+                     stdout=out)
+        self.assertIn('1 revisions of', out.getvalue())
+        self.assertEqual(Version.objects.filter(
+            content_type__model='simpleregistered').count(), 1)
+        self.assertFalse(Version.objects.filter(
+            content_type__model='withplaceholder').exists())
+
+        call_command('backfill_revisions', stdout=six.StringIO())
+        self.assertTrue(Version.objects.filter(
+            content_type__model='withplaceholder').exists())
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from aldryn_reversion.test_helpers.benchmarks import (
+    BENCHMARKS, format_measurement, run_benchmarks,
+)
+
+from .base import ReversionBaseTestCase
+
+
+class BenchmarksTestCase(ReversionBaseTestCase):
+
+    def test_benchmarks(self):
+        sizes = {'plugins': [2], 'translations': [2], 'depth': [3]}
+        measurements = list(run_benchmarks(sizes, repeat=1))
+        self.assertEqual([measurement.name for measurement in measurements],
+                         [benchmark.name for benchmark in BENCHMARKS])
+        for measurement in measurements:
+            self.assertGreater(measurement.queries, 0)
+            self.assertIn(measurement.name, format_measurement(measurement))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.contrib import admin
+from django.core import serializers
+
+from reversion.models import Version
+from reversion.revisions import (
+    default_revision_manager, revision_context_manager,
+)
+
+from cms.api import add_plugin
+from cms.models import CMSPlugin
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    ComplexOneFK, WithPlaceholder,
+)
+from aldryn_reversion.test_helpers.utils import (
+    AdapterOptionsMixin, adapter_options,
+)
+
+from ..core import create_revision
+from ..formats import COMPRESSED_FORMAT, REFERENCE_FORMAT
+from ..formats.compressed import dumps
+
+from .base import CMSRequestBasedMixin, ReversionBaseTestCase
+
+BODY = '<p>Lorem ipsum <strong>dolor</strong> sit amet.</p>' * 50
+
+
+class CompressionTestCase(AdapterOptionsMixin, CMSRequestBasedMixin,
+                          ReversionBaseTestCase):
+    adapter_model = WithPlaceholder
+    adapter_options = {'compress_versions': True}
+
+    def setUp(self):
+        super(CompressionTestCase, self).setUp()
+        admin.autodiscover()
+        self.obj_admin = admin.site._registry[WithPlaceholder]
+
+    def get_text_version(self, obj):
+        return default_revision_manager.get_for_object(obj)[0].revision\
+            .version_set.get(content_type__model='text')
+
+    def test_compressed_revisions(self):
+        obj = WithPlaceholder.objects.create()
+        plugin = add_plugin(obj.content, 'TextPlugin', 'en', body=BODY)
+        create_revision(obj)
+
+        version = self.get_text_version(obj)
+        self.assertEqual(version.format, COMPRESSED_FORMAT)
+        self.assertLess(len(version.serialized_data), len(BODY) / 10)
+        self.assertEqual(version.object_version.object.body, BODY)
+
+        # revert
+        plugin.body = 'changed'
+        plugin.save()
+        request = self.get_su_request(post_data={})
+        obj_version = default_revision_manager.get_for_object(obj)[0]
+        self.obj_admin.revision_view(
+            request, str(obj.pk), str(obj_version.pk))
+        self.assertEqual(
+            obj.content.get_plugins()[0].get_plugin_instance()[0].body, BODY)
+
+        # recover
+        obj_pk = obj.pk
+        obj.content.delete()
+        obj.delete()
+        request = self.get_su_request(post_data={})
+        response = self.obj_admin.recover_view(request, str(obj_version.pk))
+        self.assertEqual(response.status_code, 302)
+        plugins = CMSPlugin.objects.filter(
+            placeholder=WithPlaceholder.objects.get(pk=obj_pk).content)
+        self.assertEqual(plugins[0].get_plugin_instance()[0].body, BODY)
+
+    def test_deduplicated_compressed_revisions(self):
+        with adapter_options(WithPlaceholder,
+                             deduplicate_placeholder_plugins=True):
+            obj = WithPlaceholder.objects.create()
+            add_plugin(obj.content, 'TextPlugin', 'en', body=BODY)
+            create_revision(obj)
+            create_revision(obj)
+
+        # compressed payloads of unchanged plugins are referenced
+        version = self.get_text_version(obj)
+        self.assertEqual(version.format, REFERENCE_FORMAT)
+        self.assertEqual(version.object_version.object.body, BODY)
+
+    def test_small_payloads_are_not_compressed(self):
+        obj = WithPlaceholder.objects.create()
+        create_revision(obj)
+        self.assertEqual(
+            Version.objects.filter(format=COMPRESSED_FORMAT).count(), 0)
+
+    def test_payloads_without_dictionary(self):
+        obj = WithPlaceholder.objects.create()
+        plugin = add_plugin(obj.content, 'TextPlugin', 'en', body=BODY)
+        serialized_data = dumps(
+            serializers.serialize('json', [plugin.get_plugin_instance()[0]]),
+            'json', 'djangocms_text_ckeditor.text', dictionary_version=None)
+        objects = list(serializers.deserialize(
+            COMPRESSED_FORMAT, serialized_data))
+        self.assertEqual(objects[0].object.body, BODY)
+
+    def test_revision_context_versions_are_compressed(self):
+        with adapter_options(ComplexOneFK, compress_versions=True):
+            # as the admin saves objects
+            with revision_context_manager.create_revision():
+                obj = ComplexOneFK.objects.create(
+                    simple_relation=WithPlaceholder.objects.create(),
+                    complex_description=BODY)
+
+        revision = default_revision_manager.get_for_object(obj)[0].revision
+        translation_version = revision.version_set.get(
+            content_type__model='complexonefktranslation')
+        self.assertEqual(translation_version.format, COMPRESSED_FORMAT)
+        self.assertEqual(
+            translation_version.object_version.object.complex_description,
+            BODY)
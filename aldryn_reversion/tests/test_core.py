@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from reversion.revisions import (
+    default_revision_manager, revision_context_manager)
+
+from cms.api import add_plugin
+from cms.models import CMSPlugin
+from parler import appsettings as parler_settings, cache as parler_cache
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    WithPlaceholder, WithTranslations,
+)
+
+from ..bulk import get_versions_data
+from ..core import (
+    add_placeholders_to_revision, create_revision, get_placeholder_objects,
+    get_plugin_instances,
+)
+from ..restore import restore_versions
+
+from .base import ReversionBaseTestCase
+
+
+class RecordingCache(object):
+    """
+    Records the names of called cache methods.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.calls = []
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        return getattr(self.cache, name)
+
+
+class CoreTestCase(ReversionBaseTestCase):
+
+    def add_plugins(self, placeholder, count):
+        for position in range(count):
+            add_plugin(placeholder, 'TextPlugin', 'en',
+                       body='text {0}'.format(position))
+            add_plugin(placeholder, 'SamplePlugin', 'en')
+
+    def count_capture_queries(self, obj):
+        with transaction.atomic():
+            with revision_context_manager.create_revision():
+                with CaptureQueriesContext(connection) as queries:
+                    add_placeholders_to_revision(instance=obj)
+        return len(queries)
+
+    def test_get_plugin_instances(self):
+        obj = WithPlaceholder.objects.create()
+        self.add_plugins(obj.content, 2)
+        plugins = CMSPlugin.objects.filter(placeholder=obj.content)
+
+        result = get_plugin_instances(plugins)
+        self.assertEqual(len(result), 4)
+        for plugin, plugin_instance in result:
+            expected, _ = CMSPlugin.objects.get(
+                pk=plugin.pk).get_plugin_instance()
+            self.assertEqual(plugin_instance, expected)
+            self.assertEqual(type(plugin_instance), type(expected))
+
+    def test_capture_queries_do_not_depend_on_plugins_count(self):
+        small = WithPlaceholder.objects.create()
+        self.add_plugins(small.content, 2)
+        large = WithPlaceholder.objects.create()
+        self.add_plugins(large.content, 10)
+        # warm up content types cache
+        self.count_capture_queries(small)
+
+        self.assertEqual(self.count_capture_queries(small),
+                         self.count_capture_queries(large))
+
+    def test_placeholders_are_captured_once_per_revision(self):
+        obj = WithPlaceholder.objects.create()
+        self.add_plugins(obj.content, 2)
+        plugin_model = CMSPlugin.objects.filter(
+            placeholder=obj.content)[0].get_plugin_instance()[0].__class__
+
+        with transaction.atomic():
+            with revision_context_manager.create_revision():
+                with CaptureQueriesContext(connection) as queries:
+                    obj.save()
+                    with revision_context_manager.create_revision():
+                        obj.save()
+                    obj.save()
+                # plugins are not queried until the revision is saved
+                self.assertFalse([
+                    query for query in queries.captured_queries
+                    if plugin_model._meta.db_table in query['sql']])
+                # changes after the saves are captured as well
+                add_plugin(obj.content, 'TextPlugin', 'en', body='last')
+
+        version = default_revision_manager.get_for_object(obj)[0]
+        plugin_versions = version.revision.version_set.filter(
+            content_type__model='cmsplugin')
+        self.assertEqual(plugin_versions.count(), 5)
+
+    def test_get_versions_data_matches_adapter_data(self):
+        obj = WithPlaceholder.objects.create()
+        self.add_plugins(obj.content, 2)
+        objects = [obj] + get_placeholder_objects(obj)
+
+        versions_data = get_versions_data(objects)
+        self.assertEqual(len(versions_data), len(set(objects)))
+        for item in objects:
+            adapter = default_revision_manager.get_adapter(item.__class__)
+            self.assertEqual(
+                versions_data[item], adapter.get_version_data(item))
+
+    def test_create_revision(self):
+        obj = WithPlaceholder.objects.create()
+        self.add_plugins(obj.content, 2)
+
+        create_revision(obj, user=self.staff_user, comment='bulk')
+        version = default_revision_manager.get_for_object(obj)[0]
+        revision = version.revision
+        self.assertEqual(revision.comment, 'bulk')
+        self.assertEqual(revision.user, self.staff_user)
+        # object, placeholder, 2 text plugins with their base plugins and 2
+        # sample plugins
+        self.assertEqual(revision.version_set.count(), 8)
+
+    def test_create_revision_queries_do_not_depend_on_plugins_count(self):
+        small = WithPlaceholder.objects.create()
+        self.add_plugins(small.content, 2)
+        large = WithPlaceholder.objects.create()
+        self.add_plugins(large.content, 10)
+        # warm up content types cache
+        create_revision(small)
+
+        with CaptureQueriesContext(connection) as small_queries:
+            create_revision(small)
+        with CaptureQueriesContext(connection) as large_queries:
+            create_revision(large)
+        self.assertEqual(len(small_queries), len(large_queries))
+
+    def test_create_revision_coalesces_revisions(self):
+        obj = WithPlaceholder.objects.create()
+        self.add_plugins(obj.content, 1)
+        versions = default_revision_manager.get_for_object(obj)
+
+        create_revision(obj, user=self.staff_user, comment='first')
+        create_revision(obj, user=self.staff_user, comment='second')
+        self.assertEqual(versions.count(), 2)
+
+        # delete a plugin, revision with it can still be coalesced
+        obj.content.cmsplugin_set.get(plugin_type='SamplePlugin').delete()
+        create_revision(obj, user=self.staff_user, comment='third',
+                        coalesce_window=60)
+        self.assertEqual(versions.count(), 2)
+        revision = versions[0].revision
+        self.assertEqual(revision.comment, 'second\nthird')
+        self.assertEqual(revision.version_set.count(), 4)
+
+        # other user
+        create_revision(obj, user=self.super_user, comment='fourth',
+                        coalesce_window=60)
+        self.assertEqual(versions.count(), 3)
+
+        # out of the window
+        create_revision(obj, user=self.super_user, comment='fifth',
+                        coalesce_window=0)
+        self.assertEqual(versions.count(), 4)
+        self.assertEqual(versions[0].revision.comment, 'fifth')
+
+    def test_restored_translations_are_cached_at_once(self):
+        obj = WithTranslations.objects.create(description='english')
+        languages = ['de', 'fr', 'it']
+        for language in languages:
+            obj.set_current_language(language)
+            obj.description = language
+        obj.save()
+        revision = create_revision(obj)
+        obj.translations.update(description='changed')
+
+        recording_cache = RecordingCache(parler_cache.cache)
+        parler_settings.PARLER_ENABLE_CACHING = True
+        parler_cache.cache = recording_cache
+        try:
+            restore_versions(revision.version_set.all())
+        finally:
+            parler_cache.cache = recording_cache.cache
+            parler_settings.PARLER_ENABLE_CACHING = False
+        self.assertEqual(recording_cache.calls, ['set_many'])
+        for language in ['en'] + languages:
+            key = parler_cache.get_translation_cache_key(
+                WithTranslations._parler_meta.root_model, obj.pk, language)
+            self.assertEqual(
+                parler_cache.cache.get(key)['description'],
+                'english' if language == 'en' else language)
+
+    def test_restored_plugins_mark_placeholders_dirty_once(self):
+
+        def restore(count):
+            obj = WithPlaceholder.objects.create()
+            for position in range(count):
+                add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+            revision = create_revision(obj)
+            obj.content.cmsplugin_set.all().delete()
+            with CaptureQueriesContext(connection) as context:
+                restored = restore_versions(revision.version_set.all())
+            self.assertEqual(obj.content.cmsplugin_set.count(), count)
+            self.assertFalse(any(
+                hasattr(restored_obj, '_no_reorder')
+                for restored_obj in restored))
+            return len(context)
+
+        # the number of queries does not depend on the number of plugins
+        self.assertEqual(restore(2), restore(10))
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from reversion.models import Revision, Version
+from reversion.revisions import default_revision_manager
+
+from cms.api import add_plugin
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    WithPlaceholder,
+)
+from aldryn_reversion.test_helpers.utils import AdapterOptionsMixin
+
+from .. import version_cache
+from ..core import create_revision
+from ..dedupe import get_reference
+from ..formats import REFERENCE_FORMAT
+from ..formats.reference import payloads_preloaded
+
+from .base import ReversionBaseTestCase
+
+
+class DedupeTestCase(AdapterOptionsMixin, ReversionBaseTestCase):
+    adapter_model = WithPlaceholder
+    adapter_options = {'deduplicate_placeholder_plugins': True}
+
+    def get_references(self, revision):
+        return [version for version in revision.version_set.all()
+                if version.format == REFERENCE_FORMAT]
+
+    def test_unchanged_plugins_reference_previous_payload(self):
+        obj = WithPlaceholder.objects.create()
+        changed = add_plugin(obj.content, 'TextPlugin', 'en', body='first')
+        unchanged = add_plugin(obj.content, 'TextPlugin', 'en', body='second')
+        versions = default_revision_manager.get_for_object(obj)
+
+        create_revision(obj)
+        first = versions[0].revision
+        self.assertEqual(len(self.get_references(first)), 0)
+
+        changed.body = 'changed'
+        changed.save()
+        create_revision(obj)
+        second = versions[0].revision
+        # unchanged text plugin and its base plugin
+        references = self.get_references(second)
+        self.assertEqual(len(references), 2)
+        self.assertEqual(
+            set(version.object_id_int for version in references),
+            set([unchanged.pk]))
+
+        # references always point to the stored payload
+        create_revision(obj)
+        third = versions[0].revision
+        self.assertEqual(len(self.get_references(third)), 4)
+        for version in self.get_references(third):
+            referenced = Version.objects.get(pk=get_reference(version)[0])
+            self.assertNotEqual(referenced.format, REFERENCE_FORMAT)
+
+        # and are deserialized transparently
+        unchanged.body = 'changed too'
+        unchanged.save()
+        reference = [version for version in references
+                     if version.content_type.model != 'cmsplugin'][0]
+        self.assertEqual(reference.object_version.object.body, 'second')
+        second.revert()
+        unchanged.refresh_from_db()
+        self.assertEqual(unchanged.body, 'second')
+
+    def test_references_are_resolved_in_bulk(self):
+        obj = WithPlaceholder.objects.create()
+        for position in range(5):
+            add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        versions = default_revision_manager.get_for_object(obj)
+        create_revision(obj)
+        create_revision(obj)
+        references = self.get_references(versions[0].revision)
+        self.assertEqual(len(references), 10)
+
+        version_cache.clear()
+        # one query for the payloads of all references
+        with self.assertNumQueries(1), payloads_preloaded(references):
+            objs = [version_cache.get_object_version(version).object
+                    for version in references]
+        self.assertEqual(
+            [obj.body for obj in objs if hasattr(obj, 'body')], ['text'] * 5)
+        # references deserialized already are not fetched again
+        with self.assertNumQueries(0), payloads_preloaded(references):
+            pass
+
+    def test_deleting_referenced_revisions(self):
+        obj = WithPlaceholder.objects.create()
+        add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        versions = default_revision_manager.get_for_object(obj)
+        create_revision(obj)
+        first = versions[0].revision
+        create_revision(obj)
+        second = versions[0].revision
+        create_revision(obj)
+        third = versions[0].revision
+        self.assertEqual(len(self.get_references(second)), 2)
+
+        # as reversion's deleterevisions command does
+        Revision.objects.filter(pk=first.pk).delete()
+        # references to deleted payloads are replaced by the payload
+        for revision in (second, third):
+            self.assertEqual(len(self.get_references(revision)), 0)
+            plugin_version = revision.version_set.get(
+                content_type__model='text')
+            self.assertEqual(
+                plugin_version.object_version.object.body, 'text')
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.contrib import admin
+
+from reversion.models import Version
+from reversion.revisions import default_revision_manager
+
+from cms.api import add_plugin
+from cms.models import Placeholder
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    WithPlaceholder,
+)
+from aldryn_reversion.test_helpers.utils import (
+    AdapterOptionsMixin, get_bodies,
+)
+
+from ..core import create_revision
+from ..delta import (
+    IncompleteManifestError, get_manifest, get_revision_versions,
+)
+from ..formats import DELTA_FORMAT
+from ..restore import revert_revision
+
+from .base import CMSRequestBasedMixin, ReversionBaseTestCase
+
+
+class DeltaTestCase(AdapterOptionsMixin, CMSRequestBasedMixin,
+                    ReversionBaseTestCase):
+    adapter_model = WithPlaceholder
+    adapter_options = {
+        'placeholder_deltas': True,
+        'placeholder_keyframe_interval': 3,
+    }
+
+    def get_placeholder_version(self, revision):
+        return [version for version in revision.version_set.all()
+                if version.format == DELTA_FORMAT][0]
+
+    def test_delta_revisions(self):
+        obj = WithPlaceholder.objects.create()
+        placeholder = obj.content
+        plugins = [add_plugin(placeholder, 'TextPlugin', 'en',
+                              body='text {0}'.format(position))
+                   for position in range(3)]
+        versions = default_revision_manager.get_for_object(obj)
+
+        # keyframe: object, placeholder and 3 text plugins with base plugins
+        create_revision(obj)
+        keyframe = versions[0].revision
+        self.assertEqual(keyframe.version_set.count(), 8)
+        manifest = get_manifest(self.get_placeholder_version(keyframe))
+        self.assertIsNone(manifest['base'])
+        self.assertEqual(len(manifest['plugins']), 6)
+
+        # delta: only the changed plugin is stored
+        plugins[0].body = 'changed'
+        plugins[0].save()
+        create_revision(obj)
+        changed = versions[0].revision
+        self.assertEqual(changed.version_set.count(), 4)
+        manifest = get_manifest(self.get_placeholder_version(changed))
+        self.assertEqual(manifest['base'], keyframe.pk)
+        self.assertEqual(manifest['depth'], 1)
+        self.assertEqual(len(get_revision_versions(changed)), 8)
+
+        # delta: the manifest lacks the deleted plugin, only the base plugin
+        # of the following one is stored since its position has changed.
+        plugins[1].delete()
+        create_revision(obj)
+        deleted = versions[0].revision
+        self.assertEqual(deleted.version_set.count(), 3)
+        manifest = get_manifest(self.get_placeholder_version(deleted))
+        self.assertEqual(len(manifest['plugins']), 4)
+        self.assertEqual(len(get_revision_versions(deleted)), 6)
+
+        # next keyframe
+        create_revision(obj)
+        self.assertEqual(versions[0].revision.version_set.count(), 6)
+
+        # placeholder versions still deserialize to placeholders
+        placeholder_version = self.get_placeholder_version(changed)
+        self.assertEqual(placeholder_version.object_version.object,
+                         placeholder)
+        self.assertIsInstance(placeholder_version.object_version.object,
+                              Placeholder)
+
+        # revert the revision with a changed plugin
+        admin.autodiscover()
+        obj_admin = admin.site._registry[WithPlaceholder]
+        request = self.get_su_request(post_data={})
+        changed_version = changed.version_set.get(
+            content_type__model='withplaceholder')
+        obj_admin.revision_view(
+            request, str(obj.pk), str(changed_version.pk))
+        self.assertEqual(get_bodies(placeholder),
+                         ['changed', 'text 1', 'text 2'])
+
+        # and the one with deleted plugin
+        deleted_version = deleted.version_set.get(
+            content_type__model='withplaceholder')
+        obj_admin.revision_view(
+            request, str(obj.pk), str(deleted_version.pk))
+        self.assertEqual(get_bodies(placeholder),
+                         ['changed', 'text 2'])
+
+    def test_revert_revision(self):
+        obj = WithPlaceholder.objects.create()
+        unchanged = add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        changed = add_plugin(obj.content, 'TextPlugin', 'en', body='old')
+        create_revision(obj)
+        changed.body = 'new'
+        changed.save()
+        create_revision(obj)
+        delta = default_revision_manager.get_for_object(obj)[0].revision
+        unchanged.body = changed.body = 'edited'
+        unchanged.save()
+        changed.save()
+
+        # the unchanged plugin is restored from the keyframe
+        revert_revision(delta)
+        self.assertEqual(get_bodies(obj.content), ['new', 'text'])
+
+    def test_deleting_base_revisions(self):
+        obj = WithPlaceholder.objects.create()
+        add_plugin(obj.content, 'TextPlugin', 'en', body='a')
+        changed = add_plugin(obj.content, 'TextPlugin', 'en', body='b')
+        versions = default_revision_manager.get_for_object(obj)
+        create_revision(obj)
+        keyframe = versions[0].revision
+        for body in ('c', 'd'):
+            changed.body = body
+            changed.save()
+            create_revision(obj)
+        first, second = versions[1].revision, versions[0].revision
+
+        keyframe.delete()
+
+        # the first delta became a keyframe, the second is based on it
+        self.assertIsNone(
+            get_manifest(self.get_placeholder_version(first))['base'])
+        manifest = get_manifest(self.get_placeholder_version(second))
+        self.assertEqual(manifest['base'], first.pk)
+        self.assertEqual(manifest['depth'], 1)
+        revert_revision(first)
+        self.assertEqual(get_bodies(obj.content), ['a', 'c'])
+        revert_revision(second)
+        self.assertEqual(get_bodies(obj.content), ['a', 'd'])
+
+    def test_incomplete_manifest(self):
+        obj = WithPlaceholder.objects.create()
+        add_plugin(obj.content, 'TextPlugin', 'en', body='a')
+        create_revision(obj)
+        keyframe = default_revision_manager.get_for_object(obj)[0].revision
+        create_revision(obj)
+        delta = default_revision_manager.get_for_object(obj)[0].revision
+        Version.objects.filter(
+            revision=keyframe, content_type__model='text').delete()
+
+        with self.assertRaises(IncompleteManifestError):
+            get_revision_versions(delta)
+        # and live plugins are kept
+        with self.assertRaises(IncompleteManifestError):
+            revert_revision(delta)
+        self.assertEqual(get_bodies(obj.content), ['a'])
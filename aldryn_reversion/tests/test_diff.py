@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from reversion.revisions import default_revision_manager
+
+from cms.api import add_plugin
+from cms.plugin_pool import plugin_pool
+from djangocms_text_ckeditor.cms_plugins import TextPlugin
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    ComplexOneFK, WithPlaceholder,
+)
+
+from ..core import create_revision
+from ..diff import FieldChange, clear_cache, diff_revisions, diff_versions
+
+from .base import ReversionBaseTestCase
+
+
+class DiffTestCase(ReversionBaseTestCase):
+
+    def setUp(self):
+        super(DiffTestCase, self).setUp()
+        clear_cache()
+
+    def get_pks(self, changes):
+        return [change.pk for change in changes]
+
+    def test_diff(self):
+        first, second = [WithPlaceholder.objects.create() for _ in range(2)]
+        obj = ComplexOneFK.objects.create(
+            simple_relation=first, complex_description='text')
+        placeholder = obj.complex_content
+        edited, removed, moved = [
+            add_plugin(placeholder, 'TextPlugin', 'en', body=body)
+            for body in ('edited', 'removed', 'moved')]
+        old_revision = create_revision(obj)
+
+        obj.simple_relation = second
+        obj.complex_description = 'changed'
+        obj.save()
+        obj.set_current_language('de')
+        obj.complex_description = 'Text'
+        obj.save()
+        edited.body = 'changed'
+        edited.save()
+        removed.delete()
+        moved.position = 10
+        moved.save()
+        added = add_plugin(placeholder, 'TextPlugin', 'en', body='added')
+        new_revision = create_revision(obj)
+
+        diff = diff_revisions(ComplexOneFK, obj.pk, old_revision, new_revision)
+        self.assertTrue(diff)
+        self.assertIn(FieldChange('simple_relation', first.pk, second.pk),
+                      diff.fields)
+        self.assertEqual(diff.translations['en'], [
+            FieldChange('complex_description', 'text', 'changed')])
+        self.assertEqual(diff.translations['de'], [
+            FieldChange('complex_description', None, 'Text')])
+
+        plugins = diff.placeholders['complex_content']
+        self.assertEqual(self.get_pks(plugins.added), [added.pk])
+        self.assertEqual(self.get_pks(plugins.removed), [removed.pk])
+        self.assertIn(moved.pk, self.get_pks(plugins.moved))
+        self.assertEqual(self.get_pks(plugins.edited), [edited.pk])
+        self.assertEqual(plugins.edited[0].changes, [
+            FieldChange('body', 'edited', 'changed')])
+        self.assertEqual(plugins.removed[0].old.body, 'removed')
+
+        # parsed revisions are cached, and nothing is written
+        with self.assertNumQueries(0):
+            diff_revisions(ComplexOneFK, obj.pk, new_revision, new_revision)
+        self.assertFalse(
+            diff_revisions(ComplexOneFK, obj.pk, new_revision, new_revision))
+        self.assertEqual(ComplexOneFK.objects.get(pk=obj.pk)
+                         .simple_relation, second)
+
+    def test_diff_delta_revisions(self):
+        adapter = default_revision_manager.get_adapter(WithPlaceholder)
+        adapter.placeholder_deltas = True
+        try:
+            obj = WithPlaceholder.objects.create()
+            unchanged = add_plugin(obj.content, 'TextPlugin', 'en', body='a')
+            edited = add_plugin(obj.content, 'TextPlugin', 'en', body='b')
+            create_revision(obj)
+            edited.body = 'changed'
+            edited.save()
+            create_revision(obj)
+        finally:
+            del adapter.placeholder_deltas
+
+        new_version, old_version = default_revision_manager.get_for_object(
+            obj)[:2]
+        plugins = diff_versions(old_version, new_version).placeholders[
+            'content']
+        self.assertEqual(self.get_pks(plugins.edited), [edited.pk])
+        self.assertEqual(plugins.added + plugins.removed + plugins.moved, [])
+        # the unchanged plugin is stored only in the keyframe
+        self.assertNotIn(unchanged.pk, self.get_pks(plugins.removed))
+
+    def test_diff_unregistered_plugin_type(self):
+        obj = WithPlaceholder.objects.create()
+        edited = add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        old_revision = create_revision(obj)
+        edited.body = 'changed'
+        edited.save()
+        new_revision = create_revision(obj)
+
+        plugin_pool.unregister_plugin(TextPlugin)
+        try:
+            diff = diff_revisions(
+                WithPlaceholder, obj.pk, old_revision, new_revision)
+        finally:
+            plugin_pool.register_plugin(TextPlugin)
+        # stored fields of the plugin are still compared
+        plugins = diff.placeholders['content']
+        self.assertEqual(self.get_pks(plugins.edited), [edited.pk])
+        self.assertEqual(plugins.edited[0].changes, [
+            FieldChange('body', 'text', 'changed')])
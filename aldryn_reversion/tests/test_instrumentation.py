@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from reversion.revisions import default_revision_manager
+
+from cms.api import add_plugin
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    WithPlaceholder,
+)
+
+from ..core import create_revision
+from ..instrumentation import (
+    Collector, Event, MemoryCollector, logger, register_collector,
+    unregister_collector,
+)
+from ..signals import revision_operation
+from ..utils import RevisionConflictResolver
+
+from .base import ReversionBaseTestCase
+
+
+class FailingCollector(Collector):
+
+    def collect(self, event):
+        raise ValueError('collector failed')
+
+
+class RecordsHandler(logging.Handler):
+
+    def __init__(self):
+        super(RecordsHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class InstrumentationTestCase(ReversionBaseTestCase):
+
+    def setUp(self):
+        super(InstrumentationTestCase, self).setUp()
+        self.collector = MemoryCollector()
+        register_collector(self.collector)
+
+    def tearDown(self):
+        unregister_collector(self.collector)
+        super(InstrumentationTestCase, self).tearDown()
+
+    def test_create_revision_events(self):
+        obj = WithPlaceholder.objects.create()
+        add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        revision = create_revision(obj)
+
+        event = self.collector.events[-1]
+        self.assertEqual(event.operation, 'create_revision')
+        self.assertEqual(event.instance, obj)
+        # the object, the placeholder, the base plugin and the text plugin
+        self.assertEqual(event.versions, 4)
+        self.assertEqual(event.serialized_bytes, sum(
+            len(version.serialized_data)
+            for version in revision.version_set.all()))
+        self.assertGreater(event.queries, 0)
+        self.assertGreater(event.duration, 0)
+
+        version = default_revision_manager.get_for_object(obj)[0]
+        RevisionConflictResolver(version).resolve()
+        self.assertEqual(self.collector.events[-1].operation,
+                         'RevisionConflictResolver.resolve')
+
+    def test_query_count(self):
+        obj = WithPlaceholder.objects.create()
+        add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        # warm up caches (content types)
+        create_revision(obj)
+        with CaptureQueriesContext(connection) as context:
+            create_revision(obj)
+        queries = len(context)
+        self.assertEqual(self.collector.events[-1].queries, queries)
+
+        # queries are counted without the (possibly full) query log
+        connection.queries_log.extend(
+            {'sql': '', 'time': '0'}
+            for _ in range(connection.queries_log.maxlen))
+        try:
+            create_revision(obj)
+        finally:
+            connection.queries_log.clear()
+        self.assertEqual(self.collector.events[-1].queries, queries)
+        self.assertFalse(connection.force_debug_cursor)
+        self.assertNotIn('make_cursor', connection.__dict__)
+
+    def test_signal(self):
+        events = []
+
+        def receiver(sender, event, **kwargs):
+            events.append((sender, event))
+
+        revision_operation.connect(receiver, sender=Event)
+        try:
+            obj = WithPlaceholder.objects.create()
+            with default_revision_manager._revision_context_manager\
+                    .create_revision():
+                create_revision(obj)
+        finally:
+            revision_operation.disconnect(receiver, sender=Event)
+
+        self.assertEqual(set(sender for sender, _ in events), set([Event]))
+        # placeholders are added when the outer revision is saved
+        self.assertEqual([event.operation for _, event in events],
+                         ['create_revision', 'add_placeholders_to_revision'])
+        self.assertEqual(events[0][1].versions, 1)
+        self.assertEqual(events[1][1].versions, 1)
+
+    @override_settings(ALDRYN_REVERSION_INSTRUMENTATION_COLLECTORS=[
+        'aldryn_reversion.tests.test_instrumentation.FailingCollector'])
+    def test_failing_collector(self):
+        handler = RecordsHandler()
+        logger.addHandler(handler)
+        logger.propagate = False
+        try:
+            obj = WithPlaceholder.objects.create()
+            self.assertIsNotNone(create_revision(obj))
+        finally:
+            logger.removeHandler(handler)
+            logger.propagate = True
+        # other collectors still get the event, the failure is logged
+        self.assertEqual(self.collector.events[-1].operation,
+                         'create_revision')
+        self.assertEqual(handler.records[-1].exc_info[0], ValueError)
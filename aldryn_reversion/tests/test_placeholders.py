@@ -8,15 +8,19 @@ import json
 from django.contrib import admin
 from django.contrib.contenttypes.models import ContentType
 from django.http.request import QueryDict
+from django.test.utils import override_settings
 from django.utils.encoding import force_text
 from django.utils.http import urlencode
 
 from reversion.models import Version, Revision
+from reversion.revisions import revision_context_manager
 
 import cms
 from cms.api import create_page, add_plugin
 from cms.models import Placeholder, Page, StaticPlaceholder
 
+from aldryn_reversion import deferred
+from aldryn_reversion.signals import revision_operation
 from aldryn_reversion.test_helpers.project.test_app.models import (
     WithPlaceholder,
 )
@@ -38,6 +42,27 @@ CMS_3_2_1 = LooseVersion(cms.__version__) >= LooseVersion('3.2.1')
 CMS_3_3 = LooseVersion(cms.__version__) >= LooseVersion('3.3')
 
 
+class InlineExecutor(object):
+    """
+    Runs submitted callables right away, in the calling thread.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+
+class QueueExecutor(object):
+    """
+    Collects submitted callables, for tests to run them.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.calls.append((fn, args, kwargs))
+
+
 class ReversionRevisionAdminTestCase(CMSRequestBasedMixin,
                                      HelperModelsObjectsSetupMixin,
                                      ReversionBaseTestCase):
@@ -88,6 +113,166 @@ class ReversionRevisionAdminTestCase(CMSRequestBasedMixin,
         })
         return admin.move_plugin(request)
 
+    def get_add_plugin_request(self, placeholder):
+        data = {
+            'plugin_type': 'SamplePlugin',
+            'placeholder_id': placeholder.pk,
+            'plugin_language': 'en',
+        }
+
+        if CMS_3_3:
+            request = self.get_su_request(post_data={})
+            request.GET = QueryDict(urlencode(data))
+            request._dont_enforce_csrf_checks = True
+        else:
+            request = self.get_post_request(data)
+        return request
+
+    def test_deferred_revision_on_plugin_add(self):
+        example_obj = WithPlaceholder.objects.create()
+        m_pl = example_obj.content
+        m_pl_admin = self.get_example_admin()
+        example_obj_versions = m_pl_admin.revision_manager.get_for_object(
+            example_obj)
+        initial_count = example_obj_versions.count()
+
+        # create a regular revision to compare with
+        response = m_pl_admin.add_plugin(self.get_add_plugin_request(m_pl))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(example_obj_versions.count(), initial_count + 1)
+        regular_revision = example_obj_versions[0].revision
+
+        default_executor = deferred._executor
+        deferred._executor = InlineExecutor()
+        m_pl_admin.defer_plugin_revisions = True
+        try:
+            response = m_pl_admin.add_plugin(
+                self.get_add_plugin_request(m_pl))
+        finally:
+            m_pl_admin.defer_plugin_revisions = False
+            deferred._executor = default_executor
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(example_obj_versions.count(), initial_count + 2)
+        deferred_revision = example_obj_versions[0].revision
+        self.assertEqual(deferred_revision.user, self.super_user)
+        self.assertEqual(
+            deferred_revision.comment,
+            'Added plugin #%s: %s' % (
+                m_pl.cmsplugin_set.latest('pk').pk,
+                force_text(m_pl.cmsplugin_set.latest('pk'))))
+        # one more plugin, and the same set of objects otherwise
+        self.assertEqual(deferred_revision.version_set.count(),
+                         regular_revision.version_set.count() + 1)
+
+    def test_plugin_revisions_coalesced_in_revision_context(self):
+        example_obj = WithPlaceholder.objects.create()
+        m_pl = example_obj.content
+        m_pl_admin = self.get_example_admin()
+        versions = m_pl_admin.revision_manager.get_for_object(example_obj)
+
+        m_pl_admin.plugin_revisions_coalesce_window = 60
+        try:
+            for _ in range(2):
+                # as with reversion's RevisionMiddleware
+                with revision_context_manager.create_revision():
+                    response = m_pl_admin.add_plugin(
+                        self.get_add_plugin_request(m_pl))
+                self.assertEqual(response.status_code, 200)
+        finally:
+            m_pl_admin.plugin_revisions_coalesce_window = None
+
+        self.assertEqual(versions.count(), 1)
+        revision = versions[0].revision
+        self.assertEqual(revision.user, self.super_user)
+        first, second = m_pl.cmsplugin_set.order_by('pk')
+        self.assertEqual(revision.comment, '\n'.join(
+            'Added plugin #%s: %s' % (plugin.pk, force_text(plugin))
+            for plugin in (first, second)))
+        plugin_ids = revision.version_set.filter(
+            content_type=ContentType.objects.get_for_model(first),
+        ).values_list('object_id', flat=True)
+        self.assertEqual(sorted(plugin_ids),
+                         sorted([str(first.pk), str(second.pk)]))
+
+    def add_deferred_plugins(self, count, executor):
+        example_obj = WithPlaceholder.objects.create()
+        m_pl_admin = self.get_example_admin()
+        default_executor = deferred._executor
+        deferred._executor = executor
+        m_pl_admin.defer_plugin_revisions = True
+        try:
+            for _ in range(count):
+                response = m_pl_admin.add_plugin(
+                    self.get_add_plugin_request(example_obj.content))
+                self.assertEqual(response.status_code, 200)
+        finally:
+            m_pl_admin.defer_plugin_revisions = False
+            deferred._executor = default_executor
+        return m_pl_admin.revision_manager.get_for_object(example_obj)
+
+    def test_deferred_revisions_of_successive_commits(self):
+        executor = QueueExecutor()
+        example_obj_versions = self.add_deferred_plugins(2, executor)
+        self.assertEqual(example_obj_versions.count(), 0)
+
+        # workers may run in any order
+        for fn, args, kwargs in reversed(executor.calls):
+            fn(*args, **kwargs)
+        # the first commit is included in the revision of the second one
+        self.assertEqual(example_obj_versions.count(), 1)
+        revision = example_obj_versions[0].revision
+        self.assertEqual(len(revision.comment.splitlines()), 2)
+        self.assertEqual(revision.version_set.filter(
+            content_type__model='cmsplugin').count(), 2)
+
+    def test_deferred_revision_discarded_on_later_commit(self):
+        executor = QueueExecutor()
+        example_obj_versions = self.add_deferred_plugins(1, executor)
+        fn, args, kwargs = executor.calls[0]
+        key = (kwargs['content_type_id'], force_text(kwargs['object_id']))
+
+        def commit_again(sender, event, **kwargs):
+            # the object is committed while its revision is being built
+            if event.operation == 'create_revision':
+                deferred._register_commit(key, 'later')
+
+        revision_operation.connect(commit_again)
+        try:
+            fn(*args, **kwargs)
+        finally:
+            revision_operation.disconnect(commit_again)
+        self.assertEqual(example_obj_versions.count(), 0)
+
+        deferred.create_deferred_revision(
+            **dict(kwargs, sequence=deferred._commits[key]))
+        self.assertEqual(example_obj_versions.count(), 1)
+        self.assertEqual(
+            example_obj_versions[0].revision.comment.splitlines()[-1],
+            'later')
+        self.assertNotIn(key, deferred._commits)
+
+    @override_settings(ALDRYN_REVERSION_DEFERRED_WORKERS=0)
+    def test_deferred_revision_without_workers(self):
+        # revisions are created in the committing thread
+        self.assertIsNone(deferred.get_revision_executor())
+        example_obj_versions = self.add_deferred_plugins(1, None)
+        self.assertEqual(example_obj_versions.count(), 1)
+
+    def test_shutdown_revision_executor(self):
+        if deferred.ThreadPoolExecutor is None:
+            raise unittest.SkipTest('concurrent.futures is not available')
+        default_executor = deferred._executor
+        deferred._executor = None
+        try:
+            executor = deferred.get_revision_executor()
+            future = executor.submit(lambda: 'done')
+            deferred.shutdown_revision_executor()
+            self.assertEqual(future.result(), 'done')
+            self.assertIsNone(deferred._executor)
+        finally:
+            deferred._executor = default_executor
+
     def test_revision_on_placeholder_clear(self):
         placeholder_versions = self.get_placeholder_versions()
 
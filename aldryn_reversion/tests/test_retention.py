@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.utils import six, timezone
+
+from reversion.models import Revision, Version
+from reversion.revisions import default_revision_manager
+
+from cms.api import add_plugin
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    SimpleFK, SimpleNoAdmin, SimpleRegistered, WithPlaceholder,
+)
+from aldryn_reversion.test_helpers.utils import adapter_options
+
+from ..core import create_revision
+from ..dedupe import get_reference
+from ..formats import REFERENCE_FORMAT
+from ..retention import (
+    RetentionPolicy, get_prunable_revision_ids, get_revision_batches,
+    prune_revisions,
+)
+
+from .base import ReversionBaseTestCase
+
+
+class RetentionTestCase(ReversionBaseTestCase):
+
+    def create_revisions(self, obj, ages):
+        """
+        Creates revisions of obj with given ages in days, returns their ids
+        latest first.
+        """
+        now = timezone.now()
+        revision_ids = []
+        for age in sorted(ages, reverse=True):
+            revision = create_revision(obj)
+            Revision.objects.filter(pk=revision.pk).update(
+                date_created=now - timedelta(days=age, hours=1))
+            revision_ids.insert(0, revision.pk)
+        return revision_ids
+
+    def test_policies(self):
+        obj = SimpleRegistered.objects.create(position=1)
+        revision_ids = self.create_revisions(obj, [0, 1, 5, 5, 6, 20, 40])
+
+        def get_pruned(**kwargs):
+            policies = {SimpleRegistered: RetentionPolicy(**kwargs)}
+            return sorted(get_prunable_revision_ids(policies))
+
+        self.assertEqual(get_pruned(keep_last=3), sorted(revision_ids[3:]))
+        # only the latest of the two revisions 5 days ago is kept
+        self.assertEqual(get_pruned(keep_daily_after=2), [revision_ids[3]])
+        self.assertEqual(get_pruned(drop_older_than=10),
+                         sorted(revision_ids[5:]))
+        self.assertEqual(get_pruned(keep_last=6, drop_older_than=10),
+                         [revision_ids[6]])
+
+        # command
+        adapter = default_revision_manager.get_adapter(SimpleRegistered)
+        adapter.retention_keep_last = 2
+        try:
+            out = six.StringIO()
+            call_command('prune_revisions', chunk_size=2, stdout=out)
+        finally:
+            del adapter.retention_keep_last
+        self.assertIn('Deleted 2 of 5 revisions.', out.getvalue())
+        self.assertIn('5 revisions deleted.', out.getvalue())
+        self.assertEqual(
+            sorted(Revision.objects.values_list('pk', flat=True)),
+            sorted(revision_ids[:2]))
+
+    def test_revisions_kept_by_other_models(self):
+        related = SimpleNoAdmin.objects.create(position=1)
+        obj = SimpleFK.objects.create(simple_relation=related)
+        # revisions of obj contain related too
+        revision_ids = self.create_revisions(obj, [0, 1, 2])
+        policies = {SimpleNoAdmin: RetentionPolicy(keep_last=1),
+                    SimpleFK: RetentionPolicy(keep_last=2)}
+
+        self.assertEqual(
+            get_prunable_revision_ids(policies, models=[SimpleNoAdmin]),
+            set(revision_ids[2:]))
+        self.assertEqual(
+            get_prunable_revision_ids(policies, models=[SimpleFK]),
+            set(revision_ids[2:]))
+
+        # the policy of SimpleFK keeps revisions of SimpleNoAdmin
+        with adapter_options(SimpleNoAdmin, retention_keep_last=1), \
+                adapter_options(SimpleFK, retention_keep_last=2):
+            out = six.StringIO()
+            call_command('prune_revisions', 'test_app.SimpleNoAdmin',
+                         stdout=out)
+        self.assertIn('1 revisions deleted.', out.getvalue())
+        self.assertEqual(
+            sorted(Revision.objects.values_list('pk', flat=True)),
+            sorted(revision_ids[:2]))
+
+    def test_revision_batches(self):
+        small = SimpleRegistered.objects.create(position=1)
+        large = WithPlaceholder.objects.create()
+        for position in range(3):
+            add_plugin(large.content, 'TextPlugin', 'en', body='text')
+        small_ids = self.create_revisions(small, [1, 2, 3])
+        # the object, the placeholder and 3 plugins with base plugins
+        large_id = create_revision(large).pk
+
+        # transactions are bounded by versions, not revisions
+        batches = list(get_revision_batches(small_ids + [large_id], 2))
+        self.assertEqual(batches, [sorted(small_ids)[:2],
+                                   sorted(small_ids)[2:], [large_id]])
+        self.assertEqual(
+            list(get_revision_batches(small_ids + [large_id], 100)),
+            [sorted(small_ids + [large_id])])
+
+    def test_delta_chains_and_references_are_kept(self):
+        adapter = default_revision_manager.get_adapter(WithPlaceholder)
+        obj = WithPlaceholder.objects.create()
+        add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        policies = {WithPlaceholder: RetentionPolicy(keep_last=1)}
+
+        # deltas are based on the keyframe
+        adapter.placeholder_deltas = True
+        try:
+            revision_ids = self.create_revisions(obj, [0, 1, 2])
+        finally:
+            del adapter.placeholder_deltas
+        self.assertEqual(get_prunable_revision_ids(policies), set())
+
+        # references are replaced by their payload
+        adapter.deduplicate_placeholder_plugins = True
+        try:
+            revision_ids = self.create_revisions(obj, [0, 1])
+        finally:
+            del adapter.deduplicate_placeholder_plugins
+        references = Version.objects.filter(
+            revision_id=revision_ids[0], format=REFERENCE_FORMAT)
+        self.assertTrue(references.exists())
+        self.assertIn(revision_ids[1], get_prunable_revision_ids(policies))
+
+        prune_revisions(policies)
+        self.assertEqual(list(Revision.objects.values_list('pk', flat=True)),
+                         [revision_ids[0]])
+        self.assertFalse(references.exists())
+        for version in Version.objects.all():
+            self.assertEqual(get_reference(version)[0], version.pk)
+            self.assertIsNotNone(version.object_version.object)
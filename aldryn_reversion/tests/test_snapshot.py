@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.contrib import admin
+
+from reversion.revisions import default_revision_manager
+
+from cms.api import add_plugin
+from cms.models import CMSPlugin, Placeholder
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    WithPlaceholder,
+)
+from aldryn_reversion.test_helpers.utils import (
+    AdapterOptionsMixin, get_bodies,
+)
+
+from ..core import create_revision
+from ..formats import SNAPSHOT_FORMAT
+from ..restore import revert_revision
+from ..snapshot import get_snapshot_plugin_keys
+
+from .base import CMSRequestBasedMixin, ReversionBaseTestCase
+
+
+class SnapshotTestCase(AdapterOptionsMixin, CMSRequestBasedMixin,
+                       ReversionBaseTestCase):
+    adapter_model = WithPlaceholder
+    adapter_options = {'placeholder_snapshots': True}
+
+    def test_snapshot_revisions(self):
+        obj = WithPlaceholder.objects.create()
+        placeholder = obj.content
+        plugins = [add_plugin(placeholder, 'TextPlugin', 'en',
+                              body='text {0}'.format(position))
+                   for position in range(3)]
+
+        create_revision(obj)
+        version = default_revision_manager.get_for_object(obj)[0]
+        revision = version.revision
+        # the object and the placeholder with all of its plugins
+        self.assertEqual(revision.version_set.count(), 2)
+        placeholder_version = revision.version_set.get(format=SNAPSHOT_FORMAT)
+        self.assertEqual(len(get_snapshot_plugin_keys(placeholder_version)),
+                         6)
+        self.assertIsInstance(placeholder_version.object_version.object,
+                              Placeholder)
+
+        # revert
+        plugins[0].body = 'changed'
+        plugins[0].save()
+        plugins[1].delete()
+        add_plugin(placeholder, 'TextPlugin', 'en', body='added')
+        admin.autodiscover()
+        obj_admin = admin.site._registry[WithPlaceholder]
+        request = self.get_su_request(post_data={})
+        obj_admin.revision_view(request, str(obj.pk), str(version.pk))
+        self.assertEqual(get_bodies(placeholder),
+                         ['text 0', 'text 1', 'text 2'])
+
+        # recover
+        placeholder_pk = placeholder.pk
+        placeholder.delete()
+        obj.delete()
+        self.assertEqual(
+            CMSPlugin.objects.filter(placeholder_id=placeholder_pk).count(), 0)
+        obj_admin.recover_view(request, str(version.pk))
+        self.assertEqual(
+            get_bodies(Placeholder.objects.get(pk=placeholder_pk)),
+            ['text 0', 'text 1', 'text 2'])
+
+    def test_revert_revision(self):
+        obj = WithPlaceholder.objects.create()
+        plugin = add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+        create_revision(obj)
+        revision = default_revision_manager.get_for_object(obj)[0].revision
+        plugin.body = 'changed'
+        plugin.save()
+
+        # Revision.revert restores the placeholder only
+        revision.revert()
+        self.assertEqual(get_bodies(obj.content), ['changed'])
+        revert_revision(revision)
+        self.assertEqual(get_bodies(obj.content), ['text'])
@@ -2,6 +2,11 @@
 
 from __future__ import unicode_literals
 
+import sys
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 from reversion.models import Version
 from reversion.revisions import default_revision_manager
 from cms.models import Placeholder
@@ -10,10 +15,14 @@ from ..utils import (
     object_is_translation, object_has_placeholders,
     get_placeholder_fields_names, get_fk_models,
     get_translations_versions_for_object, get_deleted_objects_versions,
+    get_indexed_translations_versions_for_object,
     get_conflict_fks_versions, get_deleted_placeholders,
     get_deleted_placeholders_for_object,
-    RecursiveRevisionConflictResolver,
+    RecursiveRevisionConflictResolver, RevisionConflictResolver,
+    RevisionIndex,
 )
+from ..bulk import save_revision
+from ..metadata import get_model_metadata
 
 from .base import (
     ReversionBaseTestCase, HelperModelsObjectsSetupMixin,
@@ -21,7 +30,7 @@ from .base import (
 )
 from aldryn_reversion.test_helpers.project.test_app.models import (
     SimpleNoAdmin, SimpleRegistered, WithPlaceholder,
-    SimpleFK, BlankFK, ComplexOneFK, MultiLevelFK,
+    SimpleFK, BlankFK, ComplexOneFK, MultiLevelFK, FKtoSelf,
 )
 
 
@@ -98,6 +107,10 @@ class UtilsTestCase(HelperModelsObjectsSetupMixin, ReversionBaseTestCase):
 
         self.assertEqual(len(result_revision_2), 2)
         self.assertEqual(len(result_revision_1), 1)
+        self.assertEqual(
+            list(result_revision_2),
+            get_indexed_translations_versions_for_object(
+                self.with_translation, RevisionIndex(revision_2)))
 
         # test with providing versions explicitly, should respect versions
         # over revision
@@ -147,6 +160,27 @@ class UtilsTestCase(HelperModelsObjectsSetupMixin, ReversionBaseTestCase):
         result = get_deleted_objects_versions(custom_versions)
         self.assertEqual(len(result), 2)
 
+    def test_get_deleted_objects_versions_queries(self):
+        complex_fk_version = default_revision_manager.get_for_object(
+            self.complex_one_fk)[0]
+        versions = list(complex_fk_version.revision.version_set.all())
+        content_types_count = len(
+            set(version.content_type_id for version in versions))
+        self.assertTrue(content_types_count > 1)
+        # warm up content types cache
+        get_deleted_objects_versions(versions)
+
+        # one query per model, regardless of number of versions
+        with self.assertNumQueries(content_types_count):
+            result = get_deleted_objects_versions(versions)
+        self.assertEqual(len(result), 0)
+
+        self.complex_one_fk.delete()
+        result = get_deleted_objects_versions(versions)
+        # the object, its translations and the multi level fk object, which
+        # revision this is, since it follows the object.
+        self.assertEqual(len(result), 4)
+
     def test_get_conflict_fks_versions_with_simple_models(self):
         # test with object that has no relations
         simple_no_admin_version = default_revision_manager.get_for_object(
@@ -350,3 +384,81 @@ class UtilsTestCase(HelperModelsObjectsSetupMixin, ReversionBaseTestCase):
             RecursiveRevisionConflictResolver(simple_fk_version).resolve()
         ).resolve()
         self.assertEqual(len(result), 9)
+
+    def test_resolver_restore_plan_for_long_chains(self):
+        # longer than the recursion limit
+        length = sys.getrecursionlimit() + 100
+        root = FKtoSelf.objects.create(pk=1, self_relation_id=1)
+        chain = [root]
+        for position in range(length - 1):
+            chain.append(FKtoSelf.objects.create(self_relation=chain[-1]))
+        save_revision(chain, follow=False)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {0}'.format(FKtoSelf._meta.db_table))
+
+        version = get_version_for_object(chain[-1])
+        with CaptureQueriesContext(connection) as context:
+            result = RevisionConflictResolver(version).resolve()
+        # versions are fetched and deleted objects looked up in bulk, not
+        # once per object
+        self.assertLessEqual(len(context), 3 * (length // 500 + 1) + 1)
+        # every object is restored after the object it relates to
+        self.assertEqual([version.object_id_int for version in result],
+                         [obj.pk for obj in chain])
+
+    def test_revision_index(self):
+        complex_fk_version = get_version_for_object(self.complex_one_fk)
+        revision = complex_fk_version.revision
+        self.with_placeholder.content.delete()
+        self.complex_one_fk.complex_content.delete()
+        self.with_placeholder.delete()
+
+        with CaptureQueriesContext(connection) as context:
+            index = RevisionIndex(revision)
+            translations = get_indexed_translations_versions_for_object(
+                self.complex_one_fk, index)
+            conflicts = get_conflict_fks_versions(
+                self.complex_one_fk, complex_fk_version, revision,
+                index=index)
+            placeholders = get_deleted_placeholders_for_object(
+                self.complex_one_fk, revision, index)
+            resolver = RevisionConflictResolver(
+                complex_fk_version, index=index)
+            resolver.resolve()
+        self.assertEqual(resolver.get_indexes(), [index])
+        checked = dict(
+            (row.pk, deleted) for row, deleted in index.get_checked())
+        self.assertTrue(all(checked[item.pk] for item in conflicts))
+        self.assertEqual(len(translations), 2)
+        # deleted placeholders and the object with placeholder
+        self.assertEqual(len(conflicts), 3)
+        self.assertEqual(len(placeholders), 1)
+        # rows are loaded once, versions are fetched once per lookup
+        version_queries = [
+            query for query in context.captured_queries
+            if Version._meta.db_table in query['sql']]
+        self.assertTrue(len(version_queries) <= 5)
+        # and lookups are answered from memory afterwards
+        with self.assertNumQueries(0):
+            get_conflict_fks_versions(
+                self.complex_one_fk, complex_fk_version, revision,
+                index=index)
+            get_deleted_placeholders_for_object(
+                self.complex_one_fk, revision, index)
+
+    def test_model_metadata(self):
+        metadata = get_model_metadata(ComplexOneFK)
+        self.assertIs(metadata, get_model_metadata(ComplexOneFK))
+        self.assertEqual(metadata.placeholder_field_names, ['complex_content'])
+        self.assertEqual(metadata.translation_model,
+                         ComplexOneFK._parler_meta.root_model)
+        self.assertEqual(
+            set(relation['model'] for relation in metadata.fk_relations),
+            set([WithPlaceholder, Placeholder]))
+
+        # helpers read the metadata, which is introspected only once
+        get_fk_models(self.complex_one_fk)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_fk_models(self.complex_one_fk)), 2)
+            self.assertTrue(object_has_placeholders(self.complex_one_fk))
+        self.assertIn('fk_relations', metadata.__dict__)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test.utils import override_settings
+
+from reversion.revisions import default_revision_manager
+
+from cms.api import add_plugin
+
+from aldryn_reversion.test_helpers.project.test_app.models import (
+    SimpleRegistered, WithPlaceholder, WithTranslations,
+)
+
+from ..core import create_revision
+from ..formats import REFERENCE_FORMAT
+from .. import version_cache
+from ..utils import object_was_deleted
+from ..version_cache import clear, get_deserialized_objects, get_object_version
+
+from .base import ReversionBaseTestCase
+
+
+class VersionCacheTestCase(ReversionBaseTestCase):
+
+    def setUp(self):
+        super(VersionCacheTestCase, self).setUp()
+        clear()
+
+    def get_version(self, obj):
+        return default_revision_manager.get_for_object(obj)[0]
+
+    def test_versions_are_deserialized_once(self):
+        adapter = default_revision_manager.get_adapter(WithPlaceholder)
+        adapter.deduplicate_placeholder_plugins = True
+        try:
+            obj = WithPlaceholder.objects.create()
+            add_plugin(obj.content, 'TextPlugin', 'en', body='text')
+            create_revision(obj)
+            create_revision(obj)
+        finally:
+            del adapter.deduplicate_placeholder_plugins
+
+        # references load the referenced version when deserialized
+        reference = self.get_version(obj).revision.version_set.filter(
+            format=REFERENCE_FORMAT, content_type__model='text')[0]
+        with self.assertNumQueries(1):
+            get_object_version(reference)
+        with self.assertNumQueries(0):
+            text = get_object_version(reference).object
+        self.assertEqual(text.body, 'text')
+
+        # callers get copies
+        text.body = 'changed'
+        self.assertEqual(get_object_version(reference).object.body, 'text')
+
+    def test_copies_do_not_share_caches(self):
+        obj = WithTranslations.objects.create(description='english')
+        create_revision(obj)
+        version = self.get_version(obj)
+
+        translated = get_object_version(version).object
+        translated.set_current_language('de')
+        translated.description = 'deutsch'
+
+        other = get_object_version(version).object
+        self.assertNotIn('de', other._translations_cache[
+            other._parler_meta.root_model])
+
+    def test_changed_versions_are_deserialized_again(self):
+        obj = SimpleRegistered.objects.create(position=1)
+        create_revision(obj)
+        version = self.get_version(obj)
+        self.assertEqual(get_object_version(version).object.position, 1)
+
+        version.serialized_data = version.serialized_data.replace(
+            '"position": 1', '"position": 2')
+        self.assertEqual(get_object_version(version).object.position, 2)
+
+    @override_settings(ALDRYN_REVERSION_VERSION_CACHE_SIZE=1)
+    def test_cache_size(self):
+        versions = []
+        for position in range(2):
+            obj = SimpleRegistered.objects.create(position=position)
+            create_revision(obj)
+            versions.append(self.get_version(obj))
+        for version in versions:
+            get_deserialized_objects(version)
+
+        # the least recently used version was dropped
+        self.assertEqual(list(version_cache._versions), [versions[1].pk])
+
+    def test_object_was_deleted(self):
+        obj = SimpleRegistered.objects.create(position=1)
+        create_revision(obj)
+        version = self.get_version(obj)
+        with self.assertNumQueries(1):
+            self.assertFalse(object_was_deleted(version))
+        obj.delete()
+        self.assertTrue(object_was_deleted(version))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Batched refresh of the django-parler translations cache.
+
+Translations restored from a revision are not saved through their save_base
+method, which updates the translations cache, so they are cached by a
+post_save receiver (see TranslatableVersionAdapterMixin). Within
+batch_translation_cache() translations are only collected and written to
+the cache with one set_many (or deleted with one delete_many) at the end.
+"""
+from __future__ import unicode_literals
+
+import threading
+from contextlib import contextmanager
+
+# We would like this to not depend on Parler, but still support if it is
+# available.
+try:
+    from parler import appsettings, cache
+except ImportError:
+    cache = None
+
+_batch = threading.local()
+
+
+def _get_cache_key(translation):
+    return cache.get_translation_cache_key(
+        translation.__class__, translation.master_id,
+        translation.language_code)
+
+
+def _get_cache_values(translation):
+    values = {'id': translation.id}
+    for name in translation.get_translated_fields():
+        values[name] = getattr(translation, name)
+    return values
+
+
+def cache_translation(translation):
+    """
+    Writes translation to the translations cache, or collects it if a batch
+    is active.
+    """
+    translations = getattr(_batch, 'translations', None)
+    if translations is None:
+        cache._cache_translation(translation)
+    else:
+        translations.append(translation)
+
+
+def _flush(translations, delete=False):
+    if cache is None or not appsettings.PARLER_ENABLE_CACHING:
+        return
+    if not translations:
+        return
+    if delete:
+        cache.cache.delete_many(
+            [_get_cache_key(translation) for translation in translations])
+        return
+    # later saves of the same translation win
+    values = dict(
+        (_get_cache_key(translation), _get_cache_values(translation))
+        for translation in translations if translation.master_id is not None)
+    cache.cache.set_many(values, timeout=cache.DEFAULT_TIMEOUT)
+
+
+@contextmanager
+def batch_translation_cache(delete=False):
+    """
+    Collects translations cached within the block and writes them to the
+    cache with one set_many at the end, or deletes them with one delete_many
+    if delete is True. If the block fails, collected translations are
+    deleted from the cache. Nested batches are flushed by the outermost one.
+    """
+    if getattr(_batch, 'translations', None) is not None:
+        yield
+        return
+
+    _batch.translations = translations = []
+    try:
+        yield
+    except Exception:
+        _batch.translations = None
+        _flush(translations, delete=True)
+        raise
+    _batch.translations = None
+    _flush(translations, delete=delete)
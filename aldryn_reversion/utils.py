@@ -2,15 +2,31 @@
 
 from __future__ import unicode_literals
 
+from collections import OrderedDict, defaultdict, namedtuple
+
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.fields.related import ForeignKey
+from django.db.models import Count
 from django.utils.encoding import force_text
 from django.utils.translation import ugettext as _
 
+from reversion.models import Version
 from reversion.revisions import default_revision_manager
 
 from cms.models import CMSPlugin, Placeholder
-from cms.models.fields import PlaceholderField
+
+from .delta import (
+    get_manifest, get_manifest_versions, get_revision_versions,
+    uses_placeholder_deltas,
+)
+from .formats.reference import payloads_preloaded
+from .instrumentation import instrument
+from .metadata import get_model_metadata
+from .snapshot import get_snapshot_plugin_keys, uses_placeholder_snapshots
+from .version_cache import get_object_version
+
+
+VersionRow = namedtuple(
+    'VersionRow', ['pk', 'content_type_id', 'object_id', 'object_id_int'])
 
 
 def object_is_reversion_ready(obj):
@@ -59,17 +75,28 @@ def get_translations_versions_for_object(obj, revision, versions=None):
     Returns a queryset of translation versions for given object, if versions
     provided - performs lookup on them instead of revision.version_set.all().
     """
-    translatable = hasattr(obj, 'translations')
-    if not translatable:
+    translation_model = get_model_metadata(obj.__class__).translation_model
+    if translation_model is None:
         return []
 
     if versions is None:
         versions = revision.version_set.all()
     # get translations versions
-    translation_model = obj.translations.model
     translation_ct = ContentType.objects.get_for_model(translation_model)
-    translation_version = versions.filter(content_type=translation_ct)
-    return translation_version
+    return versions.filter(content_type=translation_ct)
+
+
+def get_indexed_translations_versions_for_object(obj, index):
+    """
+    Returns a list of translation versions for given object, looked up in
+    index (RevisionIndex of the revision).
+    """
+    translation_model = get_model_metadata(obj.__class__).translation_model
+    if translation_model is None:
+        return []
+
+    translation_ct = ContentType.objects.get_for_model(translation_model)
+    return index.get_versions(index.get_pks(translation_ct.pk))
 
 
 def get_fk_models(obj, blank=None):
@@ -80,51 +107,64 @@ def get_fk_models(obj, blank=None):
     :param blank: bool to filter relations by `blank` FK attrubute
     :return: list of tuples (FK model, fk.blank)
     """
-    fk_relations = []
-    for fk in obj._meta.fields:
-        # process only FK and subclasses
-        if not issubclass(type(fk), ForeignKey):
-            continue
-        if fk.blank == blank or blank is None:
-            relation = {
-                'fk_field': fk,
-                'model': fk.rel.to,
-                'content_type': ContentType.objects.get_for_model(fk.rel.to),
-                'blank': fk.blank,
-            }
-            fk_relations.append(relation)
-    return fk_relations
+    return get_model_metadata(obj.__class__).get_fk_relations(blank)
+
+
+def chunks(items, size=500):
+    """
+    Yields successive lists of at most size items, to keep the number of
+    query parameters within database limits.
+    """
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 
 def get_deleted_objects_versions(versions):
     """
     Returns a list of version for deleted objects in given versions queryset.
-    Performs excluding on versions queryset if exclude dictionary
-    {field_name: value, ...} is provided.
+    Checks which objects still exist with one query per model (per chunk of
+    object ids), without deserializing versions.
     """
-    deleted_versions = []
+    versions = list(versions)
+    object_ids_by_content_type = defaultdict(set)
     for version in versions:
-        if object_was_deleted(version):
-            deleted_versions.append(version)
-    return deleted_versions
+        object_ids_by_content_type[version.content_type_id].add(
+            version.object_id)
+
+    existing = set()
+    for content_type_id, object_ids in object_ids_by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            # model is gone, all its objects are considered deleted
+            continue
+        pk_field = model._meta.pk
+        for object_ids_chunk in chunks(object_ids):
+            pks = model._default_manager.filter(
+                pk__in=[pk_field.to_python(object_id)
+                        for object_id in object_ids_chunk],
+            ).values_list('pk', flat=True)
+            existing.update(
+                (content_type_id, force_text(pk)) for pk in pks)
+
+    return [version for version in versions
+            if (version.content_type_id, version.object_id) not in existing]
 
 
 def object_was_deleted(version):
-    if version.object is None:
-        # if there is no relation to object - it is delted
-        return True
-    # in case if GenericKey relation is broken, or object was takem
-    # from cache - try to perform DB lookup. This will/should always hit db.
-    # get object model class to access database for lookup
-    check_obj_model = version.object._meta.model
-    # if there is a match - object exists and we don't need to
-    # restore it
-    if check_obj_model.objects.filter(pk=version.object_id).count() == 0:
+    content_type = ContentType.objects.get_for_id(version.content_type_id)
+    model = content_type.model_class()
+    if model is None:
+        # model is gone, the object is considered deleted
         return True
-    return False
+    # one existence query, without fetching the object through the generic
+    # relation of the version
+    return not model._default_manager.filter(
+        pk=model._meta.pk.to_python(version.object_id)).exists()
 
 
-def get_conflict_fks_versions(obj, version, revision, exclude=None):
+def get_conflict_fks_versions(obj, version, revision, exclude=None,
+                              index=None):
     """
     Lookup for deleted FKs for obj, expects version to be obj
     version from the same revision.
@@ -133,46 +173,81 @@ def get_conflict_fks_versions(obj, version, revision, exclude=None):
     Returns versions for deleted fks.
     """
     # TODO: get all conflicts, return a tuple/dict with required and not.
+    if index is None:
+        index = RevisionIndex(revision)
     fk_relations = get_fk_models(obj)
     versions_to_check = []
     for relation in fk_relations:
-        found_versions = revision.version_set.exclude(
-            pk=version.pk).filter(content_type=relation['content_type'])
-        versions_to_check += list(found_versions.values_list('pk', flat=True))
-
-    # convert to versions queryset instead of a list
-    versions_to_check_qs = revision.version_set.filter(pk__in=versions_to_check)
-
-    if exclude is not None:
-        versions_to_check_qs = versions_to_check_qs.exclude(**exclude)
-
-    conflict_fks_versions = get_deleted_objects_versions(
-        versions_to_check_qs)
-    return conflict_fks_versions
+        versions_to_check += index.get_pks(
+            relation['content_type'].pk, exclude={'pk': version.pk})
+    versions_to_check = index.exclude(versions_to_check, exclude)
+    return index.get_versions(index.get_deleted_pks(versions_to_check))
 
 
 def object_has_placeholders(obj):
     """
     Returns True if given object has placeholder fields, False otherwise.
     """
-    return PlaceholderField in [type(field)
-                                for field in obj._meta.fields]
+    return bool(get_placeholder_fields_names(obj))
 
 
 def get_placeholder_fields_names(obj):
-    return [field.name for field in obj._meta.fields
-            if type(field) == PlaceholderField]
+    return get_model_metadata(obj.__class__).placeholder_field_names
 
 
-def get_deleted_placeholders(revision):
+def get_deleted_placeholders(revision, index=None):
     """
     Lookup for deleted placeholders for given revision
     """
+    if index is None:
+        index = RevisionIndex(revision)
     placeholder_ct = ContentType.objects.get_for_model(Placeholder)
-    placeholder_versions = revision.version_set.filter(
-        content_type=placeholder_ct)
-    deleted_placeholders = get_deleted_objects_versions(placeholder_versions)
-    return deleted_placeholders
+    return index.get_versions(
+        index.get_deleted_pks(index.get_pks(placeholder_ct.pk)))
+
+
+def get_placeholders_plugins_versions(placeholder_versions, revision,
+                                      index=None):
+    """
+    Returns versions of plugins (base plugins and plugin instances) which
+    belong to given placeholder versions of a revision, including plugins of
+    delta encoded placeholders stored in previous revisions.
+    """
+    placeholder_ct_id = ContentType.objects.get_for_model(Placeholder).pk
+    placeholder_versions = [version for version in placeholder_versions
+                            if version.content_type_id == placeholder_ct_id]
+    if not placeholder_versions:
+        return []
+    if index is None:
+        index = RevisionIndex(revision)
+
+    candidates = []
+    for content_type_id, pks in index.pks_by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is not None and issubclass(model, CMSPlugin):
+            candidates += index.get_versions(pks)
+    for placeholder_version in placeholder_versions:
+        manifest = get_manifest(placeholder_version)
+        if manifest is not None:
+            candidates += get_manifest_versions(placeholder_version, manifest)
+
+    plugin_ct_id = ContentType.objects.get_for_model(CMSPlugin).pk
+    placeholder_ids = set(
+        version.object_id_int for version in placeholder_versions)
+    with payloads_preloaded(candidates):
+        plugin_ids = set(
+            version.object_id for version in candidates
+            if version.content_type_id == plugin_ct_id and
+            get_object_version(version).object.placeholder_id in
+            placeholder_ids)
+
+    result = []
+    known = set()
+    for version in candidates:
+        if version.object_id in plugin_ids and version.pk not in known:
+            known.add(version.pk)
+            result.append(version)
+    return result
 
 
 def get_placeholders_from_obj(obj):
@@ -181,13 +256,13 @@ def get_placeholders_from_obj(obj):
     return Placeholder.objects.filter(pk__in=placeholders_pks)
 
 
-def get_deleted_placeholders_for_object(obj, revision):
+def get_deleted_placeholders_for_object(obj, revision, index=None):
     """
     Return deleted placeholders for object given
     """
     if object_has_placeholders(obj):
 
-        placeholders_versions = get_deleted_placeholders(revision)
+        placeholders_versions = get_deleted_placeholders(revision, index)
         # add only placeholders that belong to this object,
         # accessing field_name itself refers to deleted object, but _id isn't.
         # Other approach would be to load object_repr and get data from there
@@ -210,17 +285,54 @@ def exclude_resolved(to_exclude, objects):
     return [item for item in objects if item not in to_exclude]
 
 
-def sync_placeholder_version_plugins(obj, version):
+def get_revision_summary(revision):
+    """
+    Returns a list of (content type, number of versions) tuples for versions
+    of revision, ordered by content type name. Counts are fetched with one
+    aggregate query, content types from the content types cache.
+    """
+    counts = Version.objects.filter(
+        revision_id=getattr(revision, 'pk', revision),
+    ).values_list('content_type').annotate(count=Count('pk')).order_by()
+    summary = [(ContentType.objects.get_for_id(content_type_id), count)
+               for content_type_id, count in counts]
+    return sorted(summary, key=lambda item: force_text(item[0].name))
+
+
+def sync_placeholder_version_plugins(obj, version, index=None,
+                                     versions=None):
+    """
+    Removes plugins from placeholders of obj, which are not part of the
+    revision of version. If versions (as returned by get_revision_versions)
+    are provided - uses them instead of looking up the revision.
+    """
+    with instrument('sync_placeholder_version_plugins', obj) as recorder:
+        recorder.versions += len(_sync_placeholder_version_plugins(
+            obj, version, index, versions))
+
+
+def _sync_placeholder_version_plugins(obj, version, index, versions):
     plugin_c_type_id = ContentType.objects.get_for_model(CMSPlugin).pk
     placeholders = get_placeholders_from_obj(obj).values_list('pk', flat=True)
 
-    # Get all versions that belong to the same revision as
-    # the given version object.
-    related_versions = version.revision.version_set.iterator()
-
     # List of all plugin ids in this revision
-    plugin_ids = [v.object_id for v in related_versions
-                  if v.content_type_id == plugin_c_type_id]
+    if versions is None and (uses_placeholder_deltas(obj.__class__) or
+                             uses_placeholder_snapshots(obj.__class__)):
+        # Include plugins of delta encoded placeholders that are stored in
+        # previous revisions, and plugins of placeholder snapshots.
+        versions = get_revision_versions(version.revision)
+    if versions is not None:
+        plugin_ids = [v.object_id for v in versions
+                      if v.content_type_id == plugin_c_type_id]
+        for v in versions:
+            plugin_ids += [object_id for content_type_id, object_id
+                           in get_snapshot_plugin_keys(v) or []
+                           if content_type_id == plugin_c_type_id]
+    else:
+        if index is None:
+            index = RevisionIndex(version.revision_id)
+        plugin_ids = [index.rows[pk].object_id
+                      for pk in index.get_pks(plugin_c_type_id)]
 
     # Remove plugins that are not part of the revision.
     old_plugins = (
@@ -230,68 +342,252 @@ def sync_placeholder_version_plugins(obj, version):
         .exclude(pk__in=plugin_ids)
     )
     old_plugins.delete()
+    return plugin_ids
 
 
-class RecursiveRevisionConflictResolver(object):
+class RevisionIndex(object):
+    """
+    In-memory index of versions of a revision.
 
-    def __init__(self, version, to_resolve=None, exclude=None):
-        self.resolved = []
-        self.version = version
-        if to_resolve is None:
-            self.to_resolve = []
-        else:
-            self.to_resolve = to_resolve
-        if exclude is not None:
-            self.initial_exclude = exclude
-        else:
-            self.initial_exclude = []
+    Loads (pk, content_type_id, object_id, object_id_int) of all versions of
+    the revision with one query and answers lookups by content type and
+    object from dictionaries. Versions themselves are fetched only when
+    needed, and only once, so do the checks for deleted objects.
+    """
 
-    def _update_resolved(self, versions):
+    def __init__(self, revision):
+        self.revision_id = getattr(revision, 'pk', revision)
+        rows = Version.objects.filter(
+            revision_id=self.revision_id,
+        ).order_by('pk').values_list(*VersionRow._fields)
+
+        self.rows = OrderedDict()
+        self.pks_by_content_type = defaultdict(list)
+        self.pks_by_key = {}
+        for row in rows:
+            row = VersionRow(*row)
+            self.rows[row.pk] = row
+            self.pks_by_content_type[row.content_type_id].append(row.pk)
+            self.pks_by_key[(row.content_type_id, row.object_id)] = row.pk
+        self._versions = {}
+        self._deleted = {}
+
+    def get_pks(self, content_type_id=None, exclude=None):
         """
-        Update resolved versions.
-        :param versions:
-        :return:
+        Returns pks of versions of given content type (of all versions if
+        content_type_id is None). See exclude() for exclude.
         """
-        for version in versions:
-            if version not in self.resolved:
-                self.resolved.append(version)
-
-    def _update_to_resolve(self, other_conflicts):
-        for item in other_conflicts:
-            if item not in self.resolved and item not in self.initial_exclude:
-                self.to_resolve.append(item)
-
-    def resolve(self, version=None):
-
-        if version is None:
-            version = self.version
+        if content_type_id is None:
+            pks = list(self.rows)
+        else:
+            pks = list(self.pks_by_content_type.get(content_type_id, []))
+        return self.exclude(pks, exclude)
 
-        obj = version.object_version.object
-        revision = version.revision
+    def get_pk(self, content_type_id, object_id):
+        """
+        Returns pk of the version of given object, or None.
+        """
+        return self.pks_by_key.get((content_type_id, force_text(object_id)))
 
-        self._update_resolved([version])
+    def exclude(self, pks, exclude=None):
+        """
+        Excludes versions from pks. Expects exclude to be a dict of filter
+        string, value i.e {'pk': 1}, lookups other than pk and pk__in are
+        performed on the database.
+        """
+        if not exclude:
+            return pks
+        exclude = dict(exclude)
+        excluded = set(exclude.pop('pk__in', []))
+        if 'pk' in exclude:
+            excluded.add(exclude.pop('pk'))
+        pks = [pk for pk in pks if pk not in excluded]
+        if exclude and pks:
+            remaining = set(Version.objects.filter(
+                pk__in=pks).exclude(**exclude).values_list('pk', flat=True))
+            pks = [pk for pk in pks if pk in remaining]
+        return pks
+
+    def get_deleted_pks(self, pks):
+        """
+        Returns pks of versions of deleted objects among pks.
+        """
+        unknown = [self.rows[pk] for pk in pks if pk not in self._deleted]
+        if unknown:
+            deleted = set(
+                row.pk for row in get_deleted_objects_versions(unknown))
+            for row in unknown:
+                self._deleted[row.pk] = row.pk in deleted
+        return [pk for pk in pks if self._deleted[pk]]
+
+    def get_checked(self):
+        """
+        Returns a list of (row, deleted) tuples for versions which were
+        checked for deleted objects so far (see get_deleted_pks).
+        """
+        return [(self.rows[pk], deleted)
+                for pk, deleted in self._deleted.items()]
 
-        other_conflicts = get_conflict_fks_versions(obj, version, revision)
+    def get_versions(self, pks=None):
+        """
+        Returns versions for given pks (for all versions if pks is None),
+        fetching those which were not fetched yet.
+        """
+        if pks is None:
+            pks = list(self.rows)
+        missing = [pk for pk in pks if pk not in self._versions]
+        for pks_chunk in chunks(missing):
+            for version in Version.objects.filter(pk__in=pks_chunk):
+                self._versions[version.pk] = version
+        return [self._versions[pk] for pk in pks if pk in self._versions]
 
-        deleted_placeholders = get_deleted_placeholders_for_object(obj,
-                                                                   revision)
-        if deleted_placeholders:
-            self._update_resolved(deleted_placeholders)
 
-        # check for translations
-        translatable = hasattr(obj, 'translations')
-        if translatable:
-            translation_versions = get_translations_versions_for_object(
-                obj, revision)
-            self._update_resolved(translation_versions)
+class RevisionConflictResolver(object):
+    """
+    Resolves versions which have to be restored together with a version:
+    deleted objects its foreign keys point to (recursively), and translations.
+    Deleted placeholders are resolved as foreign keys as well.
+
+    Each revision is indexed once (see RevisionIndex): its versions are
+    fetched, the foreign keys of its objects collected and deleted objects
+    looked up in bulk, before its dependency graph is walked. The graph is
+    walked iteratively, so that long chains (i.e. objects with relation to
+    self) do not hit the recursion limit. resolve() returns a restore plan:
+    every version comes after the versions it depends on, translations come
+    after the translated object.
+    """
 
-        # recalculate to resolve.
-        self._update_to_resolve(other_conflicts)
+    def __init__(self, version, to_resolve=None, exclude=None, index=None):
+        self.version = version
+        self.to_resolve = list(to_resolve or [])
+        self.initial_exclude = set(item.pk for item in exclude or [])
+        self._indexes = {}
+        self._graphs = {}
+        if index is not None:
+            self._indexes[index.revision_id] = index
+
+    def get_indexes(self):
+        """
+        Returns indexes of all revisions resolved so far (see RevisionIndex),
+        including the index the resolver was created with.
+        """
+        return list(self._indexes.values())
 
-        # recursion, we have everything we need
-        if self.to_resolve:
-            self.resolve(self.to_resolve.pop(0))
+    def _get_graph(self, revision_id):
+        """
+        Returns a tuple ({version pk: pks of versions of deleted objects its
+        foreign keys point to}, {(content type id, object id): pks of its
+        translation versions}) for given revision.
+        """
+        graph = self._graphs.get(revision_id)
+        if graph is None:
+            index = self._indexes.get(revision_id)
+            if index is None:
+                index = self._indexes[revision_id] = RevisionIndex(
+                    revision_id)
+            graph = self._graphs[revision_id] = self._build_graph(index)
+        return graph
+
+    def _build_graph(self, index):
+        masters = {}
+        for content_type_id in index.pks_by_content_type:
+            model = ContentType.objects.get_for_id(
+                content_type_id).model_class()
+            translation_model = (
+                model and get_model_metadata(model).translation_model)
+            if translation_model is not None:
+                translation_ct_id = ContentType.objects.get_for_model(
+                    translation_model).pk
+                masters[translation_ct_id] = content_type_id
+
+        targets = {}
+        translations = defaultdict(list)
+        versions = index.get_versions()
+        with payloads_preloaded(versions):
+            objs = [get_object_version(version).object for version in versions]
+        for version, obj in zip(versions, objs):
+            if version.content_type_id in masters:
+                key = (masters[version.content_type_id],
+                       force_text(obj.master_id))
+                translations[key].append(version.pk)
+                continue
+            targets[version.pk] = []
+            for relation in get_fk_models(obj):
+                value = getattr(obj, relation['fk_field'].attname)
+                if value is None:
+                    continue
+                pk = index.get_pk(relation['content_type'].pk, value)
+                if pk is not None and pk != version.pk:
+                    targets[version.pk].append(pk)
+
+        # one lookup of deleted objects for the whole revision
+        deleted = set(index.get_deleted_pks(
+            set(pk for pks in targets.values() for pk in pks)))
+        dependencies = dict(
+            (version_pk, [pk for pk in pks if pk in deleted])
+            for version_pk, pks in targets.items())
+        return dependencies, translations
+
+    def get_dependencies(self, version):
+        """
+        Returns a tuple (versions to restore before given version, versions
+        of its translations to restore after it).
+        """
+        dependencies, translations = self._get_graph(version.revision_id)
+        index = self._indexes[version.revision_id]
+        before = index.get_versions(dependencies.get(version.pk, []))
+        after = index.get_versions(translations.get(
+            (version.content_type_id, version.object_id), []))
+        return before, after
+
+    def resolve(self):
+        with instrument('RevisionConflictResolver.resolve',
+                        self.version) as recorder:
+            plan = self._resolve()
+            recorder.add_versions(plan)
+        return plan
+
+    def _resolve(self):
+        plan = []
+        visited = set()
+        translations = {}
+
+        for root in [self.version] + self.to_resolve:
+            if root.pk in visited:
+                continue
+            visited.add(root.pk)
+            stack = [(root, None)]
+
+            while stack:
+                version, pending = stack[-1]
+                if pending is None:
+                    before, after = self.get_dependencies(version)
+                    pending = iter(before)
+                    stack[-1] = (version, pending)
+                    translations[version.pk] = after
+
+                for dependency in pending:
+                    if (dependency.pk not in visited and
+                            dependency.pk not in self.initial_exclude):
+                        visited.add(dependency.pk)
+                        stack.append((dependency, None))
+                        break
+                else:
+                    stack.pop()
+                    plan.append(version)
+                    for translation in translations.pop(version.pk):
+                        if translation.pk not in visited:
+                            visited.add(translation.pk)
+                            plan.append(translation)
+        return plan
+
+
+class RecursiveRevisionConflictResolver(RevisionConflictResolver):
+    """
+    Kept for backwards compatibility, use RevisionConflictResolver.
+    """
 
-        # base case
-        if not self.to_resolve:
-            return self.resolved
+    def resolve(self, version=None):
+        if version is not None:
+            self.version = version
+        return super(RecursiveRevisionConflictResolver, self).resolve()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded LRU cache of deserialized versions, per process.
+
+Deserializing a version parses (and possibly decompresses or resolves) its
+serialized data, which the revision and recover views, the conflict resolver
+and the restore path would otherwise do again for every access of
+Version.object_version. Entries are keyed by version pk and are only used
+while the serialized data of the version is the same. Callers get copies of
+the cached objects, which they are free to change and save.
+"""
+from __future__ import unicode_literals
+
+import copy
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.base import DeserializedObject
+from django.utils.encoding import force_text
+
+_versions = OrderedDict()
+_lock = threading.Lock()
+
+
+def _get_size():
+    return getattr(settings, 'ALDRYN_REVERSION_VERSION_CACHE_SIZE', 1000)
+
+
+def _copy(deserialized):
+    obj = deserialized.object
+    obj_copy = obj.__class__.__new__(obj.__class__)
+    # mutable values, like the translations cache of parler, must not be
+    # shared between copies
+    obj_copy.__dict__ = copy.deepcopy(obj.__dict__)
+    m2m_data = deserialized.m2m_data
+    if m2m_data is not None:
+        m2m_data = dict(
+            (name, list(values)) for name, values in m2m_data.items())
+    return DeserializedObject(obj_copy, m2m_data)
+
+
+def _deserialize(version):
+    return list(serializers.deserialize(
+        version.format, force_text(version.serialized_data),
+        ignorenonexistent=True))
+
+
+def is_cached(version):
+    """
+    Returns True if given version is deserialized already.
+    """
+    with _lock:
+        entry = _versions.get(version.pk)
+    return (entry is not None and
+            entry[0] == (version.format, version.serialized_data))
+
+
+def get_deserialized_objects(version):
+    """
+    Returns copies of all objects deserialized from given version (the
+    object, or the placeholder and its plugins for snapshots), as
+    DeserializedObject instances.
+    """
+    with _lock:
+        entry = _versions.pop(version.pk, None)
+        if entry is not None:
+            _versions[version.pk] = entry
+    if entry is None or entry[0] != (version.format, version.serialized_data):
+        entry = ((version.format, version.serialized_data),
+                 _deserialize(version))
+        if version.pk is not None:
+            with _lock:
+                _versions[version.pk] = entry
+                size = _get_size()
+                while len(_versions) > size:
+                    _versions.popitem(last=False)
+    return [_copy(deserialized) for deserialized in entry[1]]
+
+
+def get_object_version(version):
+    """
+    Returns the DeserializedObject of given version, like
+    Version.object_version.
+    """
+    return get_deserialized_objects(version)[0]
+
+
+def clear():
+    with _lock:
+        _versions.clear()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sys
+
+
+def run():
+    from djangocms_helper import runner
+
+    import test_settings
+    runner.setup('aldryn_reversion', test_settings, use_cms=True)
+
+    from aldryn_reversion.test_helpers.benchmarks import main
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()